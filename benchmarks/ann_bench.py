@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""Speed/recall trade-off of the approximate spectral search (see kpl_library.SpectraMatrix.approximate).
+
+For each library size and search window, the peaks of synthetic exports (see chromatof.py) are scored against the
+records of their search windows, once exactly (key ion pruning only) and once with the approximate search for each
+requested recall. Reported are the throughput (peaks per second), the share of the window records which were scored,
+and the measured recall: matches above the cutoff found by the approximate search out of those found by the exact
+search, for all matches and for the matches close to the cutoff (similarity up to cutoff + 5).
+
+    python benchmarks/ann_bench.py --sizes 10000 50000 --recalls 0.8 0.9 0.99 --bands 50 200
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import chromatof
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CUTOFF = 90
+
+
+def measure(library, peaks: list, band: float) -> tuple[dict, list]:
+    """
+    Score all peaks against their search windows.
+
+    :param library: library (with or without the approximate search)
+    :param peaks: list of (1st RT, 2nd RT, spectrum)
+    :param band: half-width of the window in the first dimension
+    :returns: throughput and share of scored records, list of scores of each peak
+    """
+    windows = [library.rt_index.window(first_rt, second_rt, first_band=band) for first_rt, second_rt, _ in peaks]
+    scores, scored = [], 0
+    start = time.perf_counter()
+    for (_, _, spectrum), rows in zip(peaks, windows):
+        result, kept = library.score_pruned(spectrum, rows, CUTOFF)
+        scores.append(result)
+        scored += int(kept.sum())
+    seconds = time.perf_counter() - start
+    candidates = sum(len(rows) for rows in windows)
+    return {"peaks_per_s": len(peaks) / seconds, "candidates": candidates,
+            "scored": scored / candidates if candidates else 0.0}, scores
+
+
+def recall(exact: list, approximate: list) -> tuple[float, float, int]:
+    """
+    Share of the exact matches found by the approximate search.
+
+    :param exact: scores of the exact search
+    :param approximate: scores of the approximate search
+    :returns: recall of all matches, recall of the matches close to the cutoff and the number of such matches
+    """
+    found = total = close_found = close_total = 0
+    for reference, result in zip(exact, approximate):
+        matches = reference > CUTOFF
+        close = matches & (reference <= CUTOFF + 5)
+        total += int(matches.sum())
+        found += int((matches & (result > CUTOFF)).sum())
+        close_total += int(close.sum())
+        close_found += int((close & (result > CUTOFF)).sum())
+    return (found / total if total else float("nan"), close_found / close_total if close_total else float("nan"),
+            close_total)
+
+
+def main() -> int:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description="Speed/recall trade-off of the approximate spectral search.")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10000, 50000],
+                        help="library sizes (default: %(default)s)")
+    parser.add_argument("--recalls", nargs="+", type=float, default=[0.8, 0.9, 0.95, 0.99],
+                        help="requested recalls at the cutoff (default: %(default)s)")
+    parser.add_argument("--bands", nargs="+", type=float, default=[50, 200],
+                        help="half-widths of the window in the first dimension in s (default: %(default)s)")
+    parser.add_argument("--bits", type=int, default=12, help="hash bits in each table (default: 12)")
+    parser.add_argument("--files", type=int, default=2, help="exports (default: 2)")
+    parser.add_argument("--peaks", type=int, default=500, help="peaks per export (default: 500)")
+    parser.add_argument("--noise", type=float, default=0.1, help="relative intensity noise (default: 0.1)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generator (default: 0)")
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    import helper
+    import kpl_ingest
+    results = []
+    with tempfile.TemporaryDirectory() as work:
+        shutil.copy(os.path.join(ROOT, "kpl", "config.txt"), work)
+        os.chdir(work)
+        for size in args.sizes:
+            paths = chromatof.write_exports("exports", args.files, args.peaks, size, noise=args.noise, seed=args.seed)
+            peaks = []
+            for path in paths:
+                df = kpl_ingest.read_export(path, columns=kpl_ingest.MATCH_COLUMNS)
+                spectra = helper.parse_spectra(df["Spectra"])
+                peaks += [(float(df.at[row, "1st Dimension Time (s)"]), float(df.at[row, "2nd Dimension Time (s)"]),
+                           helper.spectrum_at(spectra, row)) for row in df.index]
+            library = chromatof.make_library(chromatof.make_compounds(0, size, args.seed))
+            library.score_pruned({}, [], CUTOFF)
+            exact = {}
+            for band in args.bands:
+                exact[band] = measure(library, peaks, band)
+                results.append({"library": size, "band": band, "recall_target": None, **exact[band][0]})
+                print(f"{size:>8} ±{band:<5g} exact        {exact[band][0]['peaks_per_s']:>9.1f} peaks/s  "
+                      f"{exact[band][0]['candidates'] / len(peaks):>8.1f} candidates/peak  "
+                      f"{exact[band][0]['scored']:>6.1%} scored")
+            for target in args.recalls:
+                start = time.perf_counter()
+                library.approximate(target, CUTOFF, args.bits)
+                build = time.perf_counter() - start
+                for band in args.bands:
+                    result, scores = measure(library, peaks, band)
+                    found, close, close_total = recall(exact[band][1], scores)
+                    results.append({"library": size, "band": band, "recall_target": target,
+                                    "tables": library.spectra.ann["tables"], "build_s": build, **result,
+                                    "recall": found, "recall_close": close, "matches_close": close_total,
+                                    "speedup": result["peaks_per_s"] / exact[band][0]["peaks_per_s"]})
+                    print(f"{size:>8} ±{band:<5g} recall {target:<5g} {result['peaks_per_s']:>9.1f} peaks/s  "
+                          f"{library.spectra.ann['tables']:>3} tables  {result['scored']:>6.1%} scored  "
+                          f"speed-up {results[-1]['speedup']:5.2f}x  recall {found:.4f} "
+                          f"(close to cutoff {close:.4f} of {close_total})")
+        os.chdir(ROOT)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"machine": platform.platform(), "python": platform.python_version(), "bits": args.bits,
+                       "results": results}, file, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""Seeded generator of synthetic ChromaTOF exports and kpl libraries for benchmarks.
+
+Compounds are drawn from a seeded random "universe" (name, retention times in both dimensions and an electron
+ionization like spectrum). A library is built from the first compounds of the universe, the exports contain peaks of
+library compounds (the overlap) and of compounds which are not in the library, with retention time drift and intensity
+noise, written in the tab separated format of the LECO ChromaTOF export.
+
+    python benchmarks/chromatof.py exports --files 10 --peaks 500 --library 1000 --overlap 0.8 --drift 2
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "kpl"))
+sys.path.insert(0, os.path.join(ROOT, "common"))
+
+from kpl_library import KPLLibrary  # noqa: E402
+
+HEADER = ["Name", "1st Dimension Time (s)", "2nd Dimension Time (s)", "Spectra", "Area", "Height"]
+FIRST_RT = (200.0, 3000.0)
+SECOND_RT = (0.5, 5.0)
+MASSES = (15, 500)
+
+
+def make_compounds(start: int, count: int, seed: int = 0, ions: tuple = (10, 40)) -> list:
+    """
+    Generate compounds of the universe. The compound number i is always the same for the same seed.
+
+    :param start: number of the first compound
+    :param count: number of compounds
+    :param seed: seed of the universe
+    :param ions: minimal and maximal number of ions in the spectrum
+    :returns: list of (name, 1st RT, 2nd RT, {m/z: intensity})
+    """
+    compounds = []
+    for number in range(start, start + count):
+        rng = np.random.default_rng([seed, number])
+        masses = np.sort(rng.choice(np.arange(*MASSES), size=int(rng.integers(*ions, endpoint=True)), replace=False))
+        intensities = np.round(rng.pareto(1.5, size=len(masses)) * 1000 + 10)
+        intensities = np.round(intensities / intensities.max() * 9999)
+        compounds.append((f"Compound {number}", float(rng.uniform(*FIRST_RT)), float(rng.uniform(*SECOND_RT)),
+                          dict(zip(masses.tolist(), intensities.tolist()))))
+    return compounds
+
+
+def make_library(compounds: list) -> KPLLibrary:
+    """
+    Build a library with one record for each compound (records are flushed to the DataFrame).
+
+    :param compounds: compounds from make_compounds
+    :returns: library
+    """
+    library = KPLLibrary()
+    for name, first_rt, second_rt, spectrum in compounds:
+        spectrum = {mass: value for mass, value in spectrum.items() if mass >= 31}
+        library.add_record({"Codename": library.new_codename(), "1st RT": first_rt, "2nd RT": second_rt,
+                            "Spectra": spectrum, "Found": ["library"], "Name": name.encode("utf-8"),
+                            "calc_1stRT": [first_rt], "calc_2ndRT": [second_rt],
+                            "calc_spectra": {mass: [value] for mass, value in spectrum.items()}})
+    library.flush()
+    return library
+
+
+def make_export(library_size: int, peaks: int, overlap: float = 0.8, drift: float = 2.0, noise: float = 0.1,
+                seed: int = 0, file: int = 0, ions: tuple = (10, 40)) -> list:
+    """
+    Generate lines of one export.
+
+    :param library_size: number of compounds in the library (the first compounds of the universe)
+    :param peaks: number of peaks in the export
+    :param overlap: fraction of the peaks which are library compounds
+    :param drift: standard deviation of the retention time drift in the first dimension (s), the second dimension drifts
+    by a hundredth of it
+    :param noise: relative noise of the intensities
+    :param seed: seed of the universe
+    :param file: number of the export (seed of the sampling)
+    :param ions: minimal and maximal number of ions in the spectrum
+    :returns: lines of the export including the header
+    """
+    rng = np.random.default_rng([seed, 1 << 30, file])
+    known = int(round(peaks * overlap)) if library_size else 0
+    numbers = rng.choice(library_size, size=min(known, library_size), replace=False).tolist() if known else []
+    numbers += (library_size + rng.choice(10 * peaks, size=peaks - len(numbers), replace=False)).tolist()
+    shift = rng.normal(0, drift)
+    lines = ["\t".join(HEADER)]
+    for number in numbers:
+        name, first_rt, second_rt, spectrum = make_compounds(number, 1, seed, ions)[0]
+        values = np.array(list(spectrum.values())) * rng.uniform(1 - noise, 1 + noise, size=len(spectrum))
+        text = " ".join(f"{mass}:{value:.0f}" for mass, value in zip(spectrum, values))
+        first = first_rt + shift + rng.normal(0, drift / 2)
+        second = second_rt + (shift + rng.normal(0, drift / 2)) / 100
+        lines.append(f"{name}\t{first:.1f}\t{second:.3f}\t{text}\t{int(rng.integers(1e3, 1e7))}\t"
+                     f"{int(rng.integers(1e2, 1e6))}")
+    return lines
+
+
+def write_exports(folder: str, files: int, peaks: int, library_size: int, overlap: float = 0.8, drift: float = 2.0,
+                  noise: float = 0.1, seed: int = 0, ions: tuple = (10, 40)) -> list:
+    """
+    Write the exports to the folder.
+
+    :param folder: output folder
+    :param files: number of exports
+    :param peaks: number of peaks in each export
+    :param library_size: number of compounds in the library
+    :param overlap: fraction of the peaks which are library compounds
+    :param drift: standard deviation of the retention time drift in the first dimension (s)
+    :param noise: relative noise of the intensities
+    :param seed: seed of the universe
+    :param ions: minimal and maximal number of ions in the spectrum
+    :returns: paths to the exports
+    """
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for file in range(files):
+        paths.append(f"{folder}{os.sep}sample_{file:04d}.txt")
+        with open(paths[-1], "w", encoding="latin-1") as f:
+            f.write("\n".join(make_export(library_size, peaks, overlap, drift, noise, seed, file, ions)) + "\n")
+    return paths
+
+
+def main() -> None:
+    """Write synthetic exports (and optionally the matching library)."""
+    parser = argparse.ArgumentParser(description="Generate synthetic ChromaTOF exports.")
+    parser.add_argument("folder", help="output folder")
+    parser.add_argument("--files", type=int, default=10, help="number of exports (default: 10)")
+    parser.add_argument("--peaks", type=int, default=500, help="peaks in each export (default: 500)")
+    parser.add_argument("--library", type=int, default=1000, help="compounds in the library (default: 1000)")
+    parser.add_argument("--overlap", type=float, default=0.8, help="fraction of library peaks (default: 0.8)")
+    parser.add_argument("--drift", type=float, default=2.0, help="1st dimension RT drift in s (default: 2)")
+    parser.add_argument("--noise", type=float, default=0.1, help="relative intensity noise (default: 0.1)")
+    parser.add_argument("--seed", type=int, default=0, help="seed (default: 0)")
+    parser.add_argument("--save-library", help="save the library of the exports to this path (.h5, .txt or .kplc)")
+    args = parser.parse_args()
+    write_exports(args.folder, args.files, args.peaks, args.library, args.overlap, args.drift, args.noise, args.seed)
+    if args.save_library:
+        make_library(make_compounds(0, args.library, args.seed)).save(args.save_library)
+
+
+if __name__ == "__main__":
+    main()
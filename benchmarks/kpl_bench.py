@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks of the kpl matching on synthetic ChromaTOF exports (see chromatof.py).
+
+Every scenario runs in a fresh process for each library size, the result is the throughput (items per second, the
+items are peaks, or spectrum pairs for compare_spectra) and the peak memory of the process. Results can be saved as a
+baseline and later runs compared to it (the script exits with 1 if a scenario got slower than the tolerance allows).
+
+    python benchmarks/kpl_bench.py --sizes 1000 10000 --json report.json
+    python benchmarks/kpl_bench.py --quick --save-baseline benchmarks/baselines/kpl_bench.json
+    python benchmarks/kpl_bench.py --quick --baseline benchmarks/baselines/kpl_bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import chromatof
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ["read_export", "transfer_spectrum", "parse_spectra", "compare_spectra", "get_foc_database",
+             "update_record", "process_files"]
+LIBRARY_INDEPENDENT = ["read_export", "transfer_spectrum", "parse_spectra"]
+SIZES = [1000, 10000, 50000, 200000]
+QUICK_SIZES = [1000, 10000]
+
+
+def read_exports(paths: list) -> list:
+    """Read the exports the same way the kpl engine does."""
+    import kpl_ingest
+    return [kpl_ingest.read_export(path) for path in paths]
+
+
+def peaks_of(frames: list) -> list:
+    """List of (1st RT, 2nd RT, spectrum, compound number) of all peaks."""
+    import helper
+    peaks = []
+    for df in frames:
+        spectra = helper.parse_spectra(df["Spectra"])
+        for row in df.index:
+            peaks.append((float(df.at[row, "1st Dimension Time (s)"]), float(df.at[row, "2nd Dimension Time (s)"]),
+                          helper.spectrum_at(spectra, row), int(df.at[row, "Name"].split(b" ")[-1])))
+    return peaks
+
+
+def run_scenario(scenario: str, size: int, args: argparse.Namespace) -> dict:
+    """
+    Set up and run one scenario in the current process.
+
+    :param scenario: name of the scenario
+    :param size: number of records in the library
+    :param args: benchmark parameters
+    :returns: number of processed items and setup and run time in seconds
+    """
+    import helper
+    import kpl_engine
+    import kpl_ingest
+
+    start = time.perf_counter()
+    paths = chromatof.write_exports("exports", args.files, args.peaks, size, args.overlap, args.drift, seed=args.seed)
+    library = chromatof.make_library(chromatof.make_compounds(0, size, args.seed)) if size else None
+
+    if scenario == "read_export":
+        setup = time.perf_counter() - start
+        start = time.perf_counter()
+        rows = sum(len(kpl_ingest.read_export(path)) for path in paths)
+        return {"items": rows, "setup": setup, "seconds": time.perf_counter() - start}
+
+    if scenario == "transfer_spectrum":
+        texts = [text for df in read_exports(paths) for text in df["Spectra"]]
+        setup = time.perf_counter() - start
+        start = time.perf_counter()
+        for text in texts:
+            helper.transfer_spectrum(text.split(" "), transform=False)
+        return {"items": len(texts), "setup": setup, "seconds": time.perf_counter() - start}
+
+    if scenario == "parse_spectra":
+        columns = [df["Spectra"] for df in read_exports(paths)]
+        setup = time.perf_counter() - start
+        start = time.perf_counter()
+        for column in columns:
+            helper.parse_spectra(column)
+        return {"items": sum(len(column) for column in columns), "setup": setup, "seconds": time.perf_counter() - start}
+
+    peaks = peaks_of(read_exports(paths))
+    if scenario == "compare_spectra":
+        pairs = []
+        for first_rt, second_rt, spectrum, _ in peaks:
+            query = helper.transform_spectrum(spectrum)
+            pairs += [(query, helper.transform_spectrum(library.get(row, "Spectra")))
+                      for row in library.window(first_rt, second_rt).tolist()]
+            if len(pairs) >= args.pairs:
+                break
+        pairs = pairs[:args.pairs]
+        setup = time.perf_counter() - start
+        start = time.perf_counter()
+        for query, record in pairs:
+            helper.compare_spectra(query, record)
+        return {"items": len(pairs), "setup": setup, "seconds": time.perf_counter() - start}
+
+    if scenario == "get_foc_database":
+        library.window(0, 0)
+        setup = time.perf_counter() - start
+        start = time.perf_counter()
+        for first_rt, second_rt, _, _ in peaks:
+            library.window(first_rt, second_rt)
+        return {"items": len(peaks), "setup": setup, "seconds": time.perf_counter() - start}
+
+    if scenario == "update_record":
+        hits = [(number, first_rt, second_rt, spectrum) for first_rt, second_rt, spectrum, number in peaks
+                if number < size]
+        library.window(0, 0)
+        library.score({}, [])
+        setup = time.perf_counter() - start
+        start = time.perf_counter()
+        for row, first_rt, second_rt, spectrum in hits:
+            library.update_record(row, first_rt, second_rt, spectrum, "bench")
+        return {"items": len(hits), "setup": setup, "seconds": time.perf_counter() - start}
+
+    if scenario == "process_files":
+        library.save("library.kplc")
+        os.makedirs("renamed", exist_ok=True)
+        setup = time.perf_counter() - start
+        start = time.perf_counter()
+        # the seeded exports would hit the cache of parsed exports of earlier runs
+        kpl_engine.KPLCompareEngine("exports", "renamed", args.processes, echo=lambda message: None, cache=False)\
+            .run("library.kplc", "updated.kplc")
+        return {"items": len(peaks), "setup": setup, "seconds": time.perf_counter() - start}
+    raise ValueError(f"Unknown scenario {scenario}.")
+
+
+def child(scenario: str, size: int, args: argparse.Namespace) -> None:
+    """Run the scenario in a temporary working folder and print the result as JSON."""
+    sys.path.insert(0, os.path.join(ROOT, "kpl"))
+    with tempfile.TemporaryDirectory() as work:
+        shutil.copy(os.path.join(ROOT, "kpl", "config.txt"), work)
+        os.chdir(work)
+        result = run_scenario(scenario, size, args)
+        os.chdir(ROOT)
+    if resource is not None:
+        scale = 1 if sys.platform == "darwin" else 1024
+        result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+    print(json.dumps(result))
+
+
+def measure(scenario: str, size: int, argv: list) -> dict:
+    """Run the scenario in a fresh process."""
+    command = [sys.executable, os.path.abspath(__file__), "--child", scenario, str(size)] + argv
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        return {"error": result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "failed"}
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    report["throughput"] = report["items"] / report["seconds"] if report["seconds"] else float("inf")
+    return report
+
+
+def compare(results: list, baseline: dict, tolerance: float) -> list:
+    """
+    Compare the results to the baseline.
+
+    :param results: results of this run
+    :param baseline: saved report
+    :param tolerance: allowed relative drop of the throughput
+    :returns: list of regressions
+    """
+    reference = {(item["scenario"], item["library"]): item for item in baseline["results"]}
+    regressions = []
+    for item in results:
+        base = reference.get((item["scenario"], item["library"]))
+        if base is None or "throughput" not in base or "throughput" not in item:
+            continue
+        ratio = item["throughput"] / base["throughput"]
+        print(f"{item['scenario']:<18} {item['library']:>8} {ratio:6.2f}x of baseline")
+        if ratio < 1 - tolerance:
+            regressions.append(f"{item['scenario']} ({item['library']} records): {ratio:.2f}x of baseline")
+    return regressions
+
+
+def main() -> int:
+    """Run the benchmarks."""
+    parser = argparse.ArgumentParser(description="Benchmarks of kpl matching on synthetic ChromaTOF exports.")
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS, help="scenarios to run")
+    parser.add_argument("--sizes", nargs="+", type=int, default=SIZES, help="library sizes (default: %(default)s)")
+    parser.add_argument("--quick", action="store_true", help=f"library sizes {QUICK_SIZES}")
+    parser.add_argument("--files", type=int, default=4, help="exports per run (default: 4)")
+    parser.add_argument("--peaks", type=int, default=500, help="peaks per export (default: 500)")
+    parser.add_argument("--overlap", type=float, default=0.8, help="fraction of library peaks (default: 0.8)")
+    parser.add_argument("--drift", type=float, default=2.0, help="1st dimension RT drift in s (default: 2)")
+    parser.add_argument("--pairs", type=int, default=20000, help="spectrum pairs of compare_spectra (default: 20000)")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes of process_files (default: 1)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the generator (default: 0)")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--save-baseline", help="write the report as a baseline to this file")
+    parser.add_argument("--baseline", help="compare the results to this baseline")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed throughput drop (default: 0.3)")
+    parser.add_argument("--child", nargs=2, metavar=("SCENARIO", "SIZE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child[0], int(args.child[1]), args)
+        return 0
+
+    argv = [f"--files={args.files}", f"--peaks={args.peaks}", f"--overlap={args.overlap}", f"--drift={args.drift}",
+            f"--pairs={args.pairs}", f"--processes={args.processes}", f"--seed={args.seed}"]
+    sizes = QUICK_SIZES if args.quick else args.sizes
+    results = []
+    for scenario in args.scenarios:
+        for size in [0] if scenario in LIBRARY_INDEPENDENT else sizes:
+            result = {"scenario": scenario, "library": size, **measure(scenario, size, argv)}
+            results.append(result)
+            if "error" in result:
+                print(f"{scenario:<18} {size:>8} error: {result['error']}")
+            else:
+                print(f"{scenario:<18} {size:>8} {result['throughput']:>12.1f} items/s  {result['items']:>7} items  "
+                      f"{result.get('peak_rss_mb', float('nan')):>8.1f} MB")
+    report = {"machine": platform.platform(), "python": platform.python_version(), "parameters": argv,
+              "results": results}
+    for path in (args.json, args.save_baseline):
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, "w") as file:
+                json.dump(report, file, indent=1)
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            baseline = json.load(file)
+        if baseline["parameters"] != argv:
+            print(f"Warning: the baseline was measured with different parameters {baseline['parameters']}.")
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
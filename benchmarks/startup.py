@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Cold-start benchmark of the main.py entry points.
+
+Each entry point is imported in a fresh interpreter (the GUI is not started), the wall time of the whole process and
+of the import itself is measured and the heavy dependencies loaded by the import are listed. The results are checked
+against the budget in startup_budget.json, the script exits with 1 if any entry point is over its budget.
+
+    python benchmarks/startup.py [--repeat 5] [--json startup_report.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "startup_budget.json")
+ENTRY_POINTS = {"kpl": "main", "kpl_cli": "kpl_cli", "data_processing": "main", "data_evaluation": "main"}
+PACKAGES = {"kpl_cli": "kpl"}
+HEAVY_MODULES = ["numpy", "pandas", "scipy", "sklearn", "seaborn", "matplotlib", "joblib", "tables"]
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{"import": time.perf_counter() - start,
+                  "heavy": [name for name in {heavy} if name in sys.modules]}}))
+"""
+
+
+def measure(entry: str, repeat: int) -> dict:
+    """
+    Measure cold start of one entry point.
+
+    :param entry: name of the entry point (see ENTRY_POINTS)
+    :param repeat: number of measured starts
+    :returns: median process and import time in seconds and the heavy modules loaded
+    """
+    probe = PROBE.format(module=ENTRY_POINTS[entry], heavy=HEAVY_MODULES)
+    cwd = os.path.join(ROOT, PACKAGES.get(entry, entry))
+    totals, imports, heavy = [], [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", probe], cwd=cwd, capture_output=True, text=True)
+        totals.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            return {"error": result.stderr.strip().splitlines()[-1]}
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+        imports.append(report["import"])
+        heavy = report["heavy"]
+    return {"total": statistics.median(totals), "import": statistics.median(imports), "heavy": heavy}
+
+
+def check(entry: str, result: dict, budget: dict) -> list:
+    """
+    Check the measured start against the budget.
+
+    :param entry: name of the entry point
+    :param result: result of measure
+    :param budget: budget of the entry point ({"seconds": max process time, "forbidden": [modules]})
+    :returns: list of budget violations
+    """
+    if "error" in result:
+        return [f"{entry}: import failed ({result['error']})"]
+    violations = []
+    if result["total"] > budget.get("seconds", float("inf")):
+        violations.append(f"{entry}: start took {result['total']:.3f} s, budget is {budget['seconds']:.3f} s")
+    loaded = sorted(set(result["heavy"]) & set(budget.get("forbidden", [])))
+    if loaded:
+        violations.append(f"{entry}: {', '.join(loaded)} imported at start")
+    return violations
+
+
+def main() -> int:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description="Cold-start benchmark of the main.py entry points.")
+    parser.add_argument("--repeat", type=int, default=5, help="number of measured starts (default: 5)")
+    parser.add_argument("--budget", default=BUDGET, help="budget file (default: benchmarks/startup_budget.json)")
+    parser.add_argument("--json", help="write the results to a JSON report")
+    args = parser.parse_args()
+    with open(args.budget, "r") as file:
+        budgets = json.load(file)
+
+    results, violations = {}, []
+    for entry in ENTRY_POINTS:
+        results[entry] = measure(entry, args.repeat)
+        violations += check(entry, results[entry], budgets.get(entry, {}))
+        if "error" in results[entry]:
+            print(f"{entry:<16} error: {results[entry]['error']}")
+        else:
+            print(f"{entry:<16} start {results[entry]['total']:.3f} s  import {results[entry]['import']:.3f} s  "
+                  f"heavy modules: {', '.join(results[entry]['heavy']) or '-'}")
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"python": sys.version.split()[0], "results": results, "violations": violations}, file,
+                      indent=2)
+    for violation in violations:
+        print(f"OVER BUDGET {violation}")
+    return 1 if violations else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""Content-addressed cache of parsed exports.
+
+The same ChromaTOF exports are read by several tools (kpl create, compare and search, the summary tables of data
+processing). The first read of an export stores its parsed columns in one binary file named by the sha256 hash of the
+export, so every later read of the same content, by any tool and under any file name, loads the columns instead of
+parsing the text. Numeric columns are stored as they are and text columns as utf-8 blobs with offsets. Further arrays
+derived from the export (e.g. the parsed spectra of kpl) can be stored with the columns.
+
+The tools parse with different encodings (kpl latin-1, data processing utf-8). An export whose parsed text is plain
+ASCII reads the same in any ASCII-compatible encoding, so its entry is named by the hash only and shared by all of
+them. Only exports with other characters get an entry for each encoding.
+
+    cache = ExportCache.default()
+    frame = cache.read(path, "utf-8", lambda file: pd.read_csv(file, sep="\\t", header=0, encoding="utf-8"))
+
+An edited export has a new hash, so it never hits a stale entry. Entries are replaced atomically. An entry that cannot
+be read (other format version, truncated file) counts as missing and is replaced. The cache folder is CHROM_CACHE
+(environment variable; an empty value disables the cache) or ~/.cache/2d_data_chrom. The least recently used entries are
+removed once the folder outgrows MAX_BYTES.
+"""
+import codecs
+import hashlib
+import json
+import os
+import zipfile
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+FORMAT_VERSION = 1
+MAX_BYTES = 4 << 30
+ENVIRONMENT = "CHROM_CACHE"
+_CHUNK = 1 << 20
+_ASCII = bytes(range(128))
+
+
+def file_hash(file: str) -> str:
+    """
+    Hash the content of the file.
+
+    :param file: path to the file
+    :returns: sha256 hex digest
+    """
+    digest = hashlib.sha256()
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def default_path() -> Optional[str]:
+    """
+    Folder of the cache shared by the tools.
+
+    :returns: CHROM_CACHE or ~/.cache/2d_data_chrom, None if CHROM_CACHE is empty (cache disabled)
+    """
+    path = os.environ.get(ENVIRONMENT)
+    if path is None:
+        return os.path.join(os.path.expanduser("~"), ".cache", "2d_data_chrom")
+    return path or None
+
+
+def ascii_compatible(encoding: str) -> bool:
+    """
+    Check whether the encoding reads ASCII text as ASCII does (utf-8 and latin-1 do, utf-16 does not).
+
+    :param encoding: name of the encoding
+    :returns: True if ASCII text decodes the same
+    """
+    try:
+        return _ASCII.decode(encoding) == _ASCII.decode("ascii")
+    except (LookupError, UnicodeDecodeError):
+        return False
+
+
+class ExportCache:
+    """Parsed exports stored by their content hash."""
+
+    def __init__(self, path: str, max_bytes: int = MAX_BYTES):
+        """
+        Initialize the cache, the folder is created with the first entry.
+
+        :param path: folder of the cache
+        :param max_bytes: size of the folder above which the least recently used entries are removed
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def default(cls) -> Optional["ExportCache"]:
+        """
+        Open the cache shared by the tools (see default_path).
+
+        :returns: the cache, None if it is disabled
+        """
+        path = default_path()
+        return None if path is None else cls(path)
+
+    def entry_path(self, digest: str, encoding: Optional[str] = None) -> str:
+        """
+        Path of the entry of the export.
+
+        :param digest: sha256 hex digest of the export (see file_hash)
+        :param encoding: encoding the export was parsed with, None for the entry of an ASCII export shared by all
+        ASCII-compatible encodings
+        :returns: path of the entry
+        """
+        if encoding is None:
+            return os.path.join(self.path, f"{digest}.npz")
+        return os.path.join(self.path, f"{digest}.{codecs.lookup(encoding).name}.npz")
+
+    def load(self, digest: str, encoding: str, columns: list = None) -> Optional[tuple[pd.DataFrame, dict]]:
+        """
+        Load the parsed export.
+
+        :param digest: sha256 hex digest of the export (see file_hash)
+        :param encoding: encoding the export was parsed with
+        :param columns: names of the columns to load, all columns if None
+        :returns: the export (with the default index) and the stored arrays, None if there is no valid entry
+        """
+        path = self.entry_path(digest, encoding)
+        if ascii_compatible(encoding) and os.path.exists(self.entry_path(digest)):
+            path = self.entry_path(digest)
+        try:
+            with np.load(path) as entry:
+                meta = json.loads(entry["meta"].tobytes())
+                if meta["version"] != FORMAT_VERSION:
+                    raise ValueError(f"Format version {meta['version']} of {path} is not supported.")
+                names = [(ix, name, kind) for ix, (name, kind) in enumerate(zip(meta["columns"], meta["kinds"]))
+                         if columns is None or name in columns]
+                frame = pd.DataFrame({name: self.__column(entry, f"column_{ix}", kind, meta["rows"])
+                                      for ix, name, kind in names}, columns=[name for _, name, _ in names])
+                arrays = {key: entry[f"array_{key}"] for key in meta["arrays"]}
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            os.utime(path)
+        except OSError:  # removed by another process
+            pass
+        return frame, arrays
+
+    def store(self, digest: str, encoding: str, frame: pd.DataFrame, arrays: dict = None) -> bool:
+        """
+        Store the parsed export, replacing its entry (the shared entry if all text of the export is ASCII).
+
+        :param digest: sha256 hex digest of the export (see file_hash)
+        :param encoding: encoding the export was parsed with
+        :param frame: export as parsed by pandas (with the default index)
+        :param arrays: further arrays stored with the export ({name: numpy array})
+        :returns: False if a column can not be stored (neither numbers nor strings), the export is not stored then
+        """
+        arrays = arrays or {}
+        data, kinds = {}, []
+        shared = ascii_compatible(encoding) and all(str(name).isascii() for name in frame.columns)
+        for ix, name in enumerate(frame.columns):
+            values = frame.iloc[:, ix]
+            if values.dtype.kind in "biuf":
+                data[f"column_{ix}"] = values.to_numpy()
+                kinds.append("number")
+                continue
+            missing = values.isna().to_numpy()
+            strings = values[~missing].tolist()
+            if values.dtype != object or not all(isinstance(string, str) for string in strings):
+                return False
+            shared = shared and all(string.isascii() for string in strings)
+            encoded = [string.encode("utf-8") for string in strings]
+            data[f"column_{ix}"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+            data[f"column_{ix}_offsets"] = np.concatenate(([0], np.cumsum([len(string) for string in encoded],
+                                                                          dtype=np.int64)))
+            data[f"column_{ix}_missing"] = missing
+            kinds.append("text")
+        data.update({f"array_{key}": np.asarray(value) for key, value in arrays.items()})
+        meta = {"version": FORMAT_VERSION, "rows": len(frame), "columns": list(frame.columns), "kinds": kinds,
+                "arrays": list(arrays)}
+        data["meta"] = np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8)
+        os.makedirs(self.path, exist_ok=True)
+        path = self.entry_path(digest, None if shared else encoding)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as file:
+            np.savez(file, **data)
+        os.replace(temporary, path)
+        self.prune()
+        return True
+
+    def read(self, file: str, encoding: str, reader: Callable[[str], pd.DataFrame], digest: str = None,
+             columns: list = None) -> pd.DataFrame:
+        """
+        Load the parsed export, it is parsed with reader and stored (all columns) if there is no valid entry.
+
+        :param file: path to the export
+        :param encoding: encoding the reader parses the export with
+        :param reader: parser of the export (e.g. pandas.read_csv), called with the path
+        :param digest: sha256 hex digest of the export if known, it is hashed otherwise
+        :param columns: names of the columns to return, all columns if None
+        :returns: the export (with the default index)
+        """
+        digest = digest or file_hash(file)
+        cached = self.load(digest, encoding, columns)
+        if cached is not None:
+            return cached[0]
+        frame = reader(file)
+        self.store(digest, encoding, frame)
+        return frame if columns is None else frame.loc[:, [column for column in frame.columns if column in columns]]
+
+    def prune(self) -> None:
+        """Remove the least recently used entries until the folder is below max_bytes."""
+        entries = []
+        with os.scandir(self.path) as scan:
+            for item in scan:
+                if item.name.endswith(".npz"):
+                    stat = item.stat()
+                    entries.append((stat.st_mtime, stat.st_size, item.path))
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:  # removed by another process
+                pass
+            size -= entry_size
+
+    @staticmethod
+    def __column(entry, key: str, kind: str, rows: int) -> np.ndarray:
+        """Decode a stored column."""
+        if kind == "number":
+            return entry[key]
+        blob = entry[key].tobytes()
+        offsets = entry[f"{key}_offsets"].tolist()
+        missing = entry[f"{key}_missing"]
+        values = np.full(rows, np.nan, dtype=object)
+        values[~missing] = [blob[start:stop].decode("utf-8") for start, stop in zip(offsets[:-1], offsets[1:])]
+        return values
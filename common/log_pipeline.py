@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""Non-blocking logging pipeline.
+
+Log calls only put the record on a queue, the handlers (log file, console) are run by a background thread, so slow disk
+or console output does not stall the processing. The queue is a multiprocessing queue, worker processes log through it
+as well (see setup_worker) and their records are written by the same thread of the main process.
+
+    log_pipeline.setup([logging.FileHandler(path, mode="w")], level=logging.INFO)
+
+Records below the level are dropped before their message is formatted, so use lazy formatting in hot paths:
+log.debug("Processing %s.", name).
+"""
+import atexit
+import logging
+import logging.handlers
+import multiprocessing
+
+FORMAT = "%(asctime)s %(message)s"
+
+_QUEUE = None
+_LISTENER = None
+
+
+def _install(log_queue, level: int) -> None:
+    """Replace the handlers of the root logger with a handler putting the records on the queue."""
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+
+
+def setup(handlers: list, level: int = logging.INFO, fmt: str = FORMAT) -> None:
+    """
+    Route the root logger through the queue to the handlers, a running pipeline is shut down first.
+
+    :param handlers: handlers writing the records (e.g. logging.FileHandler, logging.StreamHandler)
+    :param level: level of the root logger
+    :param fmt: format of the records
+    """
+    global _QUEUE, _LISTENER
+    shutdown()
+    formatter = logging.Formatter(fmt)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    _QUEUE = multiprocessing.Queue()
+    _LISTENER = logging.handlers.QueueListener(_QUEUE, *handlers, respect_handler_level=True)
+    _LISTENER.start()
+    _install(_QUEUE, level)
+    # multiprocessing registers its exit handler (closing the queue) with the first queue, the pipeline is shut down
+    # before it (exit handlers run in reverse order)
+    atexit.unregister(shutdown)
+    atexit.register(shutdown)
+
+
+def get_queue():
+    """
+    Get the queue of the running pipeline (pass it to setup_worker in the worker processes).
+
+    :returns: the queue, None if the pipeline is not set up
+    """
+    return _QUEUE
+
+
+def setup_worker(log_queue, level: int = logging.INFO) -> None:
+    """
+    Log through the queue of the main process, call it in the initializer of the worker process.
+
+    :param log_queue: queue from get_queue, the logging of the worker is left unchanged if None
+    :param level: level of the root logger
+    """
+    if log_queue is not None:
+        _install(log_queue, level)
+
+
+def shutdown() -> None:
+    """Write the queued records, close the handlers and stop the background thread."""
+    global _QUEUE, _LISTENER
+    if _LISTENER is None:
+        return
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        if isinstance(handler, logging.handlers.QueueHandler) and handler.queue is _QUEUE:
+            root.removeHandler(handler)
+    _LISTENER.stop()
+    for handler in _LISTENER.handlers:
+        handler.close()
+    _QUEUE.close()
+    _QUEUE, _LISTENER = None, None
+
+
+atexit.register(shutdown)
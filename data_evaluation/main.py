@@ -1,15 +1,18 @@
 # -*- coding: utf-8 -*-
 """Main script for running data_evaluation."""
-import pandas as pd
-from nearest_neighbors_scent import KNNGridSearch
-from random_forest_scent import RFGridSearch
-from pca_scent import PCARun
+import importlib
 import tkinter as tk
 from tkinter.filedialog import askopenfilename
 import logging
 import os
+import sys
 import datetime
-from matrix_plot_generator import MPGen
+
+try:
+    import log_pipeline
+except ImportError:  # started from the tool folder, the modules shared by the tools are in common/
+    sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+    import log_pipeline
 
 
 class DEMain(tk.Tk):
@@ -21,17 +24,17 @@ class DEMain(tk.Tk):
         """
         super().__init__()
         self.__path = ""
-        self.__df = pd.DataFrame()
+        self.__df = None
         self.__tags = []
         self.__init_window()
-        logging.basicConfig(
-            level=logging.INFO,
-            format="%(asctime)s [:::%(name)s:::] [%(levelname)s] %(message)s",
-            handlers=[
+        log_pipeline.setup(
+            [
                 logging.FileHandler(f"logs{os.sep}log_{datetime.date.today()}_"
                                     f"{datetime.datetime.now().strftime('%H_%M_%S')}.log"),
                 logging.StreamHandler()
-            ]
+            ],
+            level=logging.INFO,
+            fmt="%(asctime)s [:::%(name)s:::] [%(levelname)s] %(message)s"
         )
         self.log = logging.getLogger(__name__)
         self.mainloop()
@@ -53,10 +56,10 @@ class DEMain(tk.Tk):
         tk.Label(frame_vis, text="Visualization tools").grid(row=0, columnspan=2, sticky="WE")
 
         # PCA
-        tk.Button(frame_vis, text="PCA", command=lambda: PCARun(self.__df, self.__tags)).grid(row=1, column=0,
-                                                                                              sticky="WE")
+        tk.Button(frame_vis, text="PCA", command=lambda: self.open_tool("pca_scent", "PCARun"))\
+            .grid(row=1, column=0, sticky="WE")
         # matrix corr
-        tk.Button(frame_vis, text="Matrix plot", command=lambda: MPGen(self.__df, self.__tags)).\
+        tk.Button(frame_vis, text="Matrix plot", command=lambda: self.open_tool("matrix_plot_generator", "MPGen")).\
             grid(row=1, column=1, sticky="WE")
 
         frame_class = tk.LabelFrame(self, bg="gray89")
@@ -65,10 +68,12 @@ class DEMain(tk.Tk):
         tk.Label(frame_class, text="Classification tools").grid(row=0, columnspan=2, sticky="WE")
 
         # Nearest Neighbor
-        tk.Button(frame_class, text="K-Nearest Neighbor", command=lambda: KNNGridSearch(self.__df, self.__tags))\
+        tk.Button(frame_class, text="K-Nearest Neighbor",
+                  command=lambda: self.open_tool("nearest_neighbors_scent", "KNNGridSearch"))\
             .grid(row=1, column=0, sticky="WE")
         # Random Forest
-        tk.Button(frame_class, text="Random Forest", command=lambda: RFGridSearch(self.__df, self.__tags))\
+        tk.Button(frame_class, text="Random Forest",
+                  command=lambda: self.open_tool("random_forest_scent", "RFGridSearch"))\
             .grid(row=1, column=1, sticky="WE")
 
     def load_file(self, label: tk.Label):
@@ -80,11 +85,24 @@ class DEMain(tk.Tk):
                                       filetypes=[("Text files", "*.txt")], defaultextension=".txt")
         label.config(text=self.__path)
         label.update()
-        self.__df = pd.read_csv(self.__path, sep="\t", header=0, index_col=0)
+        # pandas is imported on first use only, as the tool modules are (see open_tool)
+        self.__df = importlib.import_module("pandas").read_csv(self.__path, sep="\t", header=0, index_col=0)
         self.__tags = [x for x in self.__df["Class"]]
         self.__df = self.__df.drop("Class", axis=1)
         self.log.info(f"File loaded: {self.__path}, shape: {self.__df.shape}, class tags: {set(self.__tags)}")
 
+    def open_tool(self, module: str, tool: str) -> None:
+        """Open the tool window with the loaded data. The tool module (and sklearn, seaborn, matplotlib) is imported
+        on first use only.
+
+        :param module: name of the tool module
+        :param tool: name of the tool class
+        """
+        if self.__df is None:
+            self.log.info("No file loaded, load the input file first.")
+            return
+        getattr(importlib.import_module(module), tool)(self.__df, self.__tags)
+
 
 if __name__ == "__main__":
     DEMain()
@@ -1,14 +1,28 @@
 # -*- coding: utf-8 -*-
 """Main function for data processing."""
 import datetime
+import importlib
 import logging
 import os
+import sys
 import tkinter as tk
 
-import data_cleaning
-import matrix_gen
-import merge_ratios
-import sort_by_name
+try:
+    import log_pipeline
+except ImportError:  # started from the tool folder, the modules shared by the tools are in common/
+    sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+    import log_pipeline
+
+
+def open_tool(module: str, tool: str, *args) -> None:
+    """
+    Open the tool window. The tool module (and its heavy dependencies) is imported on first use only.
+
+    param module: name of the tool module
+    param tool: name of the tool class
+    param args: arguments of the tool
+    """
+    getattr(importlib.import_module(module), tool)(*args)
 
 
 class DPMain(tk.Tk):
@@ -20,14 +34,14 @@ class DPMain(tk.Tk):
         """
         super().__init__()
         self.__init_window()
-        logging.basicConfig(
-            level=logging.DEBUG,
-            format="%(asctime)s [:::%(name)s:::] [%(levelname)s] %(message)s",
-            handlers=[
+        log_pipeline.setup(
+            [
                 logging.FileHandler(f"logs{os.sep}log_{datetime.date.today()}_"
                                     f"{datetime.datetime.now().strftime('%H_%M_%S')}.log"),
                 logging.StreamHandler()
-            ]
+            ],
+            level=logging.DEBUG,
+            fmt="%(asctime)s [:::%(name)s:::] [%(levelname)s] %(message)s"
         )
         self.mainloop()
 
@@ -36,16 +50,16 @@ class DPMain(tk.Tk):
         self.title("Data processing pipe interface")
         self.rowconfigure(0, minsize=100, weight=1)
         self.columnconfigure(3, weight=1, minsize=50)
-        btn_sum_table = tk.Button(text="Create summary table", command=sort_by_name.SortByName)
+        btn_sum_table = tk.Button(text="Create summary table", command=lambda: open_tool("sort_by_name", "SortByName"))
         btn_sum_table.grid(row=0, column=0, sticky="nsew", pady=10, padx=10)
 
-        btn_matrix_gen = tk.Button(text="Create matrices", command=matrix_gen.MatrixGen)
+        btn_matrix_gen = tk.Button(text="Create matrices", command=lambda: open_tool("matrix_gen", "MatrixGen"))
         btn_matrix_gen.grid(row=0, column=1, sticky="nsew", pady=10, padx=10)
 
-        btn_cleaning = tk.Button(text="Data Cleaning", command=data_cleaning.DataCleaning)
+        btn_cleaning = tk.Button(text="Data Cleaning", command=lambda: open_tool("data_cleaning", "DataCleaning"))
         btn_cleaning.grid(row=0, column=2, sticky="nsew", pady=10, padx=10)
 
-        btn_merging = tk.Button(text="Merge tables", command=merge_ratios.MergeTables)
+        btn_merging = tk.Button(text="Merge tables", command=lambda: open_tool("merge_ratios", "MergeTables"))
         btn_merging.grid(row=0, column=3, sticky="nsew", pady=10, padx=10)
 
 
@@ -104,7 +104,7 @@ class MatrixGen:
             class_tags = self.__df["Class"]
             self.__df = self.__df.drop("Class", axis=1)
             for sample in self.__df.index:
-                self.log.info(f"Generating matrix for {sample}.")
+                self.log.info("Generating matrix for %s.", sample)
                 array = np.column_stack(self.__df.loc[sample, :])
                 array2 = array.copy()
                 with np.errstate(divide="ignore", invalid="ignore"):
@@ -115,7 +115,7 @@ class MatrixGen:
                     df_single_row = pd.DataFrame(df_single_row.stack().to_frame().values).T
                     df_single_row = df_single_row.rename(index={0: sample})
                     final_table = pd.concat([final_table, df_single_row])
-                    self.log.info(f"{sample} single row representation was added to the summary file")
+                    self.log.info("%s single row representation was added to the summary file", sample)
             final_table = final_table.replace(np.inf, 0)
             final_table = final_table.set_axis([lst_rename], axis=1)
             final_table["Class"] = class_tags
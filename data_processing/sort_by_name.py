@@ -5,9 +5,18 @@ import glob
 import logging
 import os
 import pandas as pd
+import sys
 import tkinter as tk
 from tkinter.filedialog import askdirectory, askopenfilename
 
+try:
+    from export_cache import ExportCache
+except ImportError:  # started from the tool folder, the modules shared by the tools are in common/
+    sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+    from export_cache import ExportCache
+
+ENCODING = "utf-8"
+
 
 class SortByName:
     """Class of the sort by name instance."""
@@ -18,6 +27,7 @@ class SortByName:
         self.__result_path = f"{os.getcwd()}{os.sep}"
         self.__df = pd.DataFrame()
         self.__class_tags = []
+        self.__cache = ExportCache.default()
         self.log = logging.getLogger(__name__)
         self.log.debug("Create summary table instance running.")
         self.master = tk.Tk()
@@ -136,19 +146,32 @@ class SortByName:
         label.config(text=f"Class tags: {self.__class_tags}")
         label.update()
 
+    def read_table(self, file: str, columns: list = None) -> pd.DataFrame:
+        """Read the chromatogram, through the cache of parsed exports if it is enabled (see export_cache).
+
+        :param file: path to the chromatogram
+        :param columns: names of the columns to read besides the first one (compound names), missing columns are left
+        out, all columns if None
+        :returns: chromatogram with the default index
+        """
+        if columns is not None:
+            header = pd.read_csv(file, sep="\t", header=0, encoding=ENCODING, nrows=0).columns
+            columns = [column for ix, column in enumerate(header) if ix == 0 or column in columns]
+        if self.__cache is None:
+            return pd.read_csv(file, sep="\t", header=0, encoding=ENCODING, usecols=columns)
+        return self.__cache.read(file, ENCODING, lambda path: pd.read_csv(path, sep="\t", header=0, encoding=ENCODING),
+                                 columns=columns)
+
     def get_names_compounds(self) -> tuple[list, list]:
         """Get names of all compounds in analysed chromatograms and create index list."""
         list_of_files_all = [file for file in glob.iglob(f"{self.__input_path}{os.sep}*.txt")]
-        index_lst = []
+        names = {}
         for f in list_of_files_all:
-            fh = open(f, encoding="utf8")
-            for row in fh:
-                row_name = row.strip().split("\t")[0]
-                if row_name in index_lst or row_name == "Name" or row_name == "" or row_name == "Codename":
-                    continue
-                else:
-                    index_lst.append(row_name)
-            fh.close()
+            df = self.read_table(f, columns=[])
+            for row_name in df.iloc[:, 0].dropna():
+                if row_name not in ("Name", "", "Codename"):
+                    names.setdefault(row_name, None)
+        index_lst = list(names)
         self.log.info(f"{len(index_lst)} compounds from {len(list_of_files_all)} chromatograms collected.")
         return index_lst, list_of_files_all
 
@@ -159,7 +182,8 @@ class SortByName:
         df_area_all = pd.DataFrame(index=index_lst)
         df_height_all = pd.DataFrame(index=index_lst)
         for i in list_of_files:
-            df = pd.read_csv(i, sep="\t", header=0, index_col=0)
+            df = self.read_table(i, columns=["Area", "Height"])
+            df = df.set_index(df.columns[0])
             try:
                 df = df.loc[:, ["Area", "Height"]]
             except KeyError:
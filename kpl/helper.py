@@ -2,11 +2,27 @@
 """Helper functions for kpl scripts."""
 import glob
 import json
-from numpy import dot
+import numpy as np
 from numpy.linalg import norm
 import os
 import pandas as pd
-from scipy import stats
+
+import kpl_ingest
+
+_CONFIG_CACHE = {}
+
+
+def load_config() -> dict:
+    """Load the config file of the kpl tool. The parsed content is cached until the file changes on disk.
+
+    returns: content of config.txt
+    """
+    path = f"{os.getcwd()}{os.sep}config.txt"
+    stamp = os.stat(path).st_mtime_ns
+    if _CONFIG_CACHE.get(path, (None,))[0] != stamp:
+        with open(path, 'r') as j:
+            _CONFIG_CACHE[path] = (stamp, json.loads(j.read()))
+    return _CONFIG_CACHE[path][1]
 
 
 def compare_spectra(spectrum1: dict, spectrum2: dict) -> float:
@@ -18,42 +34,73 @@ def compare_spectra(spectrum1: dict, spectrum2: dict) -> float:
     param spectrum2: kpl spectrum
     returns: float result of the similarity comparison
     """
-    with open(f"{os.getcwd()}{os.sep}config.txt", 'r') as j:
-        config_file = json.loads(j.read())
-    spectrum_table_spectra = pd.DataFrame.from_dict({'spectrum1': spectrum1,
-                                                     'spectrum2': spectrum2},
-                                                    orient="index").fillna(0)
-    _1st_array = spectrum_table_spectra.iloc[0, :].to_numpy().astype("float")
-    _2nd_array = spectrum_table_spectra.iloc[1, :].to_numpy().astype("float")
-    if config_file["sim_compare"] == "Pearson":
-        pearson = stats.pearsonr(_1st_array, _2nd_array)
-        return round((pearson[0] * 100), 2)
-    elif config_file["sim_compare"] == "DOT":
-        return dot(_1st_array, _2nd_array) / (norm(_1st_array) * norm(_2nd_array)) * 100
-    else:
-        print("No valid method for spectral similarity. Force quit.")
-        quit()
+    return float(compare_spectra_batch(spectrum1, [spectrum2])[0])
+
+
+def compare_spectra_batch(spectrum: dict, spectra: list) -> np.ndarray:
+    """
+    Compare one spectrum to a list of spectra at once. The spectra are aligned by m/z values and scored with the method
+    set in the config file, each pair gives the same result as compare_spectra.
+
+    param spectrum: inspected spectrum
+    param spectra: kpl spectra
+    returns: array of similarity results, one for each kpl spectrum
+    """
+    masses = sorted(set(spectrum).union(*spectra))
+    position = {mass: ix for ix, mass in enumerate(masses)}
+    query = np.zeros(len(masses))
+    query_mask = np.zeros(len(masses), dtype=bool)
+    query[[position[key] for key in spectrum]] = list(spectrum.values())
+    query_mask[[position[key] for key in spectrum]] = True
+    matrix = np.zeros((len(spectra), len(masses)))
+    mask = np.zeros((len(spectra), len(masses)), dtype=bool)
+    for ix, kpl_spectrum in enumerate(spectra):
+        columns = [position[key] for key in kpl_spectrum]
+        matrix[ix, columns] = list(kpl_spectrum.values())
+        mask[ix, columns] = True
+    return score_spectra(query, query_mask, matrix, mask)
+
+
+def score_spectra(query: np.ndarray, query_mask: np.ndarray, matrix: np.ndarray, mask: np.ndarray,
+                  norms: np.ndarray = None) -> np.ndarray:
+    """
+    Score m/z aligned spectra against the inspected spectrum.
+
+    The masks mark the m/z values present in each spectrum. Pearson's coefficient is computed only over the m/z values
+    present in either of the two compared spectra, exactly as the pairwise comparison does.
+
+    param query: inspected spectrum as an aligned vector
+    param query_mask: m/z values present in the inspected spectrum
+    param matrix: kpl spectra as aligned rows
+    param mask: m/z values present in each kpl spectrum
+    param norms: precomputed norms of the matrix rows (used by DOT)
+    returns: array of similarity results, one for each row of the matrix
+    """
+    method = load_config()["sim_compare"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if method == "Pearson":
+            union = mask | query_mask
+            counts = union.sum(axis=1)
+            query_c = (query - (query.sum() / counts)[:, None]) * union
+            matrix_c = (matrix - (matrix.sum(axis=1) / counts)[:, None]) * union
+            pearson = (query_c * matrix_c).sum(axis=1) / np.sqrt((query_c ** 2).sum(axis=1) *
+                                                                  (matrix_c ** 2).sum(axis=1))
+            return np.round(np.clip(pearson, -1, 1) * 100, 2)
+        elif method == "DOT":
+            norms = norm(matrix, axis=1) if norms is None else norms
+            return matrix @ query / (norm(query) * norms) * 100
+        else:
+            print("No valid method for spectral similarity. Force quit.")
+            quit()
 
 
 def check_formatting(file: pd.DataFrame) -> pd.DataFrame:
-    """Helper function for reformatting the input files to a proper format
+    """Helper function for reformatting the input files to a proper format (see kpl_ingest.format_export)
 
     param file: dataframe for format check
     returns: reformatted dataframe
     """
-    lst_columns = [x for x in file.columns]
-    if "1st Dimension Time (s)" not in lst_columns:
-        lst_columns[[ix for ix, val in enumerate(lst_columns) if "1st" in val][0]] = "1st Dimension Time (s)"
-    if "2nd Dimension Time (s)" not in lst_columns:
-        lst_columns[[ix for ix, val in enumerate(lst_columns) if "2nd" in val][0]] = "2nd Dimension Time (s)"
-    if "Spectra" not in lst_columns:
-        lst_columns[[ix for ix, val in enumerate(lst_columns) if "Spect" in val][0]] = "Spectra"
-    file.columns = lst_columns
-    if file["2nd Dimension Time (s)"].dtype == object:
-        file["2nd Dimension Time (s)"] = file["2nd Dimension Time (s)"].str.replace(",", ".").astype("float")
-    for i, name in enumerate(file["Name"]):
-        file.at[i, "Name"] = name.encode("utf-8")
-    return file
+    return kpl_ingest.format_export(file)
 
 
 def transfer_spectrum(spectrum: list, transform: bool = True, do_list: bool = False) -> dict:
@@ -65,8 +112,7 @@ def transfer_spectrum(spectrum: list, transform: bool = True, do_list: bool = Fa
     param transform: True if data transformation should be performed
     returns: spectrum as a dict
     """
-    with open(f"{os.getcwd()}{os.sep}config.txt", 'r') as j:
-        config_file = json.loads(j.read())
+    config_file = load_config()
     masses = dict()
     for indic1 in spectrum:
         key = int(float(indic1.split(":")[0]))
@@ -83,19 +129,70 @@ def transfer_spectrum(spectrum: list, transform: bool = True, do_list: bool = Fa
     return masses
 
 
+def round_array(values: np.ndarray) -> np.ndarray:
+    """
+    Round values to 2 decimals with the same result as the built-in round (np.round differs for some ties).
+
+    param values: array of values
+    returns: rounded values
+    """
+    rounded = np.round(values, 2)
+    scaled = values * 100
+    ties = np.flatnonzero(np.abs(scaled - np.trunc(scaled)) == 0.5)
+    rounded[ties] = [round(value, 2) for value in values[ties].tolist()]
+    return rounded
+
+
+def parse_spectra(spectra: pd.Series) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Parse the whole Spectra column of a chromatogram at once to CSR-like arrays. Masses below 31 are dropped.
+
+    param spectra: Spectra column ("mass:intensity mass:intensity ..." strings)
+    returns: row offsets, masses (int), intensities (float, rounded to 2 decimals) and mask of rows without spectrum
+    """
+    missing = spectra.isna().to_numpy()
+    text = spectra[~missing].astype(str)
+    counts = np.zeros(len(spectra), dtype=np.int64)
+    counts[~missing] = text.str.count(":").to_numpy()
+    pairs = np.array(" ".join(text).replace(":", " ").split(), dtype=float).reshape(-1, 2)
+    masses = pairs[:, 0].astype(np.int64)
+    keep = masses >= 31
+    counts = np.bincount(np.repeat(np.arange(len(spectra)), counts)[keep], minlength=len(spectra))
+    offsets = np.zeros(len(spectra) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets, masses[keep], round_array(pairs[keep, 1]), missing
+
+
+def spectrum_at(spectra: tuple, row: int, do_list: bool = False) -> dict:
+    """
+    Get spectrum of one peak from the parsed Spectra column (see parse_spectra).
+
+    param spectra: parsed Spectra column
+    param row: position of the peak
+    param do_list: True if the values should be stored as a list - set to True when adding a new line to kpl
+    returns: spectrum as a dict, {0: 0} for peaks without spectrum
+    """
+    offsets, masses, intensities, missing = spectra
+    if missing[row]:
+        return {0: [0]} if do_list else {0: 0}
+    start, stop = offsets[row], offsets[row + 1]
+    values = intensities[start:stop].tolist()
+    return dict(zip(masses[start:stop].tolist(), [[value] for value in values] if do_list else values))
+
+
 def transform_spectrum(spectrum: dict, do_list: bool = False) -> dict:
-    """Transform spectrum.
+    """Transform spectrum. The original spectrum is left untouched.
 
     param do_list: True if the values should be stored as a list - set to True when adding a new line to kpl
     param spectrum: spectrum
     returns: transformed spectrum
     """
-    with open(f"{os.getcwd()}{os.sep}config.txt", 'r') as j:
-        config_file = json.loads(j.read())
+    config_file = load_config()
+    transformed = dict()
     for key, value in spectrum.items():
         value = round((key ** config_file["transformation"][1]) * (value ** config_file["transformation"][0]), 2)
-        spectrum.update({key: [value]}) if do_list else spectrum.update({key: value})
-    return spectrum
+        transformed[key] = [value] if do_list else value
+    return transformed
 
 
 def get_files(path: str) -> list:
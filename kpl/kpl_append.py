@@ -1,16 +1,20 @@
 # -*- coding: utf-8 -*-
 """Script for creation of the kpl."""
-import abc
 import datetime
-import json
 import logging
 import os
-import pandas as pd
-import statistics
+import sys
 import tkinter as tk
 from tkinter.filedialog import askopenfilename
+from tkinter.messagebox import askyesno
 
-import helper
+try:
+    import log_pipeline
+except ImportError:  # started from the tool folder, the modules shared by the tools are in common/
+    sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+    import log_pipeline
+
+from kpl_engine import merge_libraries
 
 
 class KPLAppend:
@@ -21,26 +25,37 @@ class KPLAppend:
         self.__core_kpl = f"{os.getcwd()}{os.sep}Core.h5"
         self.__user_kpl = f"{os.getcwd()}{os.sep}User.h5"
         self.__codename = ""
-        logging.basicConfig(filename=f"log_append_line_to_core_kpl_{datetime.date.today()}_{datetime.date.today()}.log",
-                            level=logging.DEBUG,
-                            format="%(asctime)s %(message)s", filemode="w"
-                            )
+        log_pipeline.setup([logging.FileHandler(f"log_append_line_to_core_kpl_{datetime.date.today()}_"
+                                                f"{datetime.date.today()}.log", mode="w")])
         self.master = tk.Tk()
         self.setup_window()
         self.master.mainloop()
 
-    def add_line(self) -> None:
-        """returns list of files for the analysis"""
-        self.__core_kpl = pd.read_hdf(self.__core_kpl)
-        self.__user_kpl = pd.read_hdf(self.__user_kpl)
-        new_idx = self.__user_kpl.where(self.__user_kpl == self.__codename).dropna(how='all'). \
-            dropna(how='all', axis=1).index[0]
-        new_line = self.__user_kpl.loc[new_idx].to_frame().T
-        newname = "MX" + str(int((self.__core_kpl.iat[-1, 0].split("X")[1])) + 1).zfill(5)
-        new_line.at[0, "Codename"] = newname
-        self.__core_kpl = pd.concat([self.__core_kpl, new_line], ignore_index=True)
-        logging.info(f"{self.__codename} from user's database added as {newname} into the core database.")
-        print(f"{self.__codename} from user's database added as {newname} into the core database.")
+    def add_line(self, label: tk.Label) -> None:
+        """Merge the record with the set codename into the core library and save it.
+
+        :param label: label widget
+        """
+        if not self.__codename:
+            logging.info("No codename set, nothing added to the core database.")
+            label.config(text="Set the codename first (Add).")
+        else:
+            _, missing = merge_libraries(self.__core_kpl, self.__user_kpl, [self.__codename], save_path=self.__core_kpl)
+            label.config(text=f"{self.__codename} not found in the user's library." if missing
+                         else f"Added: {self.__codename}")
+        label.update()
+
+    def merge_all(self, label: tk.Label) -> None:
+        """Merge the whole user's library into the core library and save it, after confirmation.
+
+        :param label: label widget
+        """
+        if not askyesno("Merge libraries", f"Merge all records of {self.__user_kpl} into {self.__core_kpl} and "
+                                           f"overwrite the core library?", parent=self.master):
+            return
+        codename_map, _ = merge_libraries(self.__core_kpl, self.__user_kpl, save_path=self.__core_kpl)
+        label.config(text=f"{len(codename_map)} records of the user's library merged.")
+        label.update()
 
     def setup_window(self) -> None:
         """Set up GUI window."""
@@ -76,10 +91,17 @@ class KPLAppend:
         add_button.grid(row=2, column=2, pady=10)
 
         # append button
-        add_confirm = tk.Button(self.master, text="Add new compound \nto core library", command=self.add_line)
+        add_confirm = tk.Button(self.master, text="Add new compound \nto core library",
+                                command=lambda: self.add_line(add_label))
         add_confirm.grid(row=4, column=0, pady=10)
         add_confirm.config(font=26)
 
+        # merge of the whole user's library, confirmed in a dialog
+        merge_button = tk.Button(self.master, text="Merge whole \nuser's library",
+                                 command=lambda: self.merge_all(add_label))
+        merge_button.grid(row=4, column=1, pady=10)
+        merge_button.config(font=26)
+
         add_label = tk.Label(self.master, text="Add (no codename)")
         add_label.grid(row=3, column=1, sticky="W", pady=10)
 
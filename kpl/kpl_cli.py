@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""Command line interface of the kpl tool, runs without a display.
+
+Examples:
+    python kpl_cli.py create --input data_kpl --output results --library Core_KPL.h5
+    python kpl_cli.py compare --library Core_KPL.h5 --save User_KPL.h5 --input data_kpl --output renamed -j 4
+    python kpl_cli.py compact --library Core_KPL.h5 --save User_KPL.h5
+    python kpl_cli.py append --core Core_KPL.h5 --user User_KPL.h5 --codename MX00042
+    python kpl_cli.py merge --core Core_KPL.h5 --user User_KPL.h5 [--codename "MX01*" ...]
+    python kpl_cli.py dedupe --library User_KPL.h5 --save User_KPL_dedupe.h5
+    python kpl_cli.py search --library Core_KPL.h5 --input data_kpl --output searched --top 5
+    python kpl_cli.py export Core_KPL.h5 Core_KPL.tsv
+"""
+import argparse
+import datetime
+import logging
+import os
+import sys
+from typing import Callable, Optional, TextIO
+
+try:
+    import log_pipeline
+except ImportError:  # started from the tool folder, the modules shared by the tools are in common/
+    sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+    import log_pipeline
+
+import kpl_engine
+import kpl_export
+import kpl_ingest
+import kpl_journal
+
+EXIT_OK = 0
+EXIT_FAILURE = 1
+
+
+def get_parser() -> argparse.ArgumentParser:
+    """
+    Build the argument parser.
+
+    returns: parser of the command line arguments
+    """
+    parser = argparse.ArgumentParser(prog="kpl", description="Create, update, merge and export kpl libraries.")
+    parser.add_argument("--progress", metavar="FILE", help="write progress messages to FILE instead of stdout")
+    parser.add_argument("--quiet", action="store_true", help="do not report progress")
+    parser.add_argument("--verbose", action="store_true",
+                        help="report and log the result of every peak instead of a summary of each chromatogram")
+    parser.add_argument("--log", metavar="FILE", help="log file (default: logs/log_<command>_<date>_<time>.log)")
+    parser.add_argument("--report", metavar="FILE",
+                        help="JSON report with stage timings and counters of create, compare, merge, dedupe and search "
+                             "(default: logs/report_<command>_<date>_<time>.json)")
+    parser.add_argument("--profile", metavar="FILE", help="write a cProfile dump of create and compare to FILE")
+    parser.add_argument("--parser", choices=kpl_ingest.ENGINES, default="c",
+                        help="parser of the chromatograms of create, compare and search, pyarrow must be installed "
+                             "(default: %(default)s)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="parse the chromatograms without the cache of parsed exports (see export_cache)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    create = commands.add_parser("create", help="create a new core library from evaluated chromatograms")
+    create.add_argument("--input", required=True, help="folder with the chromatograms")
+    create.add_argument("--output", required=True, help="folder for the renamed chromatograms")
+    create.add_argument("--library", default=f"Core_KPL_{datetime.date.today()}.h5",
+                        help="path of the created library, .h5, .txt, .kplc or .kpls (default: %(default)s)")
+    create.add_argument("--base", help="existing library which should be extended with the new chromatograms")
+    create.add_argument("--export", metavar="FILE",
+                        help="also export the created library to FILE, e.g. a .tsv for inspection (see export)")
+
+    compare = commands.add_parser("compare", help="compare chromatograms to an existing library and update it")
+    compare.add_argument("--library", required=True,
+                         help="path to the library, .h5, .txt and .kplc libraries are decoded whole on load, the "
+                              "shards of a .kpls library are loaded on demand")
+    compare.add_argument("--save", required=True, help="path of the updated library, .h5, .txt, .kplc or .kpls")
+    compare.add_argument("--input", required=True, help="folder with the non-processed chromatograms")
+    compare.add_argument("--output", required=True, help="folder for the renamed chromatograms")
+    compare.add_argument("-j", "--processes", type=int, default=1, help="number of worker processes (default: 1)")
+    compare.add_argument("--restart", action="store_true",
+                         help="start over instead of resuming an interrupted run from its journal")
+    compare.add_argument("--recall-check", action="store_true",
+                         help="score the records pruned by the key ion index or the approximate search too and report "
+                              "those which would match")
+    compare.add_argument("--ann-recall", type=float, metavar="RECALL",
+                         help="approximate search of the spectra for very large libraries, recall (0-1) of the records "
+                              "with the similarity at the match threshold")
+    compare.add_argument("--shard-cache", type=int, metavar="MB",
+                         default=kpl_engine.ShardedKPLLibrary.CACHE_BYTES >> 20,
+                         help="memory cap of the loaded shards of a .kpls library in MB, in each process "
+                              "(default: %(default)s)")
+
+    compact = commands.add_parser("compact", help="fold the journal of an interrupted compare run into the library")
+    compact.add_argument("--library", required=True, help="path to the starting library of the run")
+    compact.add_argument("--save", required=True, help="path of the updated library")
+    compact.add_argument("--journal", help="path to the journal (default: <save>.journal)")
+
+    append = commands.add_parser("append", help="merge a record of the user's library into the core library (merge "
+                                                "with a single codename)")
+    append.add_argument("--core", required=True, help="path to the core library")
+    append.add_argument("--user", required=True, help="path to the user's library")
+    append.add_argument("--codename", required=True, help="codename of the record in the user's library")
+    append.add_argument("--save", help="path of the updated core library (default: overwrite the core library)")
+
+    merge = commands.add_parser("merge", help="merge records of the user's library into the core library, records "
+                                              "matching a core record are merged into it")
+    merge.add_argument("--core", required=True, help="path to the core library")
+    merge.add_argument("--user", required=True, help="path to the user's library")
+    merge.add_argument("--codename", action="append", dest="codenames", metavar="CODENAME",
+                       help="codename of a merged record, shell-style patterns allowed (e.g. 'MX01*'), can be "
+                            "repeated (default: all records)")
+    merge.add_argument("--save", help="path of the updated core library (default: overwrite the core library)")
+
+    dedupe = commands.add_parser("dedupe", help="merge near-duplicate records of the library")
+    dedupe.add_argument("--library", required=True, help="path to the library")
+    dedupe.add_argument("--save", help="path of the compacted library (default: overwrite the library)")
+    dedupe.add_argument("--remap", metavar="FILE",
+                        help="tab separated table of the old and new codenames of the merged records "
+                             "(default: <save>.remap.tsv)")
+    dedupe.add_argument("--threshold", type=float, default=kpl_engine.DEDUPE_THRESHOLD,
+                        help="similarity above which the records in each other's search window are duplicates "
+                             "(default: %(default)s)")
+
+    search = commands.add_parser("search", help="search the peaks in the whole library by their spectra only, "
+                                                "regardless of retention times")
+    search.add_argument("--library", required=True, help="path to the library")
+    search.add_argument("--input", required=True, help="folder with the chromatograms")
+    search.add_argument("--output", required=True, help="folder for the chromatograms with the hits of each peak")
+    search.add_argument("--top", type=int, default=kpl_engine.SEARCH_TOP,
+                        help="number of the best records of each peak (default: %(default)s)")
+    search.add_argument("--cutoff", type=float, default=kpl_engine.MATCH_THRESHOLD,
+                        help="similarity above which a record is a hit (default: %(default)s)")
+
+    export = commands.add_parser("export", help="export the library to the format given by the file extension")
+    export.add_argument("library", help="path to the library")
+    export.add_argument("target", help="path of the exported library, .tsv or .parquet (flattened, written in chunks), "
+                                       ".txt, .h5, .kplc or .kpls")
+    export.add_argument("--chunk-records", type=int, default=kpl_export.CHUNK_RECORDS,
+                        help="records in each chunk of the .tsv, .parquet and .kpls exports (default: %(default)s)")
+    return parser
+
+
+def get_echo(stream: Optional[TextIO]) -> Callable[[str], None]:
+    """
+    Get the function reporting progress messages.
+
+    param stream: stream for the messages, None to drop them
+    returns: function writing one message per line
+    """
+    if stream is None:
+        return lambda message: None
+    return lambda message: print(message, file=stream, flush=True)
+
+
+def run(args: argparse.Namespace, echo: Callable[[str], None]) -> int:
+    """
+    Run the command.
+
+    param args: parsed command line arguments
+    param echo: called with every progress message
+    returns: exit code
+    """
+    if args.command in ("create", "compare", "search"):
+        if not os.path.isdir(args.input):
+            print(f"Input folder {args.input} does not exist.", file=sys.stderr)
+            return EXIT_FAILURE
+        os.makedirs(args.output, exist_ok=True)
+    if args.command == "create":
+        kpl_engine.KPLCreateEngine(args.input, args.output, echo=echo, report_path=args.report,
+                                   profile_path=args.profile, verbose=args.verbose,
+                                   parser=args.parser, cache=not args.no_cache).run(args.library, args.base)
+        if args.export:
+            kpl_engine.export_library(args.library, args.export, echo=echo)
+    elif args.command == "compare":
+        kpl_engine.KPLCompareEngine(args.input, args.output, args.processes, echo=echo, resume=not args.restart,
+                                    report_path=args.report, profile_path=args.profile, verbose=args.verbose,
+                                    recall_check=args.recall_check,
+                                    ann_recall=args.ann_recall,
+                                    shard_cache=args.shard_cache << 20, parser=args.parser,
+                                    cache=not args.no_cache).run(args.library, args.save)
+    elif args.command == "compact":
+        journal = args.journal or kpl_journal.KPLJournal.for_library(args.save).path
+        kpl_journal.compact(args.library, journal, args.save)
+        echo(f"Journal {journal} folded into {args.save}.")
+    elif args.command in ("append", "merge"):
+        codenames = [args.codename] if args.command == "append" else args.codenames
+        _, missing = kpl_engine.merge_libraries(args.core, args.user, codenames, args.save or args.core, echo=echo,
+                                                report_path=args.report)
+        if missing:
+            return EXIT_FAILURE
+    elif args.command == "search":
+        kpl_engine.search_library(args.library, args.input, args.output, args.top, args.cutoff, echo=echo,
+                                  parser=args.parser, cache=not args.no_cache, report_path=args.report)
+    elif args.command == "dedupe":
+        kpl_engine.dedupe_library(args.library, args.save or args.library, args.remap, args.threshold, echo=echo,
+                                  report_path=args.report)
+    else:
+        kpl_engine.export_library(args.library, args.target, echo=echo, chunk_records=args.chunk_records)
+    return EXIT_OK
+
+
+def main(argv: Optional[list] = None) -> int:
+    """
+    Entry point of the command line interface.
+
+    param argv: command line arguments, sys.argv[1:] if None
+    returns: exit code
+    """
+    args = get_parser().parse_args(argv)
+    stamp = f"{args.command}_{datetime.date.today()}_{datetime.datetime.now().strftime('%H_%M_%S')}"
+    log_file = args.log
+    if log_file is None:
+        os.makedirs("logs", exist_ok=True)
+        log_file = f"logs{os.sep}log_{stamp}.log"
+    if args.report is None and args.command in ("create", "compare", "append", "merge", "dedupe", "search"):
+        os.makedirs("logs", exist_ok=True)
+        args.report = f"logs{os.sep}report_{stamp}.json"
+    log_pipeline.setup([logging.FileHandler(log_file, mode="w")], level=logging.DEBUG if args.verbose else logging.INFO)
+    stream = None
+    try:
+        if not args.quiet:
+            stream = open(args.progress, "w", encoding="utf-8") if args.progress else sys.stdout
+        return run(args, get_echo(stream))
+    except Exception as error:
+        logging.exception("kpl %s failed.", args.command)
+        print(f"kpl {args.command} failed: {error}", file=sys.stderr)
+        return EXIT_FAILURE
+    finally:
+        if stream is not None and stream is not sys.stdout:
+            stream.close()
+        log_pipeline.shutdown()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
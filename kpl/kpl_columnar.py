@@ -0,0 +1,604 @@
+# -*- coding: utf-8 -*-
+"""Columnar, memory-mappable storage of the kpl.
+
+The library is stored as a folder (*.kplc) with one .npy file per array and a small meta.json. Variable-length values
+(spectra, calc_* histories, Found lists) are stored as ragged arrays (offsets + values), Name and Found are stored as
+ids into interned string tables. Intensities are stored as floats, positions of the values which were integers (such as
+the {0: 0} placeholder of missing spectra) are kept aside, so the conversion is lossless. Every array can be opened
+with memory mapping, so only the touched columns are read (see ColumnarLibrary). .kplc is a compact storage format: a
+library loaded for matching (read_library, KPLLibrary.load) is decoded whole, as an .h5 library.
+
+Large libraries can be split into shards by the retention time in the first dimension (a *.kpls folder): a small shard
+manifest (shards.json) with the 1st RT range of each shard and one columnar store per shard, holding also the positions
+of its records in the library (rows.npy). A shard can be read without touching the others (see ShardedStore).
+"""
+import ast
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+import pandas as pd
+
+FORMAT_VERSION = 1
+SHARDS_VERSION = 1
+SHARD_RECORDS = 5000
+COLUMNS = ["Codename", "1st RT", "2nd RT", "Spectra", "Found", "Name", "calc_1stRT", "calc_2ndRT", "calc_spectra"]
+
+
+def _offsets(lengths: list) -> np.ndarray:
+    """Convert list of lengths to offsets."""
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+def _intern(values: list) -> tuple[np.ndarray, list]:
+    """Replace values by ids into the table of unique values (missing values get id -1)."""
+    table = {}
+    ids = np.fromiter((-1 if value is None or value != value else table.setdefault(value, len(table))
+                       for value in values), dtype=np.int32, count=len(values))
+    return ids, list(table)
+
+
+def _values(values: list) -> tuple[np.ndarray, np.ndarray]:
+    """Store numbers as floats together with positions of the integer values."""
+    return np.array(values, dtype=float), np.flatnonzero([isinstance(value, int) for value in values])
+
+
+def _string_table(strings: list) -> tuple[np.ndarray, np.ndarray]:
+    """Store strings as one utf-8 blob with offsets."""
+    encoded = [string if isinstance(string, bytes) else str(string).encode("utf-8") for string in strings]
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return _offsets([len(string) for string in encoded]), blob
+
+
+def write_columnar(database: pd.DataFrame, path: str) -> None:
+    """
+    Write the library in the columnar format.
+
+    :param database: library records
+    :param path: path to the .kplc folder
+    """
+    os.makedirs(path, exist_ok=True)
+    arrays = dict()
+    arrays["codename"] = np.array([str(codename) for codename in database["Codename"]], dtype=str)
+    arrays["first_rt"] = database["1st RT"].to_numpy(dtype=float)
+    arrays["second_rt"] = database["2nd RT"].to_numpy(dtype=float)
+
+    spectra = list(database["Spectra"])
+    arrays["spectra_offsets"] = _offsets([len(spectrum) for spectrum in spectra])
+    arrays["spectra_mz"] = np.fromiter((key for spectrum in spectra for key in spectrum), dtype=np.int64)
+    arrays["spectra_intensity"], arrays["spectra_intensity_ints"] = _values(
+        [value for spectrum in spectra for value in spectrum.values()])
+
+    for column, key in (("calc_1stRT", "calc_1strt"), ("calc_2ndRT", "calc_2ndrt")):
+        history = list(database[column])
+        arrays[f"{key}_offsets"] = _offsets([len(values) for values in history])
+        arrays[f"{key}_values"] = np.fromiter((value for values in history for value in values), dtype=float)
+
+    calc_spectra = list(database["calc_spectra"])
+    arrays["calc_spectra_offsets"] = _offsets([len(spectrum) for spectrum in calc_spectra])
+    arrays["calc_spectra_mz"] = np.fromiter((key for spectrum in calc_spectra for key in spectrum), dtype=np.int64)
+    arrays["calc_spectra_value_offsets"] = _offsets([len(values) for spectrum in calc_spectra
+                                                     for values in spectrum.values()])
+    arrays["calc_spectra_values"], arrays["calc_spectra_values_ints"] = _values(
+        [value for spectrum in calc_spectra for values in spectrum.values() for value in values])
+
+    names = list(database["Name"])
+    arrays["name_ids"], name_table = _intern(names)
+    arrays["name_table_offsets"], arrays["name_table"] = _string_table(name_table)
+
+    found = list(database["Found"])
+    arrays["found_offsets"] = _offsets([len(files) for files in found])
+    arrays["found_ids"], found_table = _intern([file for files in found for file in files])
+    arrays["found_table_offsets"], arrays["found_table"] = _string_table(found_table)
+
+    for key, array in arrays.items():
+        np.save(f"{path}{os.sep}{key}.npy", array)
+    meta = {"format": "kplc", "version": FORMAT_VERSION, "records": len(database),
+            "name_type": "bytes" if all(isinstance(name, bytes) for name in name_table) else "str"}
+    with open(f"{path}{os.sep}meta.json", "w") as j:
+        j.write(json.dumps(meta, indent=1))
+
+
+class ColumnarLibrary:
+    """Read-only view of a library stored in the columnar format.
+
+    Arrays are memory mapped on first access, columns are decoded to Python objects only when requested.
+    """
+
+    def __init__(self, path: str):
+        """
+        Open the library.
+
+        :param path: path to the .kplc folder
+        """
+        self.path = path
+        with open(f"{path}{os.sep}meta.json", "r") as j:
+            self.meta = json.loads(j.read())
+        if self.meta.get("format") != "kplc" or self.meta.get("version", 0) > FORMAT_VERSION:
+            raise ValueError(f"{path} is not a supported kpl columnar library.")
+        self.__arrays = {}
+
+    def __len__(self) -> int:
+        """Number of records"""
+        return self.meta["records"]
+
+    def array(self, key: str) -> np.ndarray:
+        """
+        Get the stored array (memory mapped).
+
+        :param key: name of the array
+        :returns: read-only array
+        """
+        if key not in self.__arrays:
+            self.__arrays[key] = np.load(f"{self.path}{os.sep}{key}.npy", mmap_mode="r")
+        return self.__arrays[key]
+
+    def values(self, key: str, positions: np.ndarray = None) -> list:
+        """
+        Decode stored numbers, values stored as integers are converted back.
+
+        :param key: name of the array (spectra_intensity or calc_spectra_values)
+        :param positions: positions of the values to decode (see gather), all values if None
+        :returns: list of numbers
+        """
+        values, ints = self.array(key), self.array(f"{key}_ints")
+        if positions is not None:
+            values, ints = values[positions], np.flatnonzero(np.isin(positions, ints))
+        values = values.tolist()
+        for position in ints.tolist():
+            values[position] = int(values[position])
+        return values
+
+    @staticmethod
+    def gather(offsets: np.ndarray, rows: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Find the values of the selected rows of a ragged array.
+
+        :param offsets: offsets of the ragged array
+        :param rows: positions of the selected rows, all rows if None
+        :returns: positions of their values in the flat array (None for all rows) and their offsets
+        """
+        if rows is None:
+            return None, offsets
+        starts = offsets[rows]
+        lengths = offsets[rows + 1] - starts
+        selected = _offsets(lengths)
+        return np.repeat(starts - selected[:-1], lengths) + np.arange(selected[-1]), selected
+
+    def strings(self, key: str) -> list:
+        """
+        Decode the interned string table.
+
+        :param key: name of the table (name_table or found_table)
+        :returns: list of strings (bytes for names stored as bytes)
+        """
+        blob = self.array(key).tobytes()
+        offsets = self.array(f"{key}_offsets").tolist()
+        as_bytes = key == "name_table" and self.meta["name_type"] == "bytes"
+        return [blob[start:stop] if as_bytes else blob[start:stop].decode("utf-8")
+                for start, stop in zip(offsets[:-1], offsets[1:])]
+
+    def column(self, column: str, rows: np.ndarray = None) -> list:
+        """
+        Decode one column of the library to Python objects.
+
+        :param column: name of the library column
+        :param rows: positions of the records to decode, all records if None
+        :returns: list of values in the order of the records (of rows)
+        """
+        def take(key: str, positions: np.ndarray = None) -> np.ndarray:
+            return self.array(key) if positions is None else self.array(key)[positions]
+
+        if column == "Codename":
+            return take("codename", rows).tolist()
+        if column in ("1st RT", "2nd RT"):
+            return take("first_rt" if column == "1st RT" else "second_rt", rows).tolist()
+        if column == "Name":
+            table = self.strings("name_table")
+            return [table[ix] if ix >= 0 else np.nan for ix in take("name_ids", rows).tolist()]
+        if column == "Found":
+            table = self.strings("found_table")
+            positions, offsets = self.gather(self.array("found_offsets"), rows)
+            return self.__split([table[ix] for ix in take("found_ids", positions).tolist()], offsets)
+        if column == "Spectra":
+            positions, offsets = self.gather(self.array("spectra_offsets"), rows)
+            return [dict(zip(masses, values)) for masses, values in
+                    zip(self.__split(take("spectra_mz", positions).tolist(), offsets),
+                        self.__split(self.values("spectra_intensity", positions), offsets))]
+        if column in ("calc_1stRT", "calc_2ndRT"):
+            key = column.lower()
+            positions, offsets = self.gather(self.array(f"{key}_offsets"), rows)
+            return self.__split(take(f"{key}_values", positions).tolist(), offsets)
+        if column == "calc_spectra":
+            groups, offsets = self.gather(self.array("calc_spectra_offsets"), rows)
+            positions, value_offsets = self.gather(self.array("calc_spectra_value_offsets"), groups)
+            values = self.__split(self.values("calc_spectra_values", positions), value_offsets)
+            return [dict(zip(masses, values)) for masses, values in
+                    zip(self.__split(take("calc_spectra_mz", groups).tolist(), offsets),
+                        self.__split(values, offsets))]
+        raise KeyError(column)
+
+    def record(self, row: int) -> dict:
+        """
+        Decode one record without touching the rest of the library.
+
+        :param row: position of the record
+        :returns: record as a dict of library columns
+        """
+        def ragged(key: str, offsets_key: str, start: int = None, stop: int = None) -> list:
+            offsets = self.array(offsets_key)
+            start, stop = (offsets[row], offsets[row + 1]) if start is None else (start, stop)
+            values = self.array(key)[start:stop].tolist()
+            if key in ("spectra_intensity", "calc_spectra_values"):
+                ints = self.array(f"{key}_ints")
+                for position in ints[np.searchsorted(ints, start):np.searchsorted(ints, stop)].tolist():
+                    values[position - start] = int(values[position - start])
+            return values
+
+        value_offsets = self.array("calc_spectra_value_offsets")
+        group_start, group_stop = self.array("calc_spectra_offsets")[row:row + 2]
+        name_id = int(self.array("name_ids")[row])
+        found_table = self.strings("found_table")
+        return {"Codename": str(self.array("codename")[row]),
+                "1st RT": float(self.array("first_rt")[row]),
+                "2nd RT": float(self.array("second_rt")[row]),
+                "Spectra": dict(zip(ragged("spectra_mz", "spectra_offsets"),
+                                    ragged("spectra_intensity", "spectra_offsets"))),
+                "Found": [found_table[ix] for ix in ragged("found_ids", "found_offsets")],
+                "Name": self.strings("name_table")[name_id] if name_id >= 0 else np.nan,
+                "calc_1stRT": ragged("calc_1strt_values", "calc_1strt_offsets"),
+                "calc_2ndRT": ragged("calc_2ndrt_values", "calc_2ndrt_offsets"),
+                "calc_spectra": {int(mass): ragged("calc_spectra_values", "calc_spectra_value_offsets",
+                                                   value_offsets[group], value_offsets[group + 1])
+                                 for mass, group in zip(self.array("calc_spectra_mz")[group_start:group_stop],
+                                                        range(group_start, group_stop))}}
+
+    def to_frame(self, columns: list = None, rows: np.ndarray = None) -> pd.DataFrame:
+        """
+        Decode the library (or selected columns and records) to a DataFrame.
+
+        :param columns: library columns to decode, all columns if not set
+        :param rows: positions of the records to decode, all records if not set
+        :returns: library records
+        """
+        columns = COLUMNS if columns is None else columns
+        rows = None if rows is None else np.asarray(rows, dtype=np.int64)
+        database = pd.DataFrame({column: self.column(column, rows) for column in columns}, columns=columns)
+        return database.astype({column: object for column in columns if column not in ("1st RT", "2nd RT")})
+
+    @staticmethod
+    def __split(values: list, offsets: np.ndarray) -> list:
+        """Split flat list of values into lists by offsets."""
+        offsets = offsets.tolist()
+        return [values[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
+
+
+def next_codename(codenames) -> int:
+    """
+    Get the number of the codename following the highest valid codename (MX + number) of the records.
+
+    :param codenames: codenames of the records
+    :returns: number of the next codename, 0 if there is no valid codename
+    """
+    number = 0
+    for codename in codenames:
+        try:
+            number = max(number, int(codename.split("X")[1]) + 1)
+        except (AttributeError, IndexError, ValueError):
+            pass
+    return number
+
+
+def folder_size(path: str) -> int:
+    """
+    Get the stored size of the folder.
+
+    :param path: path to the folder
+    :returns: size of the files in bytes
+    """
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def shard_range(first_rt: np.ndarray):
+    """
+    Get the 1st RT range of the shard (records without the retention time are never in a search window).
+
+    :param first_rt: retention times of the records in the first dimension
+    :returns: [minimum, maximum], None if no record has the retention time
+    """
+    first_rt = np.asarray(first_rt, dtype=float)
+    first_rt = first_rt[~np.isnan(first_rt)]
+    return [float(first_rt.min()), float(first_rt.max())] if len(first_rt) else None
+
+
+def write_shard(database: pd.DataFrame, rows: np.ndarray, path: str) -> dict:
+    """
+    Write one shard, an existing shard is replaced only once the new one is written.
+
+    :param database: records of the shard
+    :param rows: positions of the records in the library
+    :param path: path to the shard folder
+    :returns: entry of the shard manifest
+    """
+    staging = f"{path.rstrip(os.sep)}.tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    write_columnar(database, staging)
+    np.save(f"{staging}{os.sep}rows.npy", np.asarray(rows, dtype=np.int64))
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(staging, path)
+    return {"name": os.path.basename(path.rstrip(os.sep)), "records": len(database),
+            "first_rt": shard_range(database["1st RT"].to_numpy(dtype=float)), "bytes": folder_size(path)}
+
+
+def write_shard_manifest(path: str, shards: list, records: int, codename: int) -> None:
+    """
+    Write the shard manifest and remove the shards which are not in it.
+
+    :param path: path to the .kpls folder
+    :param shards: entries of the shards (see write_shard)
+    :param records: number of records of the library
+    :param codename: number of the next codename of the library (see next_codename)
+    """
+    meta = {"format": "kpls", "version": SHARDS_VERSION, "records": records, "next_codename": codename,
+            "shards": shards}
+    with open(f"{path}{os.sep}shards.json", "w") as j:
+        j.write(json.dumps(meta, indent=1))
+    names = {shard["name"] for shard in shards}
+    for entry in os.scandir(path):
+        if entry.is_dir() and entry.name.startswith("shard_") and entry.name not in names:
+            shutil.rmtree(entry.path)
+
+
+def write_sharded(database: pd.DataFrame, path: str, shard_records: int = SHARD_RECORDS) -> None:
+    """
+    Write the library split into shards of consecutive retention times in the first dimension.
+
+    :param database: library records
+    :param path: path to the .kpls folder
+    :param shard_records: number of records in each shard
+    """
+    os.makedirs(path, exist_ok=True)
+    database = database.reset_index(drop=True)
+    # records without the retention time sort last
+    order = np.argsort(database["1st RT"].to_numpy(dtype=float), kind="stable")
+    shards = []
+    for number, start in enumerate(range(0, max(len(order), 1), shard_records)):
+        rows = order[start:start + shard_records]
+        shards.append(write_shard(database.iloc[rows].reset_index(drop=True), rows,
+                                  f"{path}{os.sep}shard_{number:05d}.kplc"))
+    write_shard_manifest(path, shards, len(database), next_codename(database["Codename"]))
+
+
+class ShardedStore:
+    """Read-only view of a library stored in RT shards."""
+
+    def __init__(self, path: str):
+        """
+        Open the library (only the shard manifest is read).
+
+        :param path: path to the .kpls folder
+        """
+        self.path = path.rstrip(os.sep)
+        with open(f"{self.path}{os.sep}shards.json", "r") as j:
+            self.meta = json.loads(j.read())
+        if self.meta.get("format") != "kpls" or self.meta.get("version", 0) > SHARDS_VERSION:
+            raise ValueError(f"{path} is not a supported kpl sharded library.")
+
+    def __len__(self) -> int:
+        """Number of records"""
+        return self.meta["records"]
+
+    @property
+    def shards(self) -> list:
+        """Entries of the shard manifest (name, records, first_rt range, bytes)"""
+        return self.meta["shards"]
+
+    def shard_path(self, shard: int) -> str:
+        """
+        Get the path to the shard.
+
+        :param shard: number of the shard
+        :returns: path to the columnar store of the shard
+        """
+        return f"{self.path}{os.sep}{self.shards[shard]['name']}"
+
+    def rows(self, shard: int) -> np.ndarray:
+        """
+        Get the positions of the records of the shard in the library.
+
+        :param shard: number of the shard
+        :returns: positions in the order of the records of the shard
+        """
+        return np.load(f"{self.shard_path(shard)}{os.sep}rows.npy")
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Decode all shards to one DataFrame in the order of the library.
+
+        :returns: library records
+        """
+        frames = [ColumnarLibrary(self.shard_path(shard)).to_frame() for shard in range(len(self.shards))]
+        rows = np.concatenate([self.rows(shard) for shard in range(len(self.shards))])
+        database = pd.concat(frames, ignore_index=True).iloc[np.argsort(rows, kind="stable")]
+        return database.reset_index(drop=True)
+
+
+def read_text(path: str, chunksize: int = None):
+    """
+    Read the library exported to the tab separated text file.
+
+    :param path: path to the .txt library
+    :param chunksize: number of records in each chunk, the whole library is read if None
+    :returns: library records, generator of the chunks of records if chunksize is set
+    """
+    database = pd.read_csv(path, sep="\t", header=0, dtype={"Codename": str, "Name": str},
+                           float_precision="round_trip", chunksize=chunksize)
+    if chunksize is not None:
+        return (_decode_text(chunk) for chunk in database)
+    return _decode_text(database)
+
+
+def _decode_text(database: pd.DataFrame) -> pd.DataFrame:
+    """Convert the reprs of the text library back to Python objects."""
+    for column in ("Spectra", "Found", "calc_1stRT", "calc_2ndRT", "calc_spectra"):
+        database[column] = [ast.literal_eval(value) for value in database[column]]
+    database["Name"] = [ast.literal_eval(name) if isinstance(name, str) and name[:2] in ("b'", 'b"') else name
+                        for name in database["Name"]]
+    return database
+
+
+def read_library(path: str) -> pd.DataFrame:
+    """
+    Read the library in any supported format (.h5, .txt, .kplc or .kpls). All records are decoded, use ColumnarLibrary
+    or iter_library to read a part of a .kplc or .kpls library.
+
+    :param path: path to the library
+    :returns: library records
+    """
+    if path.rstrip(os.sep).split(".")[-1] == "kplc":
+        return ColumnarLibrary(path).to_frame()
+    if path.rstrip(os.sep).split(".")[-1] == "kpls":
+        return ShardedStore(path).to_frame()
+    if path.split(".")[-1] == "txt":
+        return read_text(path)
+    return pd.read_hdf(path)
+
+
+def iter_library(path: str, chunk_records: int = SHARD_RECORDS, by_rt: bool = False):
+    """
+    Read the library in chunks of records, only one chunk is decoded at a time. The .h5 libraries (and .txt libraries
+    read by_rt) are read whole first, .kpls libraries are read shard by shard regardless of the order.
+
+    :param path: path to the library (.h5, .txt, .kplc or .kpls)
+    :param chunk_records: number of records in each chunk
+    :param by_rt: chunks of consecutive retention times in the first dimension (records without it last), the order of
+    the library otherwise
+    :returns: generator of (records, positions of the records in the library)
+    """
+    extension = path.rstrip(os.sep).split(".")[-1]
+    if extension == "kpls":
+        store = ShardedStore(path)
+        for shard in range(len(store.shards)):
+            yield ColumnarLibrary(store.shard_path(shard)).to_frame(), store.rows(shard)
+        return
+    if extension == "txt" and not by_rt:
+        start = 0
+        for chunk in read_text(path, chunk_records):
+            yield chunk.reset_index(drop=True), np.arange(start, start + len(chunk))
+            start += len(chunk)
+        return
+    if extension == "kplc":
+        library = ColumnarLibrary(path)
+        first_rt = library.array("first_rt")
+    else:
+        library = read_library(path).reset_index(drop=True)
+        first_rt = library["1st RT"].to_numpy(dtype=float)
+    order = np.argsort(first_rt, kind="stable") if by_rt else np.arange(len(first_rt))
+    for start in range(0, len(order), chunk_records):
+        rows = order[start:start + chunk_records]
+        if extension == "kplc":
+            yield library.to_frame(rows=rows), rows
+        else:
+            yield library.iloc[rows].reset_index(drop=True), rows
+
+
+def write_library(database: pd.DataFrame, path: str) -> None:
+    """
+    Write the library in the format given by the file extension (.h5, .txt, .kplc or .kpls).
+
+    :param database: library records
+    :param path: path to the library
+    """
+    if path.rstrip(os.sep).split(".")[-1] == "kplc":
+        write_columnar(database, path)
+    elif path.rstrip(os.sep).split(".")[-1] == "kpls":
+        write_sharded(database, path)
+    elif path.split(".")[-1] == "txt":
+        database.to_csv(path, sep="\t", index=False)
+    else:
+        database.to_hdf(path, key="main_database", mode='w', format='fixed', data_columns=True)
+
+
+def manifest_path(path: str) -> str:
+    """
+    Get the path to the manifest of ingested chromatograms of the library (inside a .kplc or .kpls folder, next to .h5
+    and .txt).
+
+    :param path: path to the library
+    :returns: path to the manifest
+    """
+    if path.rstrip(os.sep).split(".")[-1] in ("kplc", "kpls"):
+        return f"{path.rstrip(os.sep)}{os.sep}manifest.json"
+    return f"{path}.manifest.json"
+
+
+def load_manifest(path: str):
+    """
+    Load the stored manifest of the library: a list of entries, or {"next_codename", "entries"} if the codename counter
+    is stored with them (see write_manifest).
+
+    :param path: path to the library
+    :returns: stored manifest, empty list if the library has no manifest
+    """
+    if not os.path.exists(manifest_path(path)):
+        return []
+    with open(manifest_path(path), "r") as j:
+        return json.loads(j.read())
+
+
+def read_manifest(path: str) -> list:
+    """
+    Read the manifest of ingested chromatograms of the library.
+
+    :param path: path to the library
+    :returns: manifest entries, empty if the library has no manifest
+    """
+    manifest = load_manifest(path)
+    return manifest["entries"] if isinstance(manifest, dict) else manifest
+
+
+def read_codename(path: str) -> int:
+    """
+    Read the codename counter stored with the manifest of the library.
+
+    :param path: path to the library
+    :returns: number of the next codename, 0 if it is not stored
+    """
+    manifest = load_manifest(path)
+    return manifest["next_codename"] if isinstance(manifest, dict) else 0
+
+
+def write_manifest(entries: list, path: str, codename: int = 0) -> None:
+    """
+    Write the manifest of ingested chromatograms of the library (a stale manifest is removed if there is nothing to
+    store).
+
+    :param entries: manifest entries
+    :param path: path to the library
+    :param codename: number of the next codename, stored with the entries if set. Needed when codenames of removed
+    records (e.g. merged by dedupe) are above the codenames of the records, so they are never issued again.
+    """
+    if entries or codename:
+        with open(manifest_path(path), "w") as j:
+            j.write(json.dumps({"next_codename": codename, "entries": entries} if codename else entries, indent=1))
+    elif os.path.exists(manifest_path(path)):
+        os.remove(manifest_path(path))
+
+
+def convert(source: str, target: str) -> None:
+    """
+    Convert the library between the supported formats.
+
+    :param source: path to the source library
+    :param target: path to the converted library
+    """
+    write_library(read_library(source), target)
+    write_manifest(read_manifest(source), target, read_codename(source))
+
+
+if __name__ == "__main__":
+    convert(sys.argv[1], sys.argv[2])
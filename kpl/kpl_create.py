@@ -1,16 +1,19 @@
 # -*- coding: utf-8 -*-
 """Script for creation of the kpl."""
-import abc
 import datetime
-import json
 import logging
 import os
-import pandas as pd
-import statistics
+import sys
 import tkinter as tk
 from tkinter.filedialog import askdirectory
 
-import helper
+try:
+    import log_pipeline
+except ImportError:  # started from the tool folder, the modules shared by the tools are in common/
+    sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+    import log_pipeline
+
+from kpl_engine import KPLCreateEngine, export_library
 
 
 class KPLCreate:
@@ -18,19 +21,12 @@ class KPLCreate:
 
     def __init__(self):
         """Initialize the kpl base class"""
-        self.__main_database = pd.DataFrame(columns=["Codename", "1st RT", "2nd RT", "Spectra", "Found", "Name",
-                                                     "calc_1stRT", "calc_2ndRT", "calc_spectra"])
         self.__input_path = f"{os.getcwd()}{os.sep}data_kpl"
         self.__result_path = f"{os.getcwd()}{os.sep}results"
-        with open(f"{os.getcwd()}{os.sep}config.txt", 'r') as j:
-            self.__config_file = json.loads(j.read())
-        self.__df = pd.DataFrame()
-        logging.basicConfig(filename=f"logs{os.sep}log_create_new_kpl_{datetime.date.today()}_"
-                                     f"{datetime.datetime.now().strftime('%H_%M_%S')}.log",
-                            level=logging.DEBUG,
-                            format="%(asctime)s %(message)s", filemode="w"
-                            )
+        log_pipeline.setup([logging.FileHandler(f"logs{os.sep}log_create_new_kpl_{datetime.date.today()}_"
+                                                f"{datetime.datetime.now().strftime('%H_%M_%S')}.log", mode="w")])
         self.master = tk.Tk()
+        self.__export = tk.BooleanVar(self.master, value=False)
         self.setup_window()
         self.master.mainloop()
 
@@ -41,114 +37,26 @@ class KPLCreate:
         top_lvl.geometry("300x250")
         proc_file = tk.Label(top_lvl, text="Starting...")
         proc_file.grid(row=0, column=1, pady=10)
-        files = helper.get_files(self.__input_path)
-        for file in files:
-            proc_file.config(text=f"Processing file: {file.split(f'{os.sep}')[-1].split('.')[0]}.")
+
+        def on_file(name: str) -> None:
+            proc_file.config(text=f"Processing file: {name}.")
             proc_file.update()
-            logging.info(f"Processing file: {file.split(f'{os.sep}')[-1].split('.')[0]}.")
-            print(f"Processing file: {file.split(f'{os.sep}')[-1].split('.')[0]}.")
-            self.__df = pd.read_csv(file, sep="\t", header=0, encoding="latin-1")
-            helper.check_formatting(self.__df)
-            self.__df["Codename"] = ""
-            for row in self.__df.index:
-                if self.__main_database.empty:
-                    logging.info("Initializing the new database with row 0")
-                    init_row = {"Codename": "MX00000",
-                                "1st RT": float(self.__df.at[row, "1st Dimension Time (s)"]),
-                                "2nd RT": float(self.__df.at[row, "2nd Dimension Time (s)"]),
-                                "Spectra": helper.transfer_spectrum(self.__df.at[row, "Spectra"].split(" "),
-                                                                    transform=False),
-                                "Found": [file.split(f"{os.sep}")[-1].split(".")[0]],
-                                "Name": self.__df.at[row, "Name"],
-                                "calc_1stRT": [float(self.__df.at[row, "1st Dimension Time (s)"])],
-                                "calc_2ndRT": [float(self.__df.at[row, "2nd Dimension Time (s)"])],
-                                "calc_spectra": helper.transfer_spectrum(self.__df.at[row, "Spectra"].split(" "),
-                                                                         transform=False, do_list=True)}
-                    self.__df.at[row, "Codename"] = "MX00000"
-                    self.__main_database = self.__main_database.append(init_row, ignore_index=True)
-                    continue
-                if self.__df.at[row, "Name"] not in self.__main_database["Name"].values:
-                    self.add_new_row(row, file)
-                else:
-                    self.update_record(file, self.__df.at[row, "Name"], row)
-
-            logging.info(f"File done: {file.split(f'{os.sep}')[-1].split('.')[0]}.")
-            print(f"File done: {file.split(f'{os.sep}')[-1].split('.')[0]}.")
-            self.__df.set_index("Codename", inplace=True)
-            self.__df.to_csv(f"{self.__result_path}{os.sep}{file.split(f'{os.sep}')[-1]}", sep="\t")
-
-        logging.info(f"The core database was created successfully")
-        print(f"The core database was created successfully")
+
+        engine = KPLCreateEngine(self.__input_path, self.__result_path, on_file=on_file,
+                                 report_path=f"logs{os.sep}report_create_new_kpl_{datetime.date.today()}_"
+                                             f"{datetime.datetime.now().strftime('%H_%M_%S')}.json")
+        library_path = f"Core_KPL_{datetime.date.today()}.h5"
+        engine.run(library_path)
+        if self.__export.get():
+            proc_file.config(text="Exporting the library...")
+            proc_file.update()
+            export_library(library_path, f"exported_Core_KPL_{datetime.date.today()}.tsv")
         proc_file.config(text="All done!")
         proc_file.update()
 
-        self.__main_database.to_csv("test.txt", sep="\t")
-        self.__main_database.to_hdf(f"Core_KPL_{datetime.date.today()}.h5", key="main_database", mode='w',
-                                    format='fixed', data_columns=True)
         top_lvl.destroy()
         self.master.destroy()
 
-    def add_new_row(self, row: int, file: str) -> None:
-        """
-        Add a new line to kpl.
-
-        param file: name of the inspected chromatogram
-        param row: inspected row
-        """
-        newname = "MX" + str(int((self.__main_database.iat[-1, 0].split("X")[1])) + 1).zfill(5)
-        try:
-            spectra = helper.transfer_spectrum(self.__df.at[row, "Spectra"].split(" "), transform=False)
-            spectra_lst = helper.transfer_spectrum(self.__df.at[row, "Spectra"].split(" "),
-                                                   transform=False, do_list=True)
-        except AttributeError:
-            spectra = {0: 0}
-            spectra_lst = {0: [0]}
-        new_row = {"Codename": newname,
-                   "1st RT": float(self.__df.at[row, "1st Dimension Time (s)"]),
-                   "2nd RT": float(self.__df.at[row, "2nd Dimension Time (s)"]),
-                   "Spectra": spectra,
-                   "Found": [file.split(f"{os.sep}")[-1].split(".")[0]],
-                   "Name": self.__df.at[row, "Name"],
-                   "calc_1stRT": [float(self.__df.at[row, "1st Dimension Time (s)"])],
-                   "calc_2ndRT": [float(self.__df.at[row, "2nd Dimension Time (s)"])],
-                   "calc_spectra": spectra_lst}
-        new_row = pd.Series(new_row).to_frame().T
-        self.__main_database = pd.concat([self.__main_database, new_row], ignore_index=True)
-        self.__df.at[row, "Codename"] = newname
-        logging.info(f"New record added: {newname}.")
-        print(f"New record added: {newname}.")
-
-    def update_record(self, file: str, name: str, row: int) -> None:
-        """Update record of the database hit.
-
-        param file: inspected file
-        param name: found name
-        param row: df index of the match
-        """
-        match = self.__main_database.where(self.__main_database == name).dropna(how='all'). \
-            dropna(how='all', axis=1).index[0]
-        self.__main_database.at[match, "calc_1stRT"].append(float(self.__df.at[row, "1st Dimension Time (s)"]))
-        self.__main_database.at[match, "1st RT"] = statistics.median(self.__main_database.at[match, "calc_1stRT"])
-        self.__main_database.at[match, "calc_2ndRT"].append(float(self.__df.at[row, "2nd Dimension Time (s)"]))
-        self.__main_database.at[match, "2nd RT"] = statistics.median(self.__main_database.at[match, "calc_2ndRT"])
-        self.__main_database.at[match, "Found"].append(file.split(f"{os.sep}")[-1].split(".")[0])
-        update_calc_spectra = self.__main_database.at[match, "calc_spectra"]
-        try:
-            df_spectra = helper.transfer_spectrum(self.__df.at[row, "Spectra"].split(" "), transform=False)
-        except AttributeError:
-            df_spectra = {0: 0}
-        for key_df in df_spectra:
-            if key_df in update_calc_spectra.keys():
-                update_calc_spectra[key_df].append(df_spectra[key_df])
-            else:
-                update_calc_spectra[key_df] = [df_spectra[key_df]]
-        self.__main_database.at[match, "calc_spectra"] = update_calc_spectra
-        self.__main_database.at[match, "Spectra"] = {k: statistics.median(v) for k, v in
-                                                     self.__main_database.at[match, "calc_spectra"].items()}
-        self.__df.at[row, "Codename"] = self.__main_database.at[match, "Codename"]
-        logging.info(f"{self.__df.at[row, 'Name']} was identified as the record "
-                     f"{self.__main_database.at[match, 'Codename']} ({self.__main_database.at[match, 'Name']})")
-
     def setup_window(self):
         """Set up GUI window."""
         self.master.title("Core Library Creator")
@@ -172,6 +80,10 @@ class KPLCreate:
                                command=lambda: self.get_path(out_entry, False))
         out_button.grid(row=1, column=2, pady=10)
 
+        # optional export of the created library
+        tk.Checkbutton(self.master, text="Export the created library to .tsv",
+                       variable=self.__export).grid(row=2, column=1, sticky="W", pady=10)
+
         # create database button
         create_button = tk.Button(self.master, text="Create new \ncore database", command=self.process_files)
         create_button.grid(row=4, column=1, pady=10)
@@ -0,0 +1,903 @@
+# -*- coding: utf-8 -*-
+"""Processing engine of the kpl tool, shared by the GUI windows and the command line interface (no GUI required)."""
+
+from concurrent.futures import ProcessPoolExecutor
+import fnmatch
+import logging
+import numpy as np
+import os
+import pandas as pd
+import sys
+from typing import Callable, Optional
+
+try:
+    import log_pipeline
+except ImportError:  # imported from the tool folder (e.g. by main.py), the modules shared by the tools are in common/
+    sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+    import log_pipeline
+
+import export_cache
+import helper
+import kpl_columnar
+import kpl_export
+import kpl_ingest
+from export_cache import ExportCache
+from kpl_journal import KPLJournal
+from kpl_library import KPLLibrary, LibrarySnapshot, RTIndex, ShardedKPLLibrary
+from kpl_manifest import Manifest
+from kpl_stats import RunStats, profile
+
+MATCH_THRESHOLD = 90
+# records of a library scoring above it are merged by dedupe_library (split by peaks just below MATCH_THRESHOLD)
+DEDUPE_THRESHOLD = 85
+DEDUPE_BLOCK = 512
+# best records of each peak written by search_library
+SEARCH_TOP = 5
+
+_SNAPSHOT = None
+_RECALL_CHECK = False
+_PARSER = "c"
+_CACHE = None
+
+
+def score_window(source, spectrum: dict, rows: np.ndarray, stats: RunStats, recall_check: bool = False) -> dict:
+    """
+    Score the spectrum against the records of the search window. Records which cannot exceed the match threshold are
+    pruned by the key ion index of the library (or which are not found by the approximate search, see
+    kpl_library.SpectraMatrix) and get the similarity -inf.
+
+    param source: library or its snapshot
+    param spectrum: inspected spectrum (not transformed)
+    param rows: positions of the records in the search window
+    param stats: statistics of the run, counts the similarity calls and pruned records
+    param recall_check: score the pruned records as well and report those which would match (the results are then the
+    same as without pruning)
+    returns: {record: similarity}
+    """
+    scores, kept = source.score_pruned(spectrum, rows, MATCH_THRESHOLD)
+    stats.count("similarity_calls", int(kept.sum()))
+    stats.count("pruned_candidates", len(rows) - int(kept.sum()))
+    if recall_check and not kept.all():
+        pruned = rows[~kept]
+        full = source.score(spectrum, pruned)
+        stats.count("recall_checked", len(pruned))
+        missed = full > MATCH_THRESHOLD
+        if missed.any():
+            stats.count("recall_misses", int(missed.sum()))
+            logging.warning("Key ion index pruned matching records %s (similarity %s).", pruned[missed].tolist(),
+                            full[missed].tolist())
+        scores[~kept] = full
+    return dict(zip(rows.tolist(), scores.tolist()))
+
+
+def read_chromatogram(file: str, stats: RunStats, parser: str = "c", cache: Optional[ExportCache] = None,
+                      digest: Optional[str] = None) -> tuple[pd.DataFrame, tuple]:
+    """
+    Read the chromatogram and parse its spectra, through the cache of parsed exports if given.
+
+    The parsed spectra are stored in the cache with the columns of the chromatogram, so a cached chromatogram is not
+    parsed at all.
+
+    param file: path to the chromatogram
+    param stats: statistics of the run, times the reading (read_export), the format check (check_formatting) and the
+    parsing of the spectra (parse_spectra) and counts the cache hits
+    param parser: parser of the chromatogram, "c" or "pyarrow" (see kpl_ingest)
+    param cache: cache of parsed exports (see export_cache), the chromatogram is always parsed if None
+    param digest: sha256 hex digest of the chromatogram if known (see kpl_manifest)
+    returns: formatted chromatogram and its parsed spectra (see helper.parse_spectra)
+    """
+    if cache is None:
+        with stats.stage("read_export"):
+            raw = kpl_ingest.read_raw(file, engine=parser)
+        with stats.stage("check_formatting"):
+            df = kpl_ingest.format_export(raw)
+        with stats.stage("parse_spectra"):
+            return df, helper.parse_spectra(df["Spectra"])
+    with stats.stage("read_export"):
+        digest = digest or export_cache.file_hash(file)
+        cached = cache.load(digest, kpl_ingest.ENCODING)
+        raw, arrays = (kpl_ingest.read_raw(file, engine=parser), {}) if cached is None else cached
+    if all(key in arrays for key in kpl_ingest.SPECTRA_ARRAYS):
+        stats.count("cache_hits")
+        with stats.stage("check_formatting"):
+            return kpl_ingest.format_export(raw), tuple(arrays[key] for key in kpl_ingest.SPECTRA_ARRAYS)
+    stats.count("cache_misses")
+    # the raw export is stored in the cache, it is formatted on every read
+    with stats.stage("check_formatting"):
+        df = kpl_ingest.format_export(raw.copy())
+    with stats.stage("parse_spectra"):
+        spectra = helper.parse_spectra(df["Spectra"])
+    with stats.stage("cache_store"):
+        cache.store(digest, kpl_ingest.ENCODING, raw, dict(zip(kpl_ingest.SPECTRA_ARRAYS, spectra)))
+    return df, spectra
+
+
+def match_file(file: str, snapshot: LibrarySnapshot, recall_check: bool = False, parser: str = "c",
+               cache: Optional[ExportCache] = None, digest: Optional[str] = None) \
+        -> tuple[pd.DataFrame, tuple, list, dict]:
+    """
+    Parse the chromatogram and score each peak against the records in its search window.
+
+    param file: path to the chromatogram
+    param snapshot: snapshot of the library, or the library itself when matched in its process
+    param recall_check: check the records pruned by the key ion index (see score_window)
+    param parser: parser of the chromatogram, "c" or "pyarrow" (see kpl_ingest)
+    param cache: cache of parsed exports (see export_cache), the chromatogram is always parsed if None
+    param digest: sha256 hex digest of the chromatogram if known (see kpl_manifest)
+    returns: formatted chromatogram, its parsed spectra (see helper.parse_spectra), {record: similarity} for each peak
+    and statistics of the matching (see kpl_stats)
+    """
+    stats = RunStats()
+    df, spectra = read_chromatogram(file, stats, parser, cache, digest)
+    matches = [{} for _ in df.index]
+    # peaks are scored in the order of retention times, so the records of a sharded library are visited shard by shard
+    for position in np.argsort(df["1st Dimension Time (s)"].to_numpy(dtype=float), kind="stable").tolist():
+        row = df.index[position]
+        with stats.stage("map.window"):
+            database_foc = snapshot.window(float(df.at[row, "1st Dimension Time (s)"]),
+                                           float(df.at[row, "2nd Dimension Time (s)"]))
+        spectrum = {} if spectra[3][row] else helper.spectrum_at(spectra, row)
+        if spectrum and len(database_foc):
+            with stats.stage("map.score"):
+                matches[position] = score_window(snapshot, spectrum, database_foc, stats, recall_check)
+    logging.debug("Matched %s: %d peaks, %d similarity calls.", os.path.basename(file), len(df),
+                  stats.counters.get("similarity_calls", 0))
+    return df, spectra, matches, stats.to_dict()
+
+
+def _init_worker(snapshot: LibrarySnapshot, log_queue, level: int, recall_check: bool, parser: str,
+                 cache: Optional[ExportCache]) -> None:
+    """Store the library snapshot in the worker process and log through the queue of the main process."""
+    global _SNAPSHOT, _RECALL_CHECK, _PARSER, _CACHE
+    _SNAPSHOT = snapshot
+    _RECALL_CHECK = recall_check
+    _PARSER = parser
+    _CACHE = cache
+    log_pipeline.setup_worker(log_queue, level)
+
+
+def _match_file_worker(file: str, digest: Optional[str]) -> tuple[pd.DataFrame, tuple, list, dict]:
+    """Match the file in the worker process."""
+    return match_file(file, _SNAPSHOT, _RECALL_CHECK, _PARSER, _CACHE, digest)
+
+
+def select_files(files: list, manifest: Manifest, echo: Callable[[str], None] = print) -> list:
+    """
+    Select the chromatograms which are not ingested in the library yet (new or changed files).
+
+    Files with the same content as an already ingested chromatogram (or as another selected file) are skipped and
+    reported.
+
+    param files: paths to the chromatograms
+    param manifest: manifest of the library
+    param echo: called with every progress message
+    returns: list of (path, manifest entry) of the selected chromatograms
+    """
+    selected, hashes = [], {}
+    for file in files:
+        entry, known = manifest.check(file)
+        known = known or hashes.get(entry["sha256"])
+        if known is not None:
+            logging.info("Skipping file %s, it was already processed as %s.", os.path.basename(file), known["file"])
+            echo(f"Skipping file {os.path.basename(file)}, it was already processed as {known['file']}.")
+            continue
+        hashes[entry["sha256"]] = entry
+        selected.append((file, entry))
+    logging.info("%d new files, %d files skipped.", len(selected), len(files) - len(selected))
+    echo(f"{len(selected)} new files, {len(files) - len(selected)} files skipped.")
+    return selected
+
+
+def file_summary(name: str, peaks: int, stats: RunStats, before: dict) -> str:
+    """
+    Summarize the processed chromatogram (logged instead of the result of every peak).
+
+    param name: name of the chromatogram
+    param peaks: number of peaks
+    param stats: statistics of the run
+    param before: counters of the run before the chromatogram was processed
+    returns: summary message
+    """
+    changes = {counter: stats.counters.get(counter, 0) - before.get(counter, 0)
+               for counter in ("new_records", "updated_records", "empty_spectra")}
+    message = (f"File done: {name}, {peaks} peaks, {changes['new_records']} new records, "
+               f"{changes['updated_records']} updated records")
+    if changes["empty_spectra"]:
+        message += f", {changes['empty_spectra']} empty spectra skipped"
+    return message + "."
+
+
+class KPLCreateEngine:
+    """Create a new kpl library from manually evaluated chromatograms."""
+
+    def __init__(self, input_path: str, result_path: str, echo: Callable[[str], None] = print,
+                 on_file: Optional[Callable[[str], None]] = None, report_path: Optional[str] = None,
+                 profile_path: Optional[str] = None, verbose: bool = False, parser: str = "c", cache: bool = True):
+        """
+        Initialize the create engine.
+
+        param input_path: folder with the chromatograms
+        param result_path: folder for the renamed chromatograms
+        param echo: called with every progress message
+        param on_file: called with the name of each chromatogram before it is processed
+        param report_path: path of the JSON report with the statistics of the run (see kpl_stats)
+        param profile_path: path of the cProfile dump of the run, the run is not profiled if None
+        param verbose: echo the result of every peak, otherwise only a summary of each chromatogram is echoed (the
+        results of the peaks are logged at DEBUG level)
+        param parser: parser of the chromatograms, "c" or "pyarrow" (see kpl_ingest)
+        param cache: read the chromatograms through the cache of parsed exports (see export_cache)
+        """
+        kpl_ingest.check_engine(parser)
+        self.__verbose = verbose
+        self.__parser = parser
+        self.__cache = ExportCache.default() if cache else None
+        self.__library = KPLLibrary()
+        self.__stats = RunStats()
+        self.__report_path = report_path
+        self.__profile_path = profile_path
+        self.__input_path = input_path
+        self.__result_path = result_path
+        self.__echo = echo
+        self.__on_file = on_file
+        self.__df = pd.DataFrame()
+        self.__spectra = helper.parse_spectra(pd.Series([], dtype=object))
+
+    @property
+    def library(self) -> KPLLibrary:
+        """The created library."""
+        return self.__library
+
+    @property
+    def stats(self) -> RunStats:
+        """Statistics of the run."""
+        return self.__stats
+
+    def run(self, library_path: str, base_path: Optional[str] = None) -> KPLLibrary:
+        """
+        Process all chromatograms of the input folder and save the created library.
+
+        Chromatograms already ingested in the library (see kpl_manifest) are skipped, so a run extending an existing
+        library processes only the new files. The statistics of the run are written to the log (and the JSON report).
+
+        param library_path: path of the created library (.h5, .txt, .kplc or .kpls)
+        param base_path: existing library which should be extended, a new library is created if None
+        returns: the created library
+        """
+        try:
+            with profile(self.__profile_path):
+                return self.__run(library_path, base_path)
+        finally:
+            self.__stats.report(self.__report_path)
+
+    def __run(self, library_path: str, base_path: Optional[str]) -> KPLLibrary:
+        """Process the chromatograms (see run)."""
+        if base_path is not None:
+            with self.__stats.stage("load"):
+                self.__library = KPLLibrary.load(base_path)
+        with self.__stats.stage("select_files"):
+            files = select_files(helper.get_files(self.__input_path), self.__library.manifest, self.__echo)
+        for file, entry in files:
+            if self.__on_file is not None:
+                self.__on_file(file.split(f'{os.sep}')[-1].split('.')[0])
+            logging.info("Processing file: %s.", file.split(os.sep)[-1].split(".")[0])
+            self.__echo(f"Processing file: {file.split(f'{os.sep}')[-1].split('.')[0]}.")
+            before = dict(self.__stats.counters)
+            self.__df, self.__spectra = read_chromatogram(file, self.__stats, self.__parser, self.__cache,
+                                                          entry["sha256"])
+            self.__stats.count("files")
+            self.__stats.count("peaks", len(self.__df))
+            self.__stats.observe("peaks_per_file", len(self.__df))
+            self.__df["Codename"] = ""
+            for row in self.__df.index:
+                if self.__library.empty:
+                    logging.debug("Initializing the new database with row 0")
+                    self.add_new_row(row, file)
+                    continue
+                with self.__stats.stage("name_lookup"):
+                    match = self.__library.name_row(self.__df.at[row, "Name"])
+                if match is None:
+                    self.add_new_row(row, file)
+                else:
+                    self.update_record(file, match, row)
+
+            with self.__stats.stage("flush"):
+                self.__library.flush()
+            summary = file_summary(file.split(os.sep)[-1].split(".")[0], len(self.__df), self.__stats, before)
+            logging.info(summary)
+            self.__echo(summary)
+            with self.__stats.stage("write_output"):
+                self.__df.set_index("Codename", inplace=True)
+                self.__df.to_csv(f"{self.__result_path}{os.sep}{file.split(f'{os.sep}')[-1]}", sep="\t")
+            self.__library.manifest.add(entry)
+
+        logging.info("The core database was created successfully")
+        self.__echo("The core database was created successfully")
+        with self.__stats.stage("save"):
+            self.__library.save(library_path)
+        return self.__library
+
+    def add_new_row(self, row: int, file: str) -> None:
+        """
+        Add a new line to kpl.
+
+        param file: name of the inspected chromatogram
+        param row: inspected row
+        """
+        newname = self.__library.new_codename()
+        spectra = helper.spectrum_at(self.__spectra, row)
+        spectra_lst = helper.spectrum_at(self.__spectra, row, do_list=True)
+        new_row = {"Codename": newname,
+                   "1st RT": float(self.__df.at[row, "1st Dimension Time (s)"]),
+                   "2nd RT": float(self.__df.at[row, "2nd Dimension Time (s)"]),
+                   "Spectra": spectra,
+                   "Found": [file.split(f"{os.sep}")[-1].split(".")[0]],
+                   "Name": self.__df.at[row, "Name"],
+                   "calc_1stRT": [float(self.__df.at[row, "1st Dimension Time (s)"])],
+                   "calc_2ndRT": [float(self.__df.at[row, "2nd Dimension Time (s)"])],
+                   "calc_spectra": spectra_lst}
+        with self.__stats.stage("add_record"):
+            self.__library.add_record(new_row)
+        self.__stats.count("new_records")
+        self.__df.at[row, "Codename"] = newname
+        logging.debug("New record added: %s.", newname)
+        if self.__verbose:
+            self.__echo(f"New record added: {newname}.")
+
+    def update_record(self, file: str, match: int, row: int) -> None:
+        """Update record of the database hit.
+
+        param file: inspected file
+        param match: id of the match line (the first record with the same name)
+        param row: df index of the match
+        """
+        with self.__stats.stage("update_record"):
+            self.__library.update_record(match, float(self.__df.at[row, "1st Dimension Time (s)"]),
+                                         float(self.__df.at[row, "2nd Dimension Time (s)"]),
+                                         helper.spectrum_at(self.__spectra, row),
+                                         file.split(f"{os.sep}")[-1].split(".")[0])
+        self.__stats.count("updated_records")
+        self.__df.at[row, "Codename"] = self.__library.get(match, "Codename")
+        logging.debug("%s was identified as the record %s (%s)", self.__df.at[row, "Name"],
+                      self.__df.at[row, "Codename"], self.__library.get(match, "Name"))
+
+
+class KPLCompareEngine:
+    """Compare chromatograms to an existing library and update it."""
+
+    def __init__(self, input_path: str, output_path: str, processes: int = 1, echo: Callable[[str], None] = print,
+                 on_file: Optional[Callable[[str], None]] = None, resume: bool = True,
+                 report_path: Optional[str] = None, profile_path: Optional[str] = None, verbose: bool = False,
+                 recall_check: bool = False, ann_recall: Optional[float] = None,
+                 shard_cache: int = ShardedKPLLibrary.CACHE_BYTES, parser: str = "c", cache: bool = True):
+        """
+        Initialize the compare engine.
+
+        param input_path: folder with the non-processed chromatograms
+        param output_path: folder for the renamed chromatograms
+        param processes: number of processes used for parsing and scoring of the chromatograms
+        param echo: called with every progress message
+        param on_file: called with the name of each chromatogram before it is processed
+        param resume: continue an interrupted run from its journal, the run starts over if False
+        param report_path: path of the JSON report with the statistics of the run (see kpl_stats)
+        param profile_path: path of the cProfile dump of the run (main process only), the run is not profiled if None
+        param verbose: echo the result of every peak, otherwise only a summary of each chromatogram is echoed (the
+        results of the peaks are logged at DEBUG level)
+        param recall_check: score the records pruned by the key ion index (or the approximate search) too and report
+        those which would match
+        param ann_recall: enable the approximate search of the spectra for very large libraries, recall of the records
+        with the similarity equal to the match threshold (see kpl_library.SpectraMatrix.approximate)
+        param shard_cache: memory cap in bytes of the loaded shards of a sharded library (.kpls), in each process
+        param parser: parser of the chromatograms, "c" or "pyarrow" (see kpl_ingest)
+        param cache: read the chromatograms through the cache of parsed exports (see export_cache)
+        """
+        kpl_ingest.check_engine(parser)
+        self.__verbose = verbose
+        self.__parser = parser
+        self.__cache = ExportCache.default() if cache else None
+        self.__shard_cache = shard_cache
+        self.__recall_check = recall_check
+        self.__ann_recall = ann_recall
+        self.__library = KPLLibrary()
+        self.__stats = RunStats()
+        self.__report_path = report_path
+        self.__profile_path = profile_path
+        self.__journal = None
+        self.__input_path = input_path
+        self.__output_path = output_path
+        self.__processes = processes
+        self.__resume = resume
+        self.__echo = echo
+        self.__on_file = on_file
+        self.__df = pd.DataFrame()
+        self.__spectra = helper.parse_spectra(pd.Series([], dtype=object))
+
+    @property
+    def library(self) -> KPLLibrary:
+        """The updated library."""
+        return self.__library
+
+    @property
+    def stats(self) -> RunStats:
+        """Statistics of the run (stage times of the map phase are summed over the worker processes)."""
+        return self.__stats
+
+    def run(self, library_path: str, save_path: str) -> KPLLibrary:
+        """
+        Compare all chromatograms of the input folder to the library and save the updated library.
+
+        Chromatograms already ingested in the library (see kpl_manifest) are skipped. The changes are written to a
+        journal next to the updated library after each chromatogram. If the run is interrupted, the next run with the
+        same library and save path replays the journal and continues with the first unfinished chromatogram. The journal
+        is removed once the updated library is saved. The statistics of the run are written to the log (and the JSON
+        report).
+
+        param library_path: path to the library (.h5, .txt, .kplc or .kpls, the shards of .kpls are loaded on demand)
+        param save_path: path of the updated library (.h5, .txt, .kplc or .kpls)
+        returns: the updated library
+        """
+        try:
+            with profile(self.__profile_path):
+                return self.__run(library_path, save_path)
+        finally:
+            self.__stats.report(self.__report_path)
+
+    def __run(self, library_path: str, save_path: str) -> KPLLibrary:
+        """Compare the chromatograms (see run)."""
+        self.__echo(library_path)
+        with self.__stats.stage("load"):
+            if library_path.rstrip(os.sep).split(".")[-1] == "kpls":
+                self.__library = ShardedKPLLibrary(library_path, self.__shard_cache)
+            else:
+                self.__library = KPLLibrary.load(library_path)
+        if self.__ann_recall is not None:
+            with self.__stats.stage("approximate"):
+                ann = self.__library.approximate(self.__ann_recall, MATCH_THRESHOLD)
+            logging.info("Approximate search with %d hash tables of %d bits.", ann["tables"], ann["bits"])
+        self.__journal = KPLJournal.for_library(save_path)
+        with self.__stats.stage("resume"):
+            done = self.__journal.resume(library_path, self.__library) if self.__resume else []
+        if done:
+            logging.info("Resuming the run from %s, %d files already done.", self.__journal.path, len(done))
+            self.__echo(f"Resuming the run from {self.__journal.path}, {len(done)} files already done.")
+        else:
+            self.__journal.start(library_path)
+        with self.__stats.stage("select_files"):
+            files = select_files([file for file in helper.get_files(self.__input_path)
+                                  if os.path.basename(file) not in done], self.__library.manifest, self.__echo)
+        matched = self.match_files([file for file, _ in files], [entry["sha256"] for _, entry in files])
+        for file, entry in files:
+            # in parallel runs the map stage is the time spent waiting for the worker processes
+            with self.__stats.stage("map"):
+                self.__df, self.__spectra, matches, stats = next(matched)
+            similarity_calls = self.__stats.counters.get("similarity_calls", 0)
+            self.__stats.merge(stats)
+            self.__stats.count("files")
+            self.__stats.count("peaks", len(self.__df))
+            self.__stats.observe("peaks_per_file", len(self.__df))
+            if self.__on_file is not None:
+                self.__on_file(file.split(f'{os.sep}')[-1].split('.')[0])
+            logging.info("Processing file: %s.", file.split(os.sep)[-1].split(".")[0])
+            self.__echo(f"Processing file: {file.split(f'{os.sep}')[-1].split('.')[0]}.")
+            before = dict(self.__stats.counters)
+            self.__df["Codename"] = ""
+            for row, scores in zip(self.__df.index, matches):
+                if self.__library.empty:
+                    logging.info("Empty database found, please create a new one.")
+                    self.__echo("Empty database found, please create a new one.")
+                with self.__stats.stage("reduce.window"):
+                    database_foc = self.get_foc_database(row)
+                self.__stats.observe("candidates_per_peak", len(database_foc))
+                if len(database_foc) == 0:
+                    logging.debug("No matches found in the core database, adding new line for %s.",
+                                  self.__df.at[row, "Name"])
+                    if self.__verbose:
+                        self.__echo(f"No matches found in the core database, adding new line for "
+                                    f"{self.__df.at[row, 'Name']}.")
+                    self.add_new_row(row, file)
+                else:
+                    spectrum_chrom = {} if self.__spectra[3][row] else helper.spectrum_at(self.__spectra, row)
+                    if not spectrum_chrom:
+                        logging.debug("Empty spectrum detected for %s.", self.__df.at[row, "Name"])
+                        if self.__verbose:
+                            self.__echo("empty spectrum detected")
+                        self.__stats.count("empty_spectra")
+                        continue
+                    # scores from the map phase are valid only for records which did not change since the snapshot
+                    stale = [kpl_row for kpl_row in database_foc.tolist()
+                             if kpl_row not in scores or self.__library.changed(kpl_row)]
+                    if stale:
+                        with self.__stats.stage("reduce.score"):
+                            scores = {**scores, **score_window(self.__library, spectrum_chrom, np.array(stale),
+                                                               self.__stats, self.__recall_check)}
+                    candidates = {kpl_row: scores[kpl_row] for kpl_row in database_foc.tolist()
+                                  if scores[kpl_row] > MATCH_THRESHOLD}
+
+                    if candidates:
+                        max_value = max(candidates, key=candidates.get)
+                        if self.__verbose:
+                            self.__echo(f"Match found for {self.__df.at[row, 'Name']}: "
+                                        f"{self.__library.get(max_value, 'Codename')} "
+                                        f"({self.__library.get(max_value, 'Name')})")
+                        self.update_record(file, max_value, row)
+                    else:
+                        logging.debug("No match found for %s in current database. Adding a new record.",
+                                      self.__df.at[row, "Name"])
+                        if self.__verbose:
+                            self.__echo(f"No match found for {self.__df.at[row, 'Name']} "
+                                        f"in current database. Adding a new record.")
+                        self.add_new_row(row, file)
+
+            self.__stats.observe("similarity_calls_per_file",
+                                 self.__stats.counters.get("similarity_calls", 0) - similarity_calls)
+            with self.__stats.stage("flush"):
+                self.__library.flush()
+            summary = file_summary(file.split(os.sep)[-1].split(".")[0], len(self.__df), self.__stats, before)
+            logging.info(summary)
+            self.__echo(summary)
+            with self.__stats.stage("write_output"):
+                self.__df.set_index("Codename", inplace=True)
+                self.__df.to_csv(f"{self.__output_path}{os.sep}renamed_{file.split(f'{os.sep}')[-1]}", sep="\t")
+            self.__library.manifest.add(entry)
+            with self.__stats.stage("journal"):
+                self.__journal.commit(file, entry)
+
+        logging.info("All files renamed successfully.")
+        self.__echo("All files renamed successfully.")
+        if self.__recall_check:
+            message = (f"Recall check: {self.__stats.counters.get('recall_checked', 0)} pruned records scored, "
+                       f"{self.__stats.counters.get('recall_misses', 0)} of them would match.")
+            logging.info(message)
+            self.__echo(message)
+        if isinstance(self.__library, ShardedKPLLibrary):
+            self.__stats.count("shard_loads", self.__library.loads)
+            self.__stats.count("shard_evictions", self.__library.evictions)
+        with self.__stats.stage("save"):
+            self.__library.save(save_path)
+        self.__journal.remove()
+        return self.__library
+
+    def match_files(self, files: list, digests: list = None):
+        """
+        Map phase of the comparison: parse the files and score their peaks against a snapshot of the library.
+
+        With more than one worker process the files are matched in parallel, the results are still yielded in the order
+        of the files. The library updates (reduce phase) are applied serially by run, so the result does not depend on
+        the number of processes. A single process matches each file right before its reduce phase against the library
+        itself, only the worker processes get a copy.
+
+        param files: list of chromatograms
+        param digests: sha256 hex digests of the chromatograms (see kpl_manifest), they are hashed if None
+        returns: generator of results of match_file
+        """
+        digests = digests or [None] * len(files)
+        if self.__processes <= 1:
+            for file, digest in zip(files, digests):
+                yield match_file(file, self.__library.snapshot(frozen=False), self.__recall_check, self.__parser,
+                                 self.__cache, digest)
+            return
+        snapshot = self.__library.snapshot()
+        with ProcessPoolExecutor(max_workers=self.__processes, initializer=_init_worker,
+                                 initargs=(snapshot, log_pipeline.get_queue(), logging.getLogger().getEffectiveLevel(),
+                                           self.__recall_check, self.__parser, self.__cache)) as executor:
+            yield from executor.map(_match_file_worker, files, digests)
+
+    def add_new_row(self, row: int, file: str) -> None:
+        """
+        Add a new line to kpl.
+
+        param file: name of the inspected chromatogram
+        param row: inspected row
+        """
+        newname = self.__library.new_codename()
+        spectra = helper.spectrum_at(self.__spectra, row)
+        spectra_lst = helper.spectrum_at(self.__spectra, row, do_list=True)
+        new_row = {"Codename": newname,
+                   "1st RT": float(self.__df.at[row, "1st Dimension Time (s)"]),
+                   "2nd RT": float(self.__df.at[row, "2nd Dimension Time (s)"]),
+                   "Spectra": spectra,
+                   "Found": [file.split(f"{os.sep}")[-1].split(".")[0]],
+                   "Name": self.__df.at[row, "Name"],
+                   "calc_1stRT": [float(self.__df.at[row, "1st Dimension Time (s)"])],
+                   "calc_2ndRT": [float(self.__df.at[row, "2nd Dimension Time (s)"])],
+                   "calc_spectra": spectra_lst}
+        with self.__stats.stage("add_record"):
+            self.__library.add_record(new_row)
+        self.__stats.count("new_records")
+        self.__journal.add(new_row)
+        self.__df.at[row, "Codename"] = newname
+        logging.debug("New record added: %s.", newname)
+        if self.__verbose:
+            self.__echo(f"New record added: {newname}.")
+
+    def update_record(self, file: str, match: int, row: int) -> None:
+        """Update record of the database hit.
+
+        param file: inspected file
+        param match: id of the match line
+        param row: df index of the match
+        """
+        hit = (float(self.__df.at[row, "1st Dimension Time (s)"]), float(self.__df.at[row, "2nd Dimension Time (s)"]),
+               helper.spectrum_at(self.__spectra, row), file.split(f"{os.sep}")[-1].split(".")[0])
+        with self.__stats.stage("update_record"):
+            self.__library.update_record(match, *hit)
+        self.__stats.count("updated_records")
+        self.__journal.update(match, *hit)
+        self.__df.at[row, "Codename"] = self.__library.get(match, "Codename")
+        logging.debug("%s was identified as the record %s (%s)", self.__df.at[row, "Name"],
+                      self.__df.at[row, "Codename"], self.__library.get(match, "Name"))
+
+    def get_foc_database(self, row: int) -> np.ndarray:
+        """
+        Get the focus on search window in core database.
+
+        param row: currently inspected row
+        returns: positions of the library records inside the search window
+        """
+        return self.__library.window(float(self.__df.at[row, "1st Dimension Time (s)"]),
+                                     float(self.__df.at[row, "2nd Dimension Time (s)"]))
+
+
+def extends(record: dict, library: KPLLibrary, row: int) -> bool:
+    """
+    Check whether the record is an updated version of the library record, i.e. the hits of the library record are the
+    first hits of the record (files and retention times).
+
+    param record: record of the user's library
+    param library: core library
+    param row: position of the library record
+    returns: True if the record extends the library record
+    """
+    return bool(library.get(row, "Found")) and all(
+        list(record[column][:len(library.get(row, column))]) == list(library.get(row, column))
+        for column in ("Found", "calc_1stRT", "calc_2ndRT"))
+
+
+def merge_libraries(core_path: str, user_path: str, codenames: Optional[list] = None, save_path: Optional[str] = None,
+                    echo: Callable[[str], None] = print, report_path: Optional[str] = None) -> tuple[dict, list]:
+    """
+    Merge records of the user's library into the core library in one pass, both libraries are read once and the core
+    library is written once. Used by the GUI and by the append and merge commands of the command line.
+
+    Each merged record is scored against the core records in its search window (one matrix product per window, records
+    which cannot match are pruned, see score_window). The hits of a record matching a core record are added to the best
+    match, other records are added under new codenames; records added earlier in the same merge are matched as well, so
+    duplicates inside the user's library are merged too. A user's record which only extends the core record with the
+    same codename (the user's library was updated from the core library by compare, see extends) replaces it instead,
+    so its hits are not counted twice. When the whole user's library is merged, its manifest is merged as well.
+
+    param core_path: path to the core library
+    param user_path: path to the user's library
+    param codenames: codenames of the merged records, shell-style patterns allowed (e.g. MX01*), all records if None
+    param save_path: path of the updated core library, the core library is not saved if None or if none of the
+    requested codenames was found
+    param echo: called with every progress message
+    param report_path: path of the JSON report with the statistics of the merge (see kpl_stats)
+    returns: {codename in the user's library: codename in the core library} of the merged records and the requested
+    codenames (and patterns) not found in the user's library
+    """
+    stats = RunStats()
+    with stats.stage("load"):
+        core_kpl = KPLLibrary.load(core_path)
+        user = kpl_columnar.read_library(user_path)
+    selected = user["Codename"].astype(str)
+    missing = []
+    if codenames is not None:
+        patterns = {pattern for pattern in codenames if any(char in pattern for char in "*?[")}
+        wanted = set(codenames) - patterns
+        selected = selected[[codename in wanted or any(fnmatch.fnmatchcase(codename, pattern) for pattern in patterns)
+                             for codename in selected.tolist()]]
+        missing = sorted((wanted - set(selected)) | {pattern for pattern in patterns
+                                                     if not fnmatch.filter(selected.tolist(), pattern)})
+        for codename in missing:
+            logging.warning("%s was not found in user's database.", codename)
+            echo(f"{codename} was not found in user's database.")
+    codename_map = {}
+    loaded = len(core_kpl)
+    # records are merged in the order of retention times, as peaks are matched
+    order = np.argsort(user.loc[selected.index, "1st RT"].to_numpy(dtype=float), kind="stable")
+    for index in selected.index[order]:
+        record = user.loc[index].to_dict()
+        own = core_kpl.codename_row(record["Codename"])
+        if own is not None and own < loaded and extends(record, core_kpl, own):
+            with stats.stage("replace_record"):
+                core_kpl.replace_record(own, record)
+            stats.count("replaced_records")
+            codename_map[record["Codename"]] = record["Codename"]
+            continue
+        candidates = {}
+        if record["Spectra"]:
+            with stats.stage("window"):
+                database_foc = core_kpl.window(float(record["1st RT"]), float(record["2nd RT"]))
+            stats.observe("candidates_per_record", len(database_foc))
+            if len(database_foc):
+                with stats.stage("score"):
+                    scores = score_window(core_kpl, record["Spectra"], database_foc, stats)
+                candidates = {row: score for row, score in scores.items() if score > MATCH_THRESHOLD}
+        if candidates:
+            match = max(candidates, key=candidates.get)
+            with stats.stage("merge_record"):
+                core_kpl.merge_record(match, record)
+            stats.count("merged_records")
+            codename_map[record["Codename"]] = core_kpl.get(match, "Codename")
+            logging.debug("%s from user's database merged into %s.", record["Codename"],
+                          codename_map[record["Codename"]])
+        else:
+            newname = core_kpl.new_codename()
+            with stats.stage("add_record"):
+                core_kpl.add_record({**record, "Codename": newname})
+            stats.count("new_records")
+            codename_map[record["Codename"]] = newname
+            logging.debug("%s from user's database added as %s.", record["Codename"], newname)
+    if codenames is None:
+        for entry in kpl_columnar.read_manifest(user_path):
+            core_kpl.manifest.add(entry)
+    message = (f"{len(codename_map)} records of the user's database merged into the core database: "
+               f"{stats.counters.get('new_records', 0)} added, {stats.counters.get('merged_records', 0)} merged into "
+               f"matching records, {stats.counters.get('replaced_records', 0)} replaced by their updated version.")
+    logging.info(message)
+    echo(message)
+    if save_path is not None and (codename_map or codenames is None):
+        with stats.stage("save"):
+            core_kpl.save(save_path)
+    stats.report(report_path)
+    return codename_map, missing
+
+
+def duplicate_pairs(library: KPLLibrary, threshold: float, block_records: int = DEDUPE_BLOCK) \
+        -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Find all pairs of records inside each other's search window with the similarity above the threshold.
+
+    The records are sorted by retention time in the first dimension and scored in blocks of consecutive records, each
+    block against all records following it up to the width of the search window (see SpectraMatrix.similarity).
+
+    param library: library
+    param threshold: similarity above which the records are duplicates
+    param block_records: number of records in each block
+    returns: positions of the first and second records of the pairs and their similarity
+    """
+    first_rt = library.database["1st RT"].to_numpy(dtype=float)
+    second_rt = library.database["2nd RT"].to_numpy(dtype=float)
+    valid = np.flatnonzero(~(np.isnan(first_rt) | np.isnan(second_rt)))
+    order = valid[np.argsort(first_rt[valid], kind="stable")]
+    sorted_rt = first_rt[order]
+    pairs = []
+    for start in range(0, len(order), block_records):
+        stop = min(start + block_records, len(order))
+        end = int(np.searchsorted(sorted_rt, sorted_rt[stop - 1] + RTIndex.FIRST_BAND, side="right"))
+        rows, others = order[start:stop], order[start:end]
+        scores = library.spectra.similarity(rows, others)
+        # each pair once: the other record follows the record in the order of retention times
+        later = np.arange(start, stop)[:, None] < np.arange(start, end)[None, :]
+        near = ((np.abs(first_rt[rows][:, None] - first_rt[others][None, :]) <= RTIndex.FIRST_BAND)
+                & (np.abs(second_rt[rows][:, None] - second_rt[others][None, :]) <= RTIndex.SECOND_BAND))
+        found = np.nonzero(later & near & (scores > threshold))
+        pairs.append((rows[found[0]], others[found[1]], scores[found]))
+    if not pairs:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    return tuple(np.concatenate(arrays) for arrays in zip(*pairs))
+
+
+def dedupe_library(library_path: str, save_path: str, remap_path: Optional[str] = None,
+                   threshold: float = DEDUPE_THRESHOLD, echo: Callable[[str], None] = print,
+                   report_path: Optional[str] = None) -> dict:
+    """
+    Merge near-duplicate records of the library (the same compound split into several records by compare).
+
+    Pairs of records inside each other's search window with the similarity above the threshold are found by
+    duplicate_pairs. The records are then visited from the most often found one: a record is merged into its most
+    similar duplicate kept so far (its hits, i.e. calc_* histories and Found, are added to it and the medians are
+    recalculated), otherwise it is kept. Merged records are never merged into, so chains of slightly different
+    records are not collapsed. The kept records keep their codenames.
+
+    param library_path: path to the library
+    param save_path: path of the compacted library
+    param remap_path: path of the tab separated table of the merged codenames (old codename, new codename and their
+    similarity), <save_path>.remap.tsv if None
+    param threshold: similarity above which the records are duplicates
+    param echo: called with every progress message
+    param report_path: path of the JSON report with the statistics of the compaction (see kpl_stats)
+    returns: {old codename: new codename} of the merged records
+    """
+    stats = RunStats()
+    with stats.stage("load"):
+        library = KPLLibrary.load(library_path)
+    before = len(library)
+    with stats.stage("pairs"):
+        first, second, scores = duplicate_pairs(library, threshold)
+    stats.count("duplicate_pairs", len(scores))
+    duplicates = [{} for _ in range(before)]
+    for row, other, score in zip(first.tolist(), second.tolist(), scores.tolist()):
+        duplicates[row][other] = score
+        duplicates[other][row] = score
+    found = np.array([len(files) for files in library.database["Found"]], dtype=np.int64)
+    kept, merged, remap = set(), [], []
+    for row in np.lexsort((np.arange(before), -found)).tolist():
+        targets = {other: score for other, score in duplicates[row].items() if other in kept}
+        if not targets:
+            kept.add(row)
+            continue
+        target = max(targets, key=targets.get)
+        with stats.stage("merge_record"):
+            library.merge_record(target, library.database.loc[row].to_dict())
+        merged.append(row)
+        remap.append((library.get(row, "Codename"), library.get(target, "Codename"), round(targets[target], 2)))
+    stats.count("merged_records", len(merged))
+    remap_path = remap_path or f"{save_path.rstrip(os.sep)}.remap.tsv"
+    with stats.stage("save"):
+        # the codenames of the merged records stay retired, even if they were the last ones issued
+        compacted = KPLLibrary(library.database.drop(index=merged), library.manifest.entries, library.next_codename)
+        compacted.save(save_path)
+        remapped = pd.DataFrame(remap, columns=["Old codename", "New codename", "Similarity"])
+        remapped.to_csv(remap_path, sep="\t", index=False)
+    message = (f"{len(merged)} duplicate records merged, the library shrank from {before} to {len(compacted)} records "
+               f"({100 * len(merged) / max(before, 1):.1f} % smaller). Codenames remapped in {remap_path}.")
+    logging.info(message)
+    echo(message)
+    stats.report(report_path)
+    return {old: new for old, new, _ in remap}
+
+
+def search_library(library_path: str, input_path: str, output_path: str, top: int = SEARCH_TOP,
+                   cutoff: float = MATCH_THRESHOLD, echo: Callable[[str], None] = print, parser: str = "c",
+                   cache: bool = True, report_path: Optional[str] = None) -> None:
+    """
+    Search the peaks of the chromatograms in the whole library by their spectra only, regardless of retention times
+    (e.g. for chromatograms measured with other column or modulation settings, see kpl_search). The library is not
+    changed, each chromatogram is written to the output folder (searched_<file>) with the best records of each peak
+    (Hit 1 ... Hit <top> and their Similarity 1 ... Similarity <top>, empty without further hits).
+
+    param library_path: path to the library
+    param input_path: folder with the chromatograms
+    param output_path: folder for the searched chromatograms
+    param top: number of the best records of each peak
+    param cutoff: similarity above which a record is a hit
+    param echo: called with every progress message
+    param parser: parser of the chromatograms, "c" or "pyarrow" (see kpl_ingest)
+    param cache: read the chromatograms through the cache of parsed exports (see export_cache)
+    param report_path: path of the JSON report with the statistics of the search (see kpl_stats)
+    """
+    # scipy is only needed by the search, the other commands start without it
+    import kpl_search
+
+    kpl_ingest.check_engine(parser)
+    stats = RunStats()
+    with stats.stage("load"):
+        library = kpl_search.SparseSpectra.from_library(library_path)
+    cache = ExportCache.default() if cache else None
+    for file in helper.get_files(input_path):
+        df, spectra = read_chromatogram(file, stats, parser, cache)
+        with stats.stage("search"):
+            records, scores = library.search(spectra, top, cutoff)
+        hits = int((records[:, 0] >= 0).sum())
+        stats.count("files")
+        stats.count("peaks", len(df))
+        stats.count("peaks_with_hits", hits)
+        for rank in range(top):
+            df[f"Hit {rank + 1}"] = np.where(records[:, rank] >= 0, library.codenames[records[:, rank]], "")
+            df[f"Similarity {rank + 1}"] = scores[:, rank]
+        with stats.stage("write_output"):
+            df.to_csv(f"{output_path}{os.sep}searched_{os.path.basename(file)}", sep="\t", index=False)
+        message = f"File searched: {os.path.basename(file).split('.')[0]}, {len(df)} peaks, {hits} with hits."
+        logging.info(message)
+        echo(message)
+    stats.report(report_path)
+
+
+def export_library(library_path: str, export_path: str, echo: Callable[[str], None] = print,
+                   chunk_records: int = kpl_export.CHUNK_RECORDS) -> None:
+    """
+    Export the library to another format given by the file extension. The .tsv, .parquet and .kpls exports are written
+    chunk by chunk (see kpl_export), .txt, .h5 and .kplc are converted whole.
+
+    param library_path: path to the library
+    param export_path: path of the exported library
+    param echo: called with every progress message
+    param chunk_records: number of records in each chunk of the .tsv, .parquet and .kpls exports
+    """
+    if export_path.rstrip(os.sep).split(".")[-1] in kpl_export.FORMATS:
+        kpl_export.export(library_path, export_path, chunk_records)
+    else:
+        kpl_columnar.convert(library_path, export_path)
+    logging.info("Database %s exported to %s.", library_path, export_path)
+    echo("Database exported.")
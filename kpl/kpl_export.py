@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""Streaming export of the kpl to tab separated text (.tsv), Parquet (.parquet) and RT shards (.kpls).
+
+The library is read and written in chunks of records (see kpl_columnar.iter_library), so only one decoded chunk is held
+in memory besides the source (.h5 libraries are read whole). Sharded libraries are exported shard by shard, so the
+records of a .kpls source follow the order of its shards. A .kpls export gets one shard per chunk of consecutive
+retention times, the same layout as kpl_columnar.write_sharded.
+
+The text and Parquet exports flatten the Python objects of the library to strings which can be parsed back (see
+read_tsv):
+
+    Spectra        mass:intensity mass:intensity ...   (the notation of ChromaTOF)
+    calc_1stRT     value value ...
+    calc_spectra   mass:value,value,... mass:value,value,...
+    Found          file|file|...
+    Name           utf-8 text
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+import kpl_columnar
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pyarrow_parquet
+except ImportError:  # optional Parquet export
+    pyarrow = None
+
+FORMATS = ("tsv", "parquet", "kpls")
+CHUNK_RECORDS = kpl_columnar.SHARD_RECORDS
+FOUND_SEPARATOR = "|"
+# columns which are missing in the text export if empty
+MISSING = {"Name": [""], "1st RT": [""], "2nd RT": [""]}
+
+
+def format_spectrum(spectrum: dict) -> str:
+    """
+    Flatten the spectrum to the notation of ChromaTOF.
+
+    :param spectrum: {mass: intensity}
+    :returns: "mass:intensity mass:intensity ..."
+    """
+    return " ".join(f"{mass}:{intensity}" for mass, intensity in spectrum.items())
+
+
+def parse_number(text: str):
+    """
+    Parse the number written by the export.
+
+    :param text: number
+    :returns: float, or int if the text is an integer
+    """
+    return float(text) if any(char in text for char in ".eEnN") else int(text)
+
+
+def parse_spectrum(text: str) -> dict:
+    """
+    Parse the spectrum flattened by format_spectrum.
+
+    :param text: "mass:intensity mass:intensity ..."
+    :returns: {mass: intensity}
+    """
+    return {int(mass): parse_number(intensity) for mass, intensity in (pair.split(":") for pair in text.split())}
+
+
+def flatten(database: pd.DataFrame) -> pd.DataFrame:
+    """
+    Flatten the records to strings (see the module description).
+
+    :param database: library records
+    :returns: flattened records
+    """
+    return pd.DataFrame({
+        "Codename": database["Codename"],
+        "Name": [name.decode("utf-8") if isinstance(name, bytes) else name for name in database["Name"]],
+        "1st RT": database["1st RT"].astype(float),
+        "2nd RT": database["2nd RT"].astype(float),
+        "Spectra": [format_spectrum(spectrum) for spectrum in database["Spectra"]],
+        "Found": [FOUND_SEPARATOR.join(files) for files in database["Found"]],
+        "calc_1stRT": [" ".join(str(value) for value in values) for values in database["calc_1stRT"]],
+        "calc_2ndRT": [" ".join(str(value) for value in values) for values in database["calc_2ndRT"]],
+        "calc_spectra": [" ".join(f"{mass}:{','.join(str(value) for value in values)}"
+                                  for mass, values in spectrum.items()) for spectrum in database["calc_spectra"]]},
+        columns=kpl_columnar.COLUMNS)
+
+
+def unflatten(database: pd.DataFrame) -> pd.DataFrame:
+    """
+    Parse the flattened records back to library records (names as bytes).
+
+    :param database: flattened records
+    :returns: library records
+    """
+    return pd.DataFrame({
+        "Codename": database["Codename"],
+        "1st RT": database["1st RT"],
+        "2nd RT": database["2nd RT"],
+        "Spectra": [parse_spectrum(text) for text in database["Spectra"]],
+        "Found": [text.split(FOUND_SEPARATOR) if text else [] for text in database["Found"]],
+        "Name": [name.encode("utf-8") if isinstance(name, str) else name for name in database["Name"]],
+        "calc_1stRT": [[parse_number(value) for value in text.split()] for text in database["calc_1stRT"]],
+        "calc_2ndRT": [[parse_number(value) for value in text.split()] for text in database["calc_2ndRT"]],
+        "calc_spectra": [{int(mass): [parse_number(value) for value in values.split(",") if value]
+                          for mass, values in (pair.split(":") for pair in text.split())}
+                         for text in database["calc_spectra"]]},
+        columns=kpl_columnar.COLUMNS).astype({"Spectra": object, "Found": object, "Name": object,
+                                              "calc_1stRT": object, "calc_2ndRT": object, "calc_spectra": object})
+
+
+def read_tsv(path: str) -> pd.DataFrame:
+    """
+    Read the library exported to .tsv.
+
+    :param path: path to the .tsv export
+    :returns: library records
+    """
+    database = pd.read_csv(path, sep="\t", header=0, dtype=str, keep_default_na=False, na_values=MISSING)
+    return unflatten(database.astype({"1st RT": float, "2nd RT": float}))
+
+
+def write_tsv(chunks, path: str) -> int:
+    """
+    Write the flattened records to tab separated text chunk by chunk.
+
+    :param chunks: chunks of (records, positions) (see kpl_columnar.iter_library)
+    :param path: path to the .tsv file
+    :returns: number of exported records
+    """
+    records, header = 0, True
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        for chunk, _ in chunks:
+            flatten(chunk).to_csv(file, sep="\t", index=False, header=header)
+            records += len(chunk)
+            header = False
+        if header:
+            file.write("\t".join(kpl_columnar.COLUMNS) + "\n")
+    return records
+
+
+def write_parquet(chunks, path: str) -> int:
+    """
+    Write the flattened records to Parquet, one row group per chunk.
+
+    :param chunks: chunks of (records, positions) (see kpl_columnar.iter_library)
+    :param path: path to the .parquet file
+    :returns: number of exported records
+    """
+    if pyarrow is None:
+        raise ValueError("The Parquet export needs pyarrow (pip install pyarrow).")
+    schema = pyarrow.schema([(column, pyarrow.float64() if column in ("1st RT", "2nd RT") else pyarrow.string())
+                             for column in kpl_columnar.COLUMNS])
+    records = 0
+    with pyarrow_parquet.ParquetWriter(path, schema) as writer:
+        for chunk, _ in chunks:
+            writer.write_table(pyarrow.Table.from_pandas(flatten(chunk), schema=schema, preserve_index=False))
+            records += len(chunk)
+    return records
+
+
+def write_kpls(chunks, path: str) -> int:
+    """
+    Write each chunk as one shard of a sharded library.
+
+    :param chunks: chunks of (records, positions) (see kpl_columnar.iter_library)
+    :param path: path to the .kpls folder
+    :returns: number of exported records
+    """
+    os.makedirs(path, exist_ok=True)
+    shards, records, codename = [], 0, 0
+    for chunk, rows in chunks:
+        shards.append(kpl_columnar.write_shard(chunk, rows, f"{path}{os.sep}shard_{len(shards):05d}.kplc"))
+        records += len(chunk)
+        codename = max(codename, kpl_columnar.next_codename(chunk["Codename"]))
+    if not shards:
+        shards.append(kpl_columnar.write_shard(pd.DataFrame(columns=kpl_columnar.COLUMNS), np.array([], dtype=int),
+                                               f"{path}{os.sep}shard_00000.kplc"))
+    kpl_columnar.write_shard_manifest(path, shards, records, codename)
+    return records
+
+
+def export(source: str, target: str, chunk_records: int = CHUNK_RECORDS) -> int:
+    """
+    Export the library chunk by chunk to the format given by the file extension (.tsv, .parquet or .kpls).
+
+    :param source: path to the library (.h5, .txt, .kplc or .kpls)
+    :param target: path of the export
+    :param chunk_records: number of records in each chunk (in each shard of .kpls)
+    :returns: number of exported records
+    """
+    extension = target.rstrip(os.sep).split(".")[-1]
+    if extension not in FORMATS:
+        raise ValueError(f"Unknown export format .{extension}, use one of .{', .'.join(FORMATS)}.")
+    chunks = kpl_columnar.iter_library(source, chunk_records, by_rt=extension == "kpls")
+    if extension == "tsv":
+        return write_tsv(chunks, target)
+    if extension == "parquet":
+        return write_parquet(chunks, target)
+    records = write_kpls(chunks, target)
+    kpl_columnar.write_manifest(kpl_columnar.read_manifest(source), target, kpl_columnar.read_codename(source))
+    return records
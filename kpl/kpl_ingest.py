@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""Reading of ChromaTOF exports (tab separated peak tables).
+
+The header is normalized to the column names used by kpl (retention time and spectra columns are also found by a part of
+their name, e.g. "1st Dimension Time (s)" exported as "1st Dim. Time (s)"), only the requested columns are parsed, and
+retention times with decimal commas and the names (encoded to bytes) are converted column-wise. The C parser of pandas
+is used by default, the multithreaded pyarrow parser can be used if it is installed. Very large exports can be read in
+chunks, so only one chunk is held in memory:
+
+    for chunk in kpl_ingest.iter_export(path, columns=kpl_ingest.MATCH_COLUMNS):
+        ...
+
+With a cache of parsed exports (see export_cache) an export is parsed only once, later reads of the same content load
+the stored columns. The kpl engine stores the parsed spectra with them (SPECTRA_ARRAYS).
+"""
+import csv
+import os
+import sys
+
+import pandas as pd
+
+try:
+    import export_cache
+except ImportError:  # imported from the tool folder, the modules shared by the tools are in common/
+    sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+    import export_cache
+from export_cache import ExportCache
+
+try:
+    import pyarrow.csv as pyarrow_csv
+except ImportError:  # optional parser
+    pyarrow_csv = None
+
+ENCODING = "latin-1"
+NAME = "Name"
+FIRST_RT = "1st Dimension Time (s)"
+SECOND_RT = "2nd Dimension Time (s)"
+SPECTRA = "Spectra"
+# kpl columns found by a part of the exported name if missing
+PATTERNS = {FIRST_RT: "1st", SECOND_RT: "2nd", SPECTRA: "Spect"}
+# columns needed for matching the peaks to the library
+MATCH_COLUMNS = [NAME, FIRST_RT, SECOND_RT, SPECTRA]
+ENGINES = ("c", "pyarrow")
+# arrays of helper.parse_spectra stored in the cache, the version is raised whenever the parsing changes
+SPECTRA_VERSION = 1
+SPECTRA_ARRAYS = [f"spectra{SPECTRA_VERSION}_{name}" for name in ("offsets", "masses", "intensities", "missing")]
+CHUNK_ROWS = 50000
+CHUNK_BYTES = 16 << 20
+
+
+def normalize_header(columns: list) -> list:
+    """
+    Rename the columns of the export to the kpl column names.
+
+    :param columns: exported column names
+    :returns: normalized column names
+    """
+    columns = list(columns)
+    for column, pattern in PATTERNS.items():
+        if column not in columns:
+            columns[[ix for ix, val in enumerate(columns) if pattern in val][0]] = column
+    return columns
+
+
+def format_export(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Normalize the header and convert the retention times with decimal commas and the names of the export in place.
+
+    :param df: export (or its chunk) as read by pandas
+    :returns: the same DataFrame
+    """
+    df.columns = normalize_header(df.columns)
+    for column in (FIRST_RT, SECOND_RT):
+        if column in df.columns and df[column].dtype == object:
+            df[column] = df[column].str.replace(",", ".").astype("float")
+    if NAME in df.columns:
+        df[NAME] = [name.encode("utf-8") for name in df[NAME].tolist()]
+    return df
+
+
+def read_header(path: str) -> list:
+    """
+    Read the column names of the export.
+
+    :param path: path to the export
+    :returns: exported column names
+    """
+    with open(path, "r", encoding=ENCODING, newline="") as file:
+        return next(csv.reader(file, delimiter="\t"), [])
+
+
+def project(path: str, columns: list = None, exported: list = None):
+    """
+    Find the exported names of the requested kpl columns.
+
+    :param path: path to the export
+    :param columns: kpl column names, all columns if None
+    :param exported: exported column names, read from the header of the export if None
+    :returns: exported names of the columns (for usecols of pandas), None for all columns
+    """
+    if columns is None:
+        return None
+    exported = read_header(path) if exported is None else exported
+    normalized = normalize_header(exported)
+    missing = [column for column in columns if column not in normalized]
+    if missing:
+        raise KeyError(f"Columns {missing} not found in {path}.")
+    return [name for name, column in zip(exported, normalized) if column in columns]
+
+
+def check_engine(engine: str) -> None:
+    """
+    Check that the parser is known and installed.
+
+    :param engine: "c" or "pyarrow"
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown parser {engine}, use one of {', '.join(ENGINES)}.")
+    if engine == "pyarrow" and pyarrow_csv is None:
+        raise ValueError("The pyarrow parser is not installed (pip install pyarrow).")
+
+
+def read_raw(path: str, columns: list = None, engine: str = "c") -> pd.DataFrame:
+    """
+    Read the export as exported (header, retention times and names are not converted).
+
+    :param path: path to the export
+    :param columns: kpl column names to read (e.g. MATCH_COLUMNS), all columns if None
+    :param engine: parser, "c" (pandas) or "pyarrow"
+    :returns: export
+    """
+    check_engine(engine)
+    return pd.read_csv(path, sep="\t", header=0, encoding=ENCODING, usecols=project(path, columns), engine=engine)
+
+
+def read_export(path: str, columns: list = None, engine: str = "c", cache: ExportCache = None,
+                digest: str = None) -> pd.DataFrame:
+    """
+    Read the export with normalized header, retention times and names.
+
+    :param path: path to the export
+    :param columns: kpl column names to read (e.g. MATCH_COLUMNS), all columns if None
+    :param engine: parser, "c" (pandas) or "pyarrow"
+    :param cache: cache of parsed exports, the export is always parsed if None
+    :param digest: sha256 hex digest of the export if known (see export_cache.file_hash)
+    :returns: formatted export
+    """
+    if cache is None:
+        return format_export(read_raw(path, columns, engine))
+    return read_cached(path, cache, columns, engine, digest)[0]
+
+
+def read_cached(path: str, cache: ExportCache, columns: list = None, engine: str = "c", digest: str = None) \
+        -> tuple[pd.DataFrame, dict]:
+    """
+    Read the export through the cache of parsed exports.
+
+    A missing export is parsed and stored with all columns, if only some columns are requested only these are parsed
+    and nothing is stored.
+
+    :param path: path to the export
+    :param cache: cache of parsed exports
+    :param columns: kpl column names to read (e.g. MATCH_COLUMNS), all columns if None
+    :param engine: parser of a missing export, "c" (pandas) or "pyarrow"
+    :param digest: sha256 hex digest of the export if known (see export_cache.file_hash)
+    :returns: formatted export and the arrays stored with it (e.g. SPECTRA_ARRAYS)
+    """
+    check_engine(engine)
+    digest = digest or export_cache.file_hash(path)
+    cached = cache.load(digest, ENCODING, None if columns is None else project(path, columns))
+    if cached is not None:
+        return format_export(cached[0]), cached[1]
+    df = read_raw(path, columns, engine)
+    if columns is None:
+        cache.store(digest, ENCODING, df)
+    return format_export(df), {}
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""Append-only journal of library changes made by a compare run (crash recovery and resume).
+
+The journal is a JSON lines file. The first line identifies the starting library, the following lines are the new
+records and record updates of the run in the order they were applied. The changes of a chromatogram are written
+together with a "file" line once the chromatogram is done, so the journal only ever holds whole chromatograms.
+Replaying the journal against the starting library gives the library as it was after the last finished chromatogram.
+"""
+import json
+import logging
+import os
+
+import numpy as np
+
+from kpl_library import KPLLibrary
+
+
+def encode(value):
+    """
+    Encode the library value to JSON compatible types (keeps bytes and int dict keys).
+
+    :param value: library value
+    :returns: encoded value
+    """
+    if isinstance(value, bytes):
+        return {"bytes": value.decode("latin-1")}
+    if isinstance(value, dict):
+        return {"dict": [[encode(key), encode(item)] for key, item in value.items()]}
+    if isinstance(value, (list, tuple)):
+        return [encode(item) for item in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def decode(value):
+    """
+    Decode the value encoded by encode.
+
+    :param value: encoded value
+    :returns: library value
+    """
+    if isinstance(value, dict):
+        if "bytes" in value:
+            return value["bytes"].encode("latin-1")
+        return {decode(key): decode(item) for key, item in value["dict"]}
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+    return value
+
+
+class KPLJournal:
+    """Journal of a compare run."""
+
+    def __init__(self, path: str):
+        """
+        Initialize the journal.
+
+        :param path: path to the journal file
+        """
+        self.__path = path
+        self.__entries = []
+        self.__file = None
+
+    @staticmethod
+    def for_library(save_path: str) -> "KPLJournal":
+        """
+        Get the journal of the run saving the library to save_path.
+
+        :param save_path: path of the updated library
+        :returns: journal next to the updated library
+        """
+        return KPLJournal(f"{save_path.rstrip(os.sep)}.journal")
+
+    @property
+    def path(self) -> str:
+        """Path to the journal file"""
+        return self.__path
+
+    def start(self, library_path: str) -> None:
+        """
+        Start a new journal (an existing journal is overwritten).
+
+        :param library_path: path to the starting library
+        """
+        self.close()
+        self.__file = open(self.__path, "w", encoding="utf-8", newline="\n")
+        self.__write([{"op": "start", **self.__identify(library_path)}])
+
+    def resume(self, library_path: str, library: KPLLibrary) -> list:
+        """
+        Replay the journal against the starting library and continue writing to it.
+
+        The journal is replayed only if it was started from the same library file (path, size and modification time),
+        otherwise it is ignored and nothing is resumed.
+
+        :param library_path: path to the starting library
+        :param library: starting library, the journal is replayed into it
+        :returns: names of the chromatograms which were already done (empty if there is nothing to resume)
+        """
+        if not os.path.exists(self.__path):
+            return []
+        with open(self.__path, "r", encoding="utf-8", newline="") as file:
+            lines = file.readlines()
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, json.JSONDecodeError):
+            header = {}
+        if header.get("op") != "start" or {key: header.get(key) for key in ("library", "size", "mtime")} != \
+                self.__identify(library_path):
+            logging.info("Journal %s does not belong to %s, it is not resumed.", self.__path, library_path)
+            return []
+        done, size = replay(library, lines)
+        self.close()
+        with open(self.__path, "rb+") as file:
+            # drop the changes of an unfinished chromatogram (or a torn last line) before writing more
+            file.truncate(size)
+        self.__file = open(self.__path, "a", encoding="utf-8", newline="\n")
+        return done
+
+    def add(self, record: dict) -> None:
+        """
+        Record a new library record.
+
+        :param record: new record with all library columns
+        """
+        self.__entries.append({"op": "add", "record": {column: encode(record[column])
+                                                       for column in KPLLibrary.COLUMNS}})
+
+    def update(self, row: int, first_rt: float, second_rt: float, spectrum: dict, found: str) -> None:
+        """
+        Record a new hit of the library record (see KPLLibrary.update_record).
+
+        :param row: position of the record
+        :param first_rt: retention time of the hit in the first dimension
+        :param second_rt: retention time of the hit in the second dimension
+        :param spectrum: spectrum of the hit (not transformed)
+        :param found: name of the chromatogram
+        """
+        self.__entries.append({"op": "update", "row": int(row), "first_rt": first_rt, "second_rt": second_rt,
+                               "spectrum": encode(spectrum), "found": found})
+
+    def commit(self, file: str, manifest: dict = None) -> None:
+        """
+        Write the changes made for the chromatogram to the disk.
+
+        :param file: the finished chromatogram
+        :param manifest: manifest entry of the chromatogram (see kpl_manifest)
+        """
+        self.__write(self.__entries + [{"op": "file", "file": os.path.basename(file), "manifest": manifest}])
+        self.__entries = []
+
+    def close(self) -> None:
+        """Close the journal file."""
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+        self.__entries = []
+
+    def remove(self) -> None:
+        """Close and delete the journal (once its changes are saved in the library)."""
+        self.close()
+        if os.path.exists(self.__path):
+            os.remove(self.__path)
+
+    def __write(self, entries: list) -> None:
+        """Append the entries and force them to the disk."""
+        self.__file.write("".join(json.dumps(entry) + "\n" for entry in entries))
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+
+    @staticmethod
+    def __identify(library_path: str) -> dict:
+        """Identification of the starting library file."""
+        stat = os.stat(library_path)
+        return {"library": os.path.abspath(library_path), "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def replay(library: KPLLibrary, lines: list) -> tuple[list, int]:
+    """
+    Apply the journal entries of the finished chromatograms to the library.
+
+    :param library: starting library
+    :param lines: lines of the journal
+    :returns: names of the finished chromatograms and length of the journal up to the last finished chromatogram
+    """
+    done, entries = [], []
+    size = position = len(lines[0].encode("utf-8")) if lines else 0
+    for line in lines[1:]:
+        position += len(line.encode("utf-8"))
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            break
+        if not line.endswith("\n"):
+            break
+        if entry["op"] != "file":
+            entries.append(entry)
+            continue
+        for change in entries:
+            if change["op"] == "add":
+                library.add_record({column: decode(value) for column, value in change["record"].items()})
+            else:
+                library.update_record(change["row"], change["first_rt"], change["second_rt"],
+                                      decode(change["spectrum"]), change["found"])
+        library.flush()
+        if entry.get("manifest") is not None:
+            library.manifest.add(entry["manifest"])
+        done.append(entry["file"])
+        entries = []
+        size = position
+    return done, size
+
+
+def compact(library_path: str, journal_path: str, save_path: str) -> KPLLibrary:
+    """
+    Fold the journal of an interrupted run into the library and save it.
+
+    :param library_path: path to the starting library of the run
+    :param journal_path: path to the journal
+    :param save_path: path of the updated library
+    :returns: the updated library
+    """
+    library = KPLLibrary.load(library_path)
+    with open(journal_path, "r", encoding="utf-8", newline="") as file:
+        lines = file.readlines()
+    done, _ = replay(library, lines)
+    library.save(save_path)
+    logging.info("Journal %s with %d finished files folded into %s.", journal_path, len(done), save_path)
+    return library
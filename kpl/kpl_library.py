@@ -0,0 +1,1266 @@
+# -*- coding: utf-8 -*-
+"""Library object of the kpl with precomputed structures for fast matching."""
+import collections
+import copy
+import heapq
+import os
+import shutil
+import statistics
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import helper
+import kpl_columnar
+from kpl_manifest import Manifest
+
+
+class RunningMedian:
+    """Exact median of a growing list of observations.
+
+    The lower half of the values is kept in a max-heap, the upper half in a min-heap, so adding a value and reading the
+    median takes logarithmic time. The median is the same as statistics.median of all the values.
+    """
+
+    def __init__(self, values: list):
+        """
+        Initialize the median from already collected values.
+
+        :param values: collected values
+        """
+        ordered = sorted(values)
+        half = (len(ordered) + 1) // 2
+        self.__lower = [-value for value in ordered[:half]]
+        heapq.heapify(self.__lower)
+        self.__upper = ordered[half:]
+
+    @property
+    def median(self):
+        """median of the values"""
+        if len(self.__lower) > len(self.__upper):
+            return -self.__lower[0]
+        return (-self.__lower[0] + self.__upper[0]) / 2
+
+    def add(self, value):
+        """
+        Add a new value.
+
+        :param value: new value
+        :returns: updated median
+        """
+        if self.__lower and value > -self.__lower[0]:
+            heapq.heappush(self.__upper, value)
+        else:
+            heapq.heappush(self.__lower, -value)
+        if len(self.__lower) > len(self.__upper) + 1:
+            heapq.heappush(self.__upper, -heapq.heappop(self.__lower))
+        elif len(self.__upper) > len(self.__lower):
+            heapq.heappush(self.__lower, -heapq.heappop(self.__upper))
+        return self.median
+
+
+class SpectraMatrix:
+    """Transformed kpl spectra aligned by m/z values.
+
+    Each row holds the transformed spectrum of one library record, the columns are m/z values in order of their first
+    appearance. The arrays are read-only to the outside world, only the matrix itself rewrites the rows of changed
+    records.
+
+    The dominant ions (key ions) of each record are indexed as well: the columns of its most intense transformed ions
+    and the fraction of the norm of the spectrum outside of them (residual). For the DOT similarity, a record sharing no
+    key ion with the inspected spectrum can reach at most a * r + sqrt(1 - a ** 2) * sqrt(1 - r ** 2) (Cauchy-Schwarz,
+    a is the fraction of the norm of the inspected spectrum in its key ions, r the residual of the record, the bound is
+    1 if r >= a), so records whose bound does not exceed the match threshold are pruned without scoring (see
+    score_pruned).
+
+    For very large libraries, an approximate search can be enabled (see approximate): the transformed spectra are hashed
+    by random hyperplanes (sign of the projection, locality-sensitive for the cosine similarity, i.e. DOT) into several
+    tables of a few bits each, and only records sharing a hash with the inspected spectrum in at least one table are
+    scored. The number of tables follows from the requested recall of records with the similarity at the cutoff.
+    """
+
+    KEY_IONS = 5
+    ANN_BITS = 12
+
+    def __init__(self, spectra: list, transformation: tuple, key_ions: int = KEY_IONS):
+        """
+        Build the matrix from the spectra of the library.
+
+        :param spectra: list of spectra dicts (in the order of the library rows)
+        :param transformation: exponents (a, b) used for the transformation of intensities and masses
+        :param key_ions: number of key ions of each record
+        """
+        self.transformation = tuple(transformation)
+        self.key_ions = key_ions
+        self.rows = len(spectra)
+        lengths = np.fromiter((len(spectrum) for spectrum in spectra), dtype=np.int64, count=self.rows)
+        masses = np.fromiter((key for spectrum in spectra for key in spectrum), dtype=np.int64,
+                             count=lengths.sum())
+        values = np.fromiter((value for spectrum in spectra for value in spectrum.values()), dtype=float,
+                             count=lengths.sum())
+        self.__mass_power = np.zeros(0)
+        self.__masses = np.zeros(0, dtype=np.int64)
+        self.__column_of = np.full(0, -1, dtype=np.int64)
+        self.__columns = 0
+        self.__values = np.zeros((max(self.rows, 1), 0))
+        self.__mask = np.zeros((max(self.rows, 1), 0), dtype=bool)
+        self.__norms = np.zeros(max(self.rows, 1))
+        self.__keys = np.full((max(self.rows, 1), key_ions), -1, dtype=np.int64)
+        self.__residuals = np.ones(max(self.rows, 1))
+        self.__codes = None
+        self.__planes = None
+        self.ann = None
+        self.__add_columns(np.unique(masses))
+        rows = np.repeat(np.arange(self.rows), lengths)
+        self.__write(lambda: self.__fill(rows, masses, values))
+
+    @property
+    def masses(self) -> np.ndarray:
+        """m/z values of the matrix columns"""
+        return self.__masses[:self.__columns]
+
+    @property
+    def mass_power(self) -> np.ndarray:
+        """lookup table of mass ** b indexed by m/z value"""
+        return self.__mass_power
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """transformed intensities (rows = records, columns = m/z values)"""
+        return self.__values[:self.rows, :self.__columns]
+
+    @property
+    def mask(self) -> np.ndarray:
+        """m/z values present in each record"""
+        return self.__mask[:self.rows, :self.__columns]
+
+    @property
+    def norms(self) -> np.ndarray:
+        """norms of the transformed spectra"""
+        return self.__norms[:self.rows]
+
+    @property
+    def keys(self) -> np.ndarray:
+        """columns of the key ions of each record (-1 pads records with fewer ions)"""
+        return self.__keys[:self.rows]
+
+    @property
+    def residuals(self) -> np.ndarray:
+        """fractions of the norms of the transformed spectra outside of the key ions"""
+        return self.__residuals[:self.rows]
+
+    def approximate(self, recall: float, cutoff: float, bits: int = ANN_BITS, seed: int = 0) -> None:
+        """
+        Enable the approximate search (see the class description).
+
+        A record with the similarity s to the inspected spectrum agrees in one hash bit with the probability
+        p = 1 - arccos(s / 100) / pi, in a table of k bits with p ** k, so 1 - (1 - p ** k) ** tables of such records
+        are found. The number of tables is the smallest one giving the recall at the cutoff, records more similar than
+        the cutoff are found with a higher probability.
+
+        :param recall: probability that a record with the similarity equal to the cutoff is scored (0 < recall < 1)
+        :param cutoff: similarity cutoff (usually the match threshold)
+        :param bits: hash bits in each table, more bits prune more records but need more tables for the same recall
+        :param seed: seed of the random hyperplanes
+        """
+        if not 0 < recall < 1:
+            raise ValueError(f"Recall of the approximate search must be between 0 and 1, got {recall}.")
+        if not 0 < bits <= 32:
+            raise ValueError(f"Bits of the approximate search must be between 1 and 32, got {bits}.")
+        agreement = 1 - np.arccos(np.clip(cutoff / 100, -1, 1)) / np.pi
+        tables = max(1, int(np.ceil(np.log(1 - recall) / np.log(1 - agreement ** bits))))
+        self.ann = {"recall": recall, "cutoff": cutoff, "bits": bits, "tables": tables, "seed": seed}
+        self.__planes = np.zeros((0, tables * bits))
+        self.__codes = np.zeros((self.__values.shape[0], tables), dtype=np.uint32)
+        self.__codes.flags.writeable = False
+        self.__write(lambda: self.__hash_rows(np.arange(self.rows)))
+
+    def transform(self, spectrum: dict) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Transform the inspected spectrum and align it to the matrix columns.
+
+        The matrix itself is not changed, m/z values unknown to the library are placed after the matrix columns in the
+        order of the spectrum. The result thus depends only on the library records and the inspected spectrum.
+
+        :param spectrum: spectrum in the form {m/z: intensity}
+        :returns: transformed vector and mask of present m/z values
+        """
+        masses = np.fromiter(spectrum.keys(), dtype=np.int64, count=len(spectrum))
+        values = np.fromiter(spectrum.values(), dtype=float, count=len(spectrum))
+        if len(masses):
+            self.__extend_power(int(masses.max()))
+        columns = np.full(len(masses), -1, dtype=np.int64)
+        in_range = masses < len(self.__column_of)
+        columns[in_range] = self.__column_of[masses[in_range]]
+        unknown = columns < 0
+        columns[unknown] = self.__columns + np.arange(unknown.sum())
+        query = np.zeros(self.__columns + unknown.sum())
+        query_mask = np.zeros(self.__columns + unknown.sum(), dtype=bool)
+        query[columns] = self.__transform(masses, values)
+        query_mask[columns] = True
+        return query, query_mask
+
+    def score(self, spectrum: dict, rows: np.ndarray) -> np.ndarray:
+        """
+        Score the inspected spectrum against selected records.
+
+        :param spectrum: inspected spectrum (not transformed)
+        :param rows: positions of the compared records
+        :returns: array of similarity results
+        """
+        query, query_mask = self.transform(spectrum)
+        return self.__score(query, query_mask, np.asarray(rows, dtype=np.int64))
+
+    def score_pruned(self, spectrum: dict, rows: np.ndarray, threshold: float) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Score the inspected spectrum against the selected records which can exceed the threshold.
+
+        Records sharing no key ion with the inspected spectrum are pruned if their similarity provably cannot exceed
+        the threshold (see the class description). With the approximate search enabled, records sharing no hash with
+        the inspected spectrum are pruned as well. Nothing is pruned for other similarity methods than DOT.
+
+        :param spectrum: inspected spectrum (not transformed)
+        :param rows: positions of the compared records
+        :param threshold: match threshold (records match with a similarity above it)
+        :returns: array of similarity results (-inf for pruned records) and mask of the scored records
+        """
+        query, query_mask = self.transform(spectrum)
+        rows = np.asarray(rows, dtype=np.int64)
+        keep = np.ones(len(rows), dtype=bool)
+        query_norm = np.linalg.norm(query)
+        if len(rows) and query_norm > 0 and helper.load_config()["sim_compare"] == "DOT":
+            top = np.argpartition(-query, min(self.key_ions, len(query)) - 1)[:self.key_ions]
+            top = top[query[top] > 0]
+            key_share = min(np.linalg.norm(query[top]) / query_norm, 1.0)
+            # lookup of the query key columns, the last item stays False for the -1 padding of the record keys
+            is_key = np.zeros(len(query) + 1, dtype=bool)
+            is_key[top] = True
+            if self.__codes is not None:
+                # the hash comparison is cheaper than the bound, the bound is only checked for the colliding records
+                masses = np.fromiter(spectrum.keys(), dtype=np.int64, count=len(spectrum))
+                values = self.__transform(masses, np.fromiter(spectrum.values(), dtype=float, count=len(spectrum)))
+                keep = (self.__codes[rows] == self.__hash(values[None, :], masses)).any(axis=1)
+            candidates = rows if self.__codes is None else rows[keep]
+            residuals = self.__residuals[candidates]
+            bound = key_share * residuals + np.sqrt(1 - key_share ** 2) * np.sqrt(1 - residuals ** 2)
+            # the margin keeps records whose bound is within rounding errors of the threshold
+            keep[keep] = (is_key[self.__keys[candidates]].any(axis=1) | (residuals >= key_share)
+                          | (bound * 100 >= threshold - 1e-6))
+        scores = np.full(len(rows), -np.inf)
+        if keep.any():
+            scores[keep] = self.__score(query, query_mask, rows[keep])
+        return scores, keep
+
+    def similarity(self, rows: np.ndarray, others: np.ndarray) -> np.ndarray:
+        """
+        Score records against other records, the same as scoring the spectrum of each record against the others (up to
+        rounding errors). All pairs are scored by matrix products, Pearson's coefficient over the m/z values present in
+        either of the two records is expanded to the sums of the records, their squares and their products.
+
+        :param rows: positions of the records
+        :param others: positions of the other records
+        :returns: array of similarity results (rows x others)
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        others = np.asarray(others, dtype=np.int64)
+        matrix, others_matrix = self.matrix[rows], self.matrix[others]
+        products = matrix @ others_matrix.T
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if helper.load_config()["sim_compare"] == "DOT":
+                return products / np.outer(self.norms[rows], self.norms[others]) * 100
+            mask, others_mask = self.mask[rows], self.mask[others]
+            counts = (mask.sum(axis=1)[:, None] + others_mask.sum(axis=1)[None, :]
+                      - mask.astype(float) @ others_mask.T.astype(float))
+            sums, others_sums = matrix.sum(axis=1)[:, None], others_matrix.sum(axis=1)[None, :]
+            squares, others_squares = (matrix ** 2).sum(axis=1)[:, None], (others_matrix ** 2).sum(axis=1)[None, :]
+            pearson = (products - sums * others_sums / counts) / np.sqrt((squares - sums ** 2 / counts)
+                                                                         * (others_squares - others_sums ** 2 / counts))
+            return np.round(np.clip(pearson, -1, 1) * 100, 2)
+
+    def set_row(self, row: int, spectrum: dict) -> None:
+        """
+        Write a new or changed record into the matrix.
+
+        :param row: position of the record (equal to the number of rows for a new record)
+        :param spectrum: spectrum of the record (not transformed)
+        """
+        masses = np.fromiter(spectrum.keys(), dtype=np.int64, count=len(spectrum))
+        values = np.fromiter(spectrum.values(), dtype=float, count=len(spectrum))
+        self.__add_columns(masses)
+        if row >= self.__values.shape[0]:
+            self.__resize(rows=max(row + 1, 2 * self.__values.shape[0]))
+        self.rows = max(self.rows, row + 1)
+
+        def rewrite():
+            self.__values[row] = 0
+            self.__mask[row] = False
+            self.__fill(np.full(len(masses), row), masses, values)
+
+        self.__write(rewrite)
+
+    def __score(self, query: np.ndarray, query_mask: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Score the transformed and aligned spectrum against the records."""
+        matrix, mask = self.matrix[rows], self.mask[rows]
+        if len(query) > self.__columns:
+            matrix = np.pad(matrix, ((0, 0), (0, len(query) - self.__columns)))
+            mask = np.pad(mask, ((0, 0), (0, len(query) - self.__columns)))
+        return helper.score_spectra(query, query_mask, matrix, mask, self.norms[rows])
+
+    def __transform(self, masses: np.ndarray, values: np.ndarray) -> np.ndarray:
+        """Transform intensities: round(mass ** b * intensity ** a, 2)."""
+        return helper.round_array(self.__mass_power[masses] * values ** self.transformation[0])
+
+    def __fill(self, rows: np.ndarray, masses: np.ndarray, values: np.ndarray) -> None:
+        """Fill transformed values into the matrix and recalculate norms of the touched rows."""
+        columns = self.__column_of[masses]
+        self.__values[rows, columns] = self.__transform(masses, values)
+        self.__mask[rows, columns] = True
+        touched = np.unique(rows)
+        self.__norms[touched] = np.linalg.norm(self.__values[touched], axis=1)
+        self.__index_keys(touched)
+
+    def __index_keys(self, rows: np.ndarray) -> None:
+        """Recalculate the key ions and residuals of the rows (in chunks to limit the temporary copies)."""
+        if self.__columns == 0:
+            return
+        count = min(self.key_ions, self.__columns)
+        for start in range(0, len(rows), 4096):
+            chunk = rows[start:start + 4096]
+            values = self.__values[chunk, :self.__columns]
+            top = np.argpartition(-values, count - 1, axis=1)[:, :count]
+            top_values = np.take_along_axis(values, top, axis=1)
+            self.__keys[chunk] = -1
+            self.__keys[chunk, :count] = np.where(top_values > 0, top, -1)
+            norms = self.__norms[chunk]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                residuals = np.sqrt(np.clip(norms ** 2 - (top_values ** 2).sum(axis=1), 0, None)) / norms
+            self.__residuals[chunk] = np.where(norms > 0, np.clip(residuals, 0, 1), 1.0)
+        if self.__codes is not None:
+            self.__hash_rows(rows)
+
+    def __hash(self, values: np.ndarray, masses: np.ndarray) -> np.ndarray:
+        """Hash the transformed spectra (rows of the values, columns given by the m/z values) into the tables."""
+        if len(masses) and masses.max() >= len(self.__planes):
+            # the hyperplane coordinates of each m/z value depend only on the seed and the m/z value
+            width = self.ann["tables"] * self.ann["bits"]
+            extra = [np.random.default_rng([self.ann["seed"], mass]).standard_normal(width)
+                     for mass in range(len(self.__planes), int(masses.max()) + 1)]
+            self.__planes = np.vstack([self.__planes, extra])
+        bits = (values @ self.__planes[masses] > 0).reshape(len(values), self.ann["tables"], self.ann["bits"])
+        return (bits.astype(np.uint32) << np.arange(self.ann["bits"], dtype=np.uint32)).sum(axis=2, dtype=np.uint32)
+
+    def __hash_rows(self, rows: np.ndarray) -> None:
+        """Recalculate the hashes of the rows."""
+        for start in range(0, len(rows), 4096):
+            chunk = rows[start:start + 4096]
+            self.__codes[chunk] = self.__hash(self.__values[chunk, :self.__columns], self.masses)
+
+    def __add_columns(self, masses: np.ndarray) -> None:
+        """Add columns for m/z values which are not present in the matrix yet."""
+        if len(masses) == 0:
+            return
+        top = int(masses.max())
+        self.__extend_power(top)
+        if top >= len(self.__column_of):
+            self.__column_of = np.concatenate([self.__column_of,
+                                               np.full(top + 1 - len(self.__column_of), -1, dtype=np.int64)])
+        new = np.unique(masses[self.__column_of[masses] < 0])
+        if len(new) == 0:
+            return
+        if self.__columns + len(new) > self.__values.shape[1]:
+            self.__resize(columns=max(self.__columns + len(new), 2 * self.__values.shape[1]))
+        self.__column_of[new] = np.arange(self.__columns, self.__columns + len(new))
+        self.__masses[self.__columns:self.__columns + len(new)] = new
+        self.__columns += len(new)
+
+    def __extend_power(self, top: int) -> None:
+        """Extend the lookup table of mass ** b up to the given m/z value."""
+        if top >= len(self.__mass_power):
+            self.__mass_power = np.arange(top + 1, dtype=float) ** self.transformation[1]
+
+    def __resize(self, rows: int = None, columns: int = None) -> None:
+        """Grow the capacity of the underlying arrays."""
+        rows = rows or self.__values.shape[0]
+        columns = columns or self.__values.shape[1]
+        values = np.zeros((rows, columns))
+        mask = np.zeros((rows, columns), dtype=bool)
+        norms = np.zeros(rows)
+        keys = np.full((rows, self.key_ions), -1, dtype=np.int64)
+        residuals = np.ones(rows)
+        masses = np.zeros(columns, dtype=np.int64)
+        old_rows, old_columns = self.__values.shape
+        values[:old_rows, :old_columns] = self.__values
+        mask[:old_rows, :old_columns] = self.__mask
+        norms[:old_rows] = self.__norms
+        keys[:old_rows] = self.__keys
+        residuals[:old_rows] = self.__residuals
+        if old_columns:
+            masses[:old_columns] = self.__masses
+        for array in (values, mask, norms, keys, residuals):
+            array.flags.writeable = False
+        self.__values, self.__mask, self.__norms, self.__masses = values, mask, norms, masses
+        self.__keys, self.__residuals = keys, residuals
+        if self.__codes is not None and rows > len(self.__codes):
+            codes = np.zeros((rows, self.__codes.shape[1]), dtype=np.uint32)
+            codes[:len(self.__codes)] = self.__codes
+            codes.flags.writeable = False
+            self.__codes = codes
+
+    def __write(self, action) -> None:
+        """Run the action with the arrays temporarily writeable."""
+        arrays = (self.__values, self.__mask, self.__norms, self.__keys, self.__residuals)
+        arrays += () if self.__codes is None else (self.__codes,)
+        for array in arrays:
+            array.flags.writeable = True
+        try:
+            action()
+        finally:
+            for array in arrays:
+                array.flags.writeable = False
+
+
+class RTIndex:
+    """Index of records sorted by retention time in the first dimension.
+
+    Window queries find the first dimension range by bisection and filter the second dimension only inside it.
+    Records without valid retention times are not indexed.
+
+    Added and moved records are not inserted into the sorted arrays one by one (each insertion shifts the arrays, so a
+    run adding many records would cost O(n) per record): they are kept aside and scanned by every window query, and
+    merged into the sorted arrays in one pass once there are more of them than the square root of the indexed records
+    (at least PENDING). An update thus costs O(sqrt(n)) amortized, and so does the scan of the pending records.
+    """
+
+    FIRST_BAND = 50
+    SECOND_BAND = 0.9
+    PENDING = 64
+
+    def __init__(self, first_rt: np.ndarray, second_rt: np.ndarray):
+        """
+        Build the index.
+
+        :param first_rt: retention times in the first dimension (in the order of the library rows)
+        :param second_rt: retention times in the second dimension (in the order of the library rows)
+        """
+        self.__first_rt = np.asarray(first_rt, dtype=float).copy()
+        self.__second_rt = np.asarray(second_rt, dtype=float).copy()
+        self.__pending = []
+        # rows whose position in the sorted arrays is stale (added or moved since the last merge)
+        self.__moved = np.zeros(len(self.__first_rt), dtype=bool)
+        valid = np.flatnonzero(~(np.isnan(self.__first_rt) | np.isnan(self.__second_rt)))
+        self.__sorted_rows = valid[np.argsort(self.__first_rt[valid], kind="stable")]
+        self.__sorted_rt = self.__first_rt[self.__sorted_rows]
+
+    def window(self, first_rt: float, second_rt: float, first_band: float = FIRST_BAND,
+               second_band: float = SECOND_BAND) -> np.ndarray:
+        """
+        Find records inside the search window (bounds included).
+
+        :param first_rt: retention time in the first dimension
+        :param second_rt: retention time in the second dimension
+        :param first_band: half-width of the window in the first dimension
+        :param second_band: half-width of the window in the second dimension
+        :returns: positions of the records inside the window in ascending order
+        """
+        lower_band_1st, upper_band_1st = float(first_rt - first_band), float(first_rt + first_band)
+        lower_band_2nd, upper_band_2nd = float(second_rt - second_band), float(second_rt + second_band)
+        start = int(np.searchsorted(self.__sorted_rt, lower_band_1st, side="left"))
+        stop = int(np.searchsorted(self.__sorted_rt, upper_band_1st, side="right"))
+        rows = self.__sorted_rows[start:stop]
+        if self.__pending:
+            pending = np.array(self.__pending, dtype=np.int64)
+            first = self.__first_rt[pending]
+            rows = np.concatenate([rows[~self.__moved[rows]],
+                                   pending[(first >= lower_band_1st) & (first <= upper_band_1st)]])
+        second = self.__second_rt[rows]
+        return np.sort(rows[(second >= lower_band_2nd) & (second <= upper_band_2nd)])
+
+    def set_row(self, row: int, first_rt: float, second_rt: float) -> None:
+        """
+        Insert a new record or move an existing one to its new retention times.
+
+        :param row: position of the record (equal to the number of rows for a new record)
+        :param first_rt: retention time in the first dimension
+        :param second_rt: retention time in the second dimension
+        """
+        if row >= len(self.__first_rt):
+            grow = max(row + 1, 2 * len(self.__first_rt)) - len(self.__first_rt)
+            self.__first_rt = np.concatenate([self.__first_rt, np.full(grow, np.nan)])
+            self.__second_rt = np.concatenate([self.__second_rt, np.full(grow, np.nan)])
+            self.__moved = np.concatenate([self.__moved, np.zeros(grow, dtype=bool)])
+        self.__first_rt[row] = first_rt
+        self.__second_rt[row] = second_rt
+        if not self.__moved[row]:
+            self.__moved[row] = True
+            self.__pending.append(row)
+        if len(self.__pending) > max(self.PENDING, int(np.sqrt(len(self.__sorted_rows)))):
+            self.__merge()
+
+    def __merge(self) -> None:
+        """Merge the pending records into the sorted arrays (stale positions are dropped), O(n) in one pass."""
+        kept = self.__sorted_rows[~self.__moved[self.__sorted_rows]]
+        pending = np.array(self.__pending, dtype=np.int64)
+        pending = pending[~(np.isnan(self.__first_rt[pending]) | np.isnan(self.__second_rt[pending]))]
+        pending = pending[np.argsort(self.__first_rt[pending], kind="stable")]
+        # pending records go after the kept records with the same retention time, as if inserted one by one
+        positions = np.searchsorted(self.__first_rt[kept], self.__first_rt[pending], side="right")
+        self.__sorted_rows = np.insert(kept, positions, pending)
+        self.__sorted_rt = self.__first_rt[self.__sorted_rows]
+        self.__moved[self.__pending] = False
+        self.__pending = []
+
+
+class LibrarySnapshot:
+    """Frozen copy of the search structures of the library.
+
+    The snapshot answers window queries and scores spectra exactly as the library did at the time it was taken. It is
+    sent to the worker processes of the compare tool.
+    """
+
+    def __init__(self, rt_index: RTIndex, spectra: SpectraMatrix):
+        """
+        Copy the search structures.
+
+        :param rt_index: index of the records by retention times
+        :param spectra: transformed spectra of the records
+        """
+        self.rt_index = copy.deepcopy(rt_index)
+        self.spectra = copy.deepcopy(spectra)
+
+    def window(self, first_rt: float, second_rt: float) -> np.ndarray:
+        """
+        Find records inside the search window.
+
+        :param first_rt: retention time in the first dimension
+        :param second_rt: retention time in the second dimension
+        :returns: positions of the records in ascending order
+        """
+        return self.rt_index.window(first_rt, second_rt)
+
+    def score(self, spectrum: dict, rows: list) -> np.ndarray:
+        """
+        Compare the inspected spectrum to the selected records.
+
+        :param spectrum: inspected spectrum (not transformed)
+        :param rows: positions of the compared records
+        :returns: array of similarity results
+        """
+        return self.spectra.score(spectrum, rows)
+
+    def score_pruned(self, spectrum: dict, rows: np.ndarray, threshold: float) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Compare the inspected spectrum to the selected records which can exceed the threshold (see SpectraMatrix).
+
+        :param spectrum: inspected spectrum (not transformed)
+        :param rows: positions of the compared records
+        :param threshold: match threshold
+        :returns: array of similarity results (-inf for pruned records) and mask of the scored records
+        """
+        return self.spectra.score_pruned(spectrum, rows, threshold)
+
+
+class KPLLibrary:
+    """Library of chemical compounds (kpl).
+
+    New records are collected in an append buffer and moved to the DataFrame in bulk (flush), all lookups of the library
+    see the buffered records as well.
+    """
+
+    COLUMNS = ["Codename", "1st RT", "2nd RT", "Spectra", "Found", "Name", "calc_1stRT", "calc_2ndRT", "calc_spectra"]
+
+    def __init__(self, database: pd.DataFrame = None, manifest: list = None, codename: int = 0):
+        """
+        Initialize the library.
+
+        :param database: records of the library, an empty library is created if not set
+        :param manifest: entries of the ingested chromatograms (see kpl_manifest)
+        :param codename: number of the next codename if it is above the codenames of the records (codenames of removed
+        records are never issued again)
+        """
+        self.__manifest = Manifest(manifest)
+        self.__database = pd.DataFrame(columns=self.COLUMNS) if database is None else database.reset_index(drop=True)
+        self.__pending = []
+        self.__spectra = None
+        self.__rt_index = None
+        self.__names = {}
+        self.__codenames = {}
+        self.__medians = {}
+        self.__approximate = None
+        self.__changed = set()
+        self.__next_codename = 0
+        for row, (record_codename, name) in enumerate(zip(self.__database["Codename"], self.__database["Name"])):
+            self.__index_keys(row, record_codename, name)
+        # the counter is stored with the library (see save) once it is ahead of the codenames of the records
+        self.__retired = codename > self.__next_codename
+        self.__next_codename = max(self.__next_codename, codename)
+
+    def __len__(self) -> int:
+        """Number of records including the buffered ones"""
+        return len(self.__database) + len(self.__pending)
+
+    @classmethod
+    def load(cls, path: str) -> "KPLLibrary":
+        """
+        Load the library from the file (.h5, .txt or .kplc). All records are decoded into memory, also from .kplc (a
+        compact storage format), only the shards of a .kpls library are loaded on demand (see ShardedKPLLibrary).
+
+        :param path: path to the library
+        :returns: loaded library
+        """
+        return cls(kpl_columnar.read_library(path), kpl_columnar.read_manifest(path), kpl_columnar.read_codename(path))
+
+    def save(self, path: str) -> None:
+        """
+        Save the library and its manifest. The format is derived from the file extension (.h5, .txt or .kplc).
+
+        :param path: path to the library
+        """
+        kpl_columnar.write_library(self.database, path)
+        kpl_columnar.write_manifest(self.__manifest.entries, path, self.__next_codename if self.__retired else 0)
+
+    @property
+    def manifest(self) -> Manifest:
+        """Chromatograms ingested into the library"""
+        return self.__manifest
+
+    @property
+    def next_codename(self) -> int:
+        """Number of the codename of the next record (see new_codename)"""
+        return self.__next_codename
+
+    @property
+    def database(self) -> pd.DataFrame:
+        """All records of the library as a DataFrame (buffered records are flushed first)"""
+        self.flush()
+        return self.__database
+
+    @property
+    def empty(self) -> bool:
+        """True if the library has no records"""
+        return len(self) == 0
+
+    @property
+    def spectra(self) -> SpectraMatrix:
+        """Transformed spectra of the library, rebuilt when the transformation in the config file changes"""
+        transformation = tuple(helper.load_config()["transformation"])
+        if self.__spectra is None or self.__spectra.transformation != transformation:
+            self.__spectra = SpectraMatrix(list(self.database["Spectra"]), transformation)
+            if self.__approximate is not None:
+                self.__spectra.approximate(*self.__approximate)
+        return self.__spectra
+
+    def approximate(self, recall: float, cutoff: float, bits: int = SpectraMatrix.ANN_BITS) -> dict:
+        """
+        Enable the approximate search of the spectra for very large libraries (see SpectraMatrix.approximate).
+
+        :param recall: probability that a record with the similarity equal to the cutoff is scored
+        :param cutoff: similarity cutoff (usually the match threshold)
+        :param bits: hash bits in each table
+        :returns: parameters of the approximate search (see SpectraMatrix.ann)
+        """
+        self.__approximate = (recall, cutoff, bits)
+        self.spectra.approximate(recall, cutoff, bits)
+        return self.spectra.ann
+
+    @property
+    def rt_index(self) -> RTIndex:
+        """Index of the records by retention times"""
+        if self.__rt_index is None:
+            self.__rt_index = RTIndex(self.database["1st RT"].to_numpy(dtype=float),
+                                      self.database["2nd RT"].to_numpy(dtype=float))
+        return self.__rt_index
+
+    def snapshot(self, frozen: bool = True):
+        """
+        Freeze the search structures of the library. Records changed after this call are reported by changed().
+
+        :param frozen: copy the search structures (for the worker processes), otherwise the library itself is returned,
+        it answers as the snapshot until the next change
+        :returns: snapshot of the library
+        """
+        self.__changed = set()
+        return LibrarySnapshot(self.rt_index, self.spectra) if frozen else self
+
+    def changed(self, row: int) -> bool:
+        """
+        Check whether the record was added or updated since the last snapshot.
+
+        :param row: position of the record
+        :returns: True if the record changed
+        """
+        return row in self.__changed
+
+    def flush(self) -> None:
+        """Move the buffered records to the DataFrame."""
+        if self.__pending:
+            self.__database = pd.concat([self.__database, pd.DataFrame(self.__pending, columns=self.COLUMNS)],
+                                        ignore_index=True)
+            self.__pending = []
+
+    def get(self, row: int, column: str):
+        """
+        Get the value of the record (works for buffered records too).
+
+        :param row: position of the record
+        :param column: library column
+        :returns: stored value
+        """
+        if row < len(self.__database):
+            return self.__database.at[row, column]
+        return self.__pending[row - len(self.__database)][column]
+
+    def set(self, row: int, column: str, value) -> None:
+        """
+        Set the value of the record (works for buffered records too).
+
+        :param row: position of the record
+        :param column: library column
+        :param value: new value
+        """
+        if row < len(self.__database):
+            self.__database.at[row, column] = value
+        else:
+            self.__pending[row - len(self.__database)][column] = value
+
+    def new_codename(self) -> str:
+        """
+        Get the codename for the next record (MX + number following the highest number issued in the library).
+
+        :returns: new codename
+        """
+        return "MX" + str(self.__next_codename).zfill(5)
+
+    def window(self, first_rt: float, second_rt: float) -> np.ndarray:
+        """
+        Find records inside the search window (+- 50 s in the first dimension, +- 0.9 s in the second dimension).
+
+        :param first_rt: retention time in the first dimension
+        :param second_rt: retention time in the second dimension
+        :returns: positions of the records in ascending order
+        """
+        return self.rt_index.window(first_rt, second_rt)
+
+    def name_row(self, name: bytes):
+        """
+        Find the first record with the given name.
+
+        :param name: name of the compound
+        :returns: position of the record, None if the name is not in the library
+        """
+        return self.__names.get(name)
+
+    def codename_row(self, codename: str):
+        """
+        Find the record with the given codename.
+
+        :param codename: codename of the record
+        :returns: position of the record, None if the codename is not in the library
+        """
+        return self.__codenames.get(codename)
+
+    def score(self, spectrum: dict, rows: list) -> np.ndarray:
+        """
+        Compare the inspected spectrum to the selected records.
+
+        :param spectrum: inspected spectrum (not transformed)
+        :param rows: positions of the compared records
+        :returns: array of similarity results
+        """
+        return self.spectra.score(spectrum, rows)
+
+    def score_pruned(self, spectrum: dict, rows: np.ndarray, threshold: float) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Compare the inspected spectrum to the selected records which can exceed the threshold (see SpectraMatrix).
+
+        :param spectrum: inspected spectrum (not transformed)
+        :param rows: positions of the compared records
+        :param threshold: match threshold
+        :returns: array of similarity results (-inf for pruned records) and mask of the scored records
+        """
+        return self.spectra.score_pruned(spectrum, rows, threshold)
+
+    def add_record(self, record: dict) -> int:
+        """
+        Add a new record to the append buffer of the library.
+
+        :param record: new record with all library columns
+        :returns: position of the new record
+        """
+        self.__pending.append({column: record[column] for column in self.COLUMNS})
+        row = len(self) - 1
+        self.__index_keys(row, record["Codename"], record["Name"])
+        self.__refresh(row)
+        return row
+
+    def update_record(self, row: int, first_rt: float, second_rt: float, spectrum: dict, found: str) -> None:
+        """
+        Add a new hit to the record and recalculate its medians.
+
+        :param row: position of the record
+        :param first_rt: retention time of the hit in the first dimension
+        :param second_rt: retention time of the hit in the second dimension
+        :param spectrum: spectrum of the hit (not transformed)
+        :param found: name of the chromatogram
+        """
+        self.set(row, "1st RT", self.__observe(row, "calc_1stRT", first_rt))
+        self.set(row, "2nd RT", self.__observe(row, "calc_2ndRT", second_rt))
+        self.get(row, "Found").append(found)
+        update_spectra = dict(self.get(row, "Spectra"))
+        for key, value in spectrum.items():
+            update_spectra[key] = self.__observe(row, "calc_spectra", value, key)
+        self.set(row, "Spectra", update_spectra)
+        self.__refresh(row)
+
+    def merge_record(self, row: int, record: dict) -> None:
+        """
+        Add all hits of another record (e.g. of the user's library) to the record and recalculate its medians.
+
+        :param row: position of the record
+        :param record: merged record with all library columns
+        """
+        for column, history in (("1st RT", "calc_1stRT"), ("2nd RT", "calc_2ndRT")):
+            self.get(row, history).extend(record[history])
+            self.__medians.pop((row, history, None), None)
+            self.set(row, column, statistics.median(self.get(row, history)))
+        self.get(row, "Found").extend(record["Found"])
+        histories = self.get(row, "calc_spectra")
+        update_spectra = dict(self.get(row, "Spectra"))
+        for key, values in record["calc_spectra"].items():
+            histories.setdefault(key, []).extend(values)
+            self.__medians.pop((row, "calc_spectra", key), None)
+            update_spectra[key] = statistics.median(histories[key])
+        self.set(row, "Spectra", update_spectra)
+        self.__refresh(row)
+
+    def replace_record(self, row: int, record: dict) -> None:
+        """
+        Replace the values of the record by those of another record, the codename is kept.
+
+        :param row: position of the record
+        :param record: new record with all library columns
+        """
+        stale = [("calc_1stRT", None), ("calc_2ndRT", None)]
+        stale += [("calc_spectra", key) for key in self.get(row, "calc_spectra")]
+        for column, key in stale:
+            self.__medians.pop((row, column, key), None)
+        for column in self.COLUMNS[1:]:
+            self.set(row, column, copy.deepcopy(record[column]))
+        self.__refresh(row)
+
+    def __observe(self, row: int, column: str, value: float, key: int = None):
+        """Append the value to the history of the record and return the updated median of the history."""
+        history = self.get(row, column)
+        if key is not None:
+            history = history.setdefault(key, [])
+        if (row, column, key) not in self.__medians:
+            self.__medians[(row, column, key)] = RunningMedian(history)
+        history.append(value)
+        return self.__medians[(row, column, key)].add(value)
+
+    def __index_keys(self, row: int, codename: str, name: bytes) -> None:
+        """Add the record to the name and codename lookups and move the codename counter."""
+        self.__names.setdefault(name, row)
+        self.__codenames[codename] = row
+        try:
+            self.__next_codename = max(self.__next_codename, int(codename.split("X")[1]) + 1)
+        except (AttributeError, IndexError, ValueError):
+            pass
+
+    def __refresh(self, row: int) -> None:
+        """Bring the precomputed structures up to date with the changed record."""
+        self.__changed.add(row)
+        if self.__spectra is not None:
+            self.__spectra.set_row(row, self.get(row, "Spectra"))
+        if self.__rt_index is not None:
+            self.__rt_index.set_row(row, float(self.get(row, "1st RT")), float(self.get(row, "2nd RT")))
+
+
+class _Shard:
+    """Loaded shard of a sharded library."""
+
+    __slots__ = ("library", "rows")
+
+    def __init__(self, library: KPLLibrary, rows: np.ndarray):
+        self.library = library
+        self.rows = rows
+
+
+class ShardedKPLLibrary:
+    """Library stored in RT shards (.kpls, see kpl_columnar) with the shards loaded lazily on demand.
+
+    Only the retention times of all records are read up front (for the search windows), a shard is loaded, as a
+    KPLLibrary of its records, once one of its records is scored, read or changed. Loaded shards are kept in a least
+    recently used cache under a memory cap, the memory of a loaded shard is estimated as MEMORY_FACTOR times its stored
+    size. Records keep their positions in the whole library. Changed shards dropped from the cache are written to a
+    temporary folder and loaded from there again. New records are added to the shard with the nearest 1st RT range, the
+    ranges grow with the retention times of their records.
+    """
+
+    CACHE_BYTES = 1 << 30
+    MEMORY_FACTOR = 10
+
+    def __init__(self, path: str, cache_bytes: int = CACHE_BYTES):
+        """
+        Open the library, only the shard manifest, the positions and the retention times of the records are read.
+
+        :param path: path to the .kpls folder
+        :param cache_bytes: memory cap of the loaded shards (the shard in use is always kept)
+        """
+        self.path = path
+        self.cache_bytes = cache_bytes
+        self.loads = 0
+        self.evictions = 0
+        self.__store = kpl_columnar.ShardedStore(path)
+        self.__manifest = Manifest(kpl_columnar.read_manifest(path))
+        self.__ranges = np.array([shard["first_rt"] or [np.nan, np.nan] for shard in self.__store.shards], dtype=float)
+        self.__bytes = [shard["bytes"] for shard in self.__store.shards]
+        self.__stored = len(self.__store)
+        self.__records = self.__stored
+        self.__shard_of = np.zeros(self.__stored, dtype=np.int64)
+        self.__local_of = np.zeros(self.__stored, dtype=np.int64)
+        first_rt, second_rt = np.full(self.__stored, np.nan), np.full(self.__stored, np.nan)
+        for shard in range(len(self.__store.shards)):
+            rows = self.__store.rows(shard)
+            self.__shard_of[rows] = shard
+            self.__local_of[rows] = np.arange(len(rows))
+            columnar = kpl_columnar.ColumnarLibrary(self.__store.shard_path(shard))
+            first_rt[rows], second_rt[rows] = columnar.array("first_rt"), columnar.array("second_rt")
+        self.__rt_index = RTIndex(first_rt, second_rt)
+        self.__added = {}
+        self.__next_codename = max(self.__store.meta["next_codename"], kpl_columnar.read_codename(path))
+        self.__cache = collections.OrderedDict()
+        self.__dirty = set()
+        self.__spilled = {}
+        self.__spill = None
+        self.__changed = set()
+        self.__approximate = None
+
+    def __len__(self) -> int:
+        """Number of records including the new ones"""
+        return self.__records
+
+    @property
+    def manifest(self) -> Manifest:
+        """Chromatograms ingested into the library"""
+        return self.__manifest
+
+    @property
+    def empty(self) -> bool:
+        """True if the library has no records"""
+        return len(self) == 0
+
+    @property
+    def database(self) -> pd.DataFrame:
+        """All records of the library as a DataFrame (the shards are read one by one, the cache is not changed)"""
+        frames, rows = [], []
+        for shard in range(len(self.__bytes)):
+            if shard in self.__cache:
+                frames.append(self.__cache[shard].library.database)
+                rows.append(self.__cache[shard].rows)
+            else:
+                path = self.__spilled.get(shard, self.__store.shard_path(shard))
+                frames.append(kpl_columnar.ColumnarLibrary(path).to_frame())
+                rows.append(np.load(f"{path}{os.sep}rows.npy"))
+        database = pd.concat(frames, ignore_index=True).iloc[np.argsort(np.concatenate(rows), kind="stable")]
+        return database.reset_index(drop=True)
+
+    def approximate(self, recall: float, cutoff: float, bits: int = SpectraMatrix.ANN_BITS) -> dict:
+        """
+        Enable the approximate search of the spectra in all shards (see SpectraMatrix.approximate).
+
+        :param recall: probability that a record with the similarity equal to the cutoff is scored
+        :param cutoff: similarity cutoff (usually the match threshold)
+        :param bits: hash bits in each table
+        :returns: parameters of the approximate search (see SpectraMatrix.ann)
+        """
+        self.__approximate = (recall, cutoff, bits)
+        for shard in self.__cache.values():
+            shard.library.approximate(recall, cutoff, bits)
+        matrix = SpectraMatrix([], tuple(helper.load_config()["transformation"]))
+        matrix.approximate(recall, cutoff, bits)
+        return matrix.ann
+
+    def snapshot(self, frozen: bool = True) -> "ShardSnapshot":
+        """
+        Get the snapshot of the library for the map phase (see ShardSnapshot).
+
+        :param frozen: not used, the snapshot never copies the library (see ShardSnapshot)
+        :returns: snapshot of the library
+        """
+        return ShardSnapshot(self, self.__approximate)
+
+    def changed(self, row: int) -> bool:
+        """
+        Check whether the record was added or updated since the library was opened (the snapshots of a sharded library
+        read the stored library, see ShardSnapshot).
+
+        :param row: position of the record
+        :returns: True if the record changed
+        """
+        return row in self.__changed
+
+    def flush(self) -> None:
+        """Move the buffered records of the loaded shards to their DataFrames."""
+        for shard in self.__cache.values():
+            shard.library.flush()
+
+    def get(self, row: int, column: str):
+        """
+        Get the value of the record (its shard is loaded if needed).
+
+        :param row: position of the record
+        :param column: library column
+        :returns: stored value
+        """
+        shard, local = self.__locate(row)
+        return self.__load(shard).library.get(local, column)
+
+    def set(self, row: int, column: str, value) -> None:
+        """
+        Set the value of the record (its shard is loaded if needed).
+
+        :param row: position of the record
+        :param column: library column
+        :param value: new value
+        """
+        shard, local = self.__locate(row)
+        self.__load(shard).library.set(local, column, value)
+        self.__dirty.add(shard)
+        self.__changed.add(row)
+
+    def new_codename(self) -> str:
+        """
+        Get the codename for the next record (MX + number following the highest number issued in the library).
+
+        :returns: new codename
+        """
+        return "MX" + str(self.__next_codename).zfill(5)
+
+    def window(self, first_rt: float, second_rt: float) -> np.ndarray:
+        """
+        Find records inside the search window (+- 50 s in the first dimension, +- 0.9 s in the second dimension), no
+        shard is loaded.
+
+        :param first_rt: retention time in the first dimension
+        :param second_rt: retention time in the second dimension
+        :returns: positions of the records in ascending order
+        """
+        return self.__rt_index.window(first_rt, second_rt)
+
+    def score(self, spectrum: dict, rows: list) -> np.ndarray:
+        """
+        Compare the inspected spectrum to the selected records.
+
+        :param spectrum: inspected spectrum (not transformed)
+        :param rows: positions of the compared records
+        :returns: array of similarity results
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        scores = np.zeros(len(rows))
+        for shard, positions, local in self.__group(rows):
+            scores[positions] = self.__load(shard).library.score(spectrum, local)
+        return scores
+
+    def score_pruned(self, spectrum: dict, rows: np.ndarray, threshold: float) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Compare the inspected spectrum to the selected records which can exceed the threshold (see SpectraMatrix).
+
+        :param spectrum: inspected spectrum (not transformed)
+        :param rows: positions of the compared records
+        :param threshold: match threshold
+        :returns: array of similarity results (-inf for pruned records) and mask of the scored records
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        scores, kept = np.full(len(rows), -np.inf), np.zeros(len(rows), dtype=bool)
+        for shard, positions, local in self.__group(rows):
+            scores[positions], kept[positions] = self.__load(shard).library.score_pruned(spectrum, local, threshold)
+        return scores, kept
+
+    def add_record(self, record: dict) -> int:
+        """
+        Add a new record to the shard with the nearest 1st RT range.
+
+        :param record: new record with all library columns
+        :returns: position of the new record
+        """
+        first_rt = float(record["1st RT"])
+        distance = np.fmax(np.fmax(self.__ranges[:, 0] - first_rt, first_rt - self.__ranges[:, 1]), 0)
+        shard = int(np.argmin(np.nan_to_num(distance, nan=np.inf)))
+        loaded = self.__load(shard)
+        local = loaded.library.add_record(record)
+        row = self.__records
+        self.__records += 1
+        self.__added[row] = (shard, local)
+        loaded.rows = np.append(loaded.rows, row)
+        self.__touch(shard, row, first_rt, float(record["2nd RT"]))
+        try:
+            self.__next_codename = max(self.__next_codename, int(record["Codename"].split("X")[1]) + 1)
+        except (AttributeError, IndexError, ValueError):
+            pass
+        return row
+
+    def update_record(self, row: int, first_rt: float, second_rt: float, spectrum: dict, found: str) -> None:
+        """
+        Add a new hit to the record and recalculate its medians (see KPLLibrary.update_record).
+
+        :param row: position of the record
+        :param first_rt: retention time of the hit in the first dimension
+        :param second_rt: retention time of the hit in the second dimension
+        :param spectrum: spectrum of the hit (not transformed)
+        :param found: name of the chromatogram
+        """
+        shard, local = self.__locate(row)
+        library = self.__load(shard).library
+        library.update_record(local, first_rt, second_rt, spectrum, found)
+        self.__touch(shard, row, float(library.get(local, "1st RT")), float(library.get(local, "2nd RT")))
+
+    def save(self, path: str) -> None:
+        """
+        Save the library and its manifest. A .kpls library is saved shard by shard (unchanged shards are copied, or kept
+        if the library is saved in place), the other formats need all records in memory.
+
+        :param path: path to the library
+        """
+        if path.rstrip(os.sep).split(".")[-1] != "kpls":
+            database = self.database
+            kpl_columnar.write_library(database, path)
+            retired = self.__next_codename > kpl_columnar.next_codename(database["Codename"])
+            kpl_columnar.write_manifest(self.__manifest.entries, path, self.__next_codename if retired else 0)
+            return
+        os.makedirs(path, exist_ok=True)
+        in_place = os.path.abspath(path.rstrip(os.sep)) == os.path.abspath(self.__store.path)
+        shards = []
+        for shard, entry in enumerate(self.__store.shards):
+            target = f"{path.rstrip(os.sep)}{os.sep}{entry['name']}"
+            if shard in self.__dirty:
+                loaded = self.__cache[shard]
+                entry = kpl_columnar.write_shard(loaded.library.database, loaded.rows, target)
+            elif shard in self.__spilled or not in_place:
+                source = self.__spilled.get(shard, self.__store.shard_path(shard))
+                shutil.rmtree(target, ignore_errors=True)
+                shutil.copytree(source, target)
+                entry = {**entry, "bytes": kpl_columnar.folder_size(target)}
+            records = len(np.load(f"{target}{os.sep}rows.npy", mmap_mode="r"))
+            first_rt = None if np.isnan(self.__ranges[shard, 0]) else self.__ranges[shard].tolist()
+            shards.append({**entry, "records": records, "first_rt": first_rt})
+        kpl_columnar.write_shard_manifest(path, shards, len(self), self.__next_codename)
+        kpl_columnar.write_manifest(self.__manifest.entries, path)
+
+    def __locate(self, row: int) -> tuple[int, int]:
+        """Get the shard of the record and its position in the shard."""
+        if row < self.__stored:
+            return int(self.__shard_of[row]), int(self.__local_of[row])
+        return self.__added[row]
+
+    def __group(self, rows: np.ndarray):
+        """Split the records by shards, yields (shard, positions in rows, positions in the shard)."""
+        shards, local = np.zeros(len(rows), dtype=np.int64), np.zeros(len(rows), dtype=np.int64)
+        stored = rows < self.__stored
+        shards[stored], local[stored] = self.__shard_of[rows[stored]], self.__local_of[rows[stored]]
+        for position in np.flatnonzero(~stored).tolist():
+            shards[position], local[position] = self.__added[int(rows[position])]
+        for shard in np.unique(shards).tolist():
+            positions = np.flatnonzero(shards == shard)
+            yield shard, positions, local[positions]
+
+    def __touch(self, shard: int, row: int, first_rt: float, second_rt: float) -> None:
+        """Mark the changed record, move it in the RT index and grow the 1st RT range of its shard."""
+        self.__dirty.add(shard)
+        self.__changed.add(row)
+        self.__rt_index.set_row(row, first_rt, second_rt)
+        if not np.isnan(first_rt):
+            self.__ranges[shard] = [np.fmin(self.__ranges[shard, 0], first_rt),
+                                    np.fmax(self.__ranges[shard, 1], first_rt)]
+
+    def __load(self, shard: int) -> _Shard:
+        """Get the loaded shard, load it (and drop the least recently used shards over the memory cap) if needed."""
+        if shard in self.__cache:
+            self.__cache.move_to_end(shard)
+            return self.__cache[shard]
+        used = sum(self.MEMORY_FACTOR * self.__bytes[number] for number in self.__cache)
+        while self.__cache and used + self.MEMORY_FACTOR * self.__bytes[shard] > self.cache_bytes:
+            number = next(iter(self.__cache))
+            used -= self.MEMORY_FACTOR * self.__bytes[number]
+            self.__evict(number)
+        path = self.__spilled.get(shard, self.__store.shard_path(shard))
+        library = KPLLibrary(kpl_columnar.ColumnarLibrary(path).to_frame())
+        if self.__approximate is not None:
+            library.approximate(*self.__approximate)
+        self.__cache[shard] = _Shard(library, np.load(f"{path}{os.sep}rows.npy"))
+        self.loads += 1
+        return self.__cache[shard]
+
+    def __evict(self, shard: int) -> None:
+        """Drop the shard from the cache, a changed shard is written to the temporary folder first."""
+        loaded = self.__cache.pop(shard)
+        self.evictions += 1
+        if shard in self.__dirty:
+            if self.__spill is None:
+                self.__spill = tempfile.TemporaryDirectory(prefix="kpl_shards_")
+            entry = kpl_columnar.write_shard(loaded.library.database, loaded.rows,
+                                             f"{self.__spill.name}{os.sep}{self.__store.shards[shard]['name']}")
+            self.__spilled[shard] = f"{self.__spill.name}{os.sep}{entry['name']}"
+            self.__bytes[shard] = entry["bytes"]
+            self.__dirty.discard(shard)
+
+
+class ShardSnapshot:
+    """Snapshot of a sharded library for the map phase of the compare tool.
+
+    In the process of the library the snapshot reads the library itself: records changed since the library was opened
+    are always scored again by the reduce phase (see ShardedKPLLibrary.changed), so the scores of the other records are
+    the same as from a frozen copy and no shard is loaded twice. Sent to a worker process, the snapshot opens the stored
+    library there, with the same memory cap.
+    """
+
+    def __init__(self, library: ShardedKPLLibrary, approximate: tuple = None):
+        """
+        Initialize the snapshot.
+
+        :param library: sharded library
+        :param approximate: parameters (recall, cutoff, bits) of the approximate search of the library, None if disabled
+        """
+        self.__library = library
+        self.__approximate = approximate
+
+    def __getstate__(self) -> dict:
+        return {"path": self.__library.path, "cache_bytes": self.__library.cache_bytes,
+                "approximate": self.__approximate}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__library = ShardedKPLLibrary(state["path"], state["cache_bytes"])
+        self.__approximate = state["approximate"]
+        if self.__approximate is not None:
+            self.__library.approximate(*self.__approximate)
+
+    def window(self, first_rt: float, second_rt: float) -> np.ndarray:
+        """
+        Find records inside the search window.
+
+        :param first_rt: retention time in the first dimension
+        :param second_rt: retention time in the second dimension
+        :returns: positions of the records in ascending order
+        """
+        return self.__library.window(first_rt, second_rt)
+
+    def score(self, spectrum: dict, rows: list) -> np.ndarray:
+        """
+        Compare the inspected spectrum to the selected records.
+
+        :param spectrum: inspected spectrum (not transformed)
+        :param rows: positions of the compared records
+        :returns: array of similarity results
+        """
+        return self.__library.score(spectrum, rows)
+
+    def score_pruned(self, spectrum: dict, rows: np.ndarray, threshold: float) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Compare the inspected spectrum to the selected records which can exceed the threshold (see SpectraMatrix).
+
+        :param spectrum: inspected spectrum (not transformed)
+        :param rows: positions of the compared records
+        :param threshold: match threshold
+        :returns: array of similarity results (-inf for pruned records) and mask of the scored records
+        """
+        return self.__library.score_pruned(spectrum, rows, threshold)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Manifest of the chromatograms ingested into the library.
+
+Each ingested chromatogram is stored by its content hash (sha256) together with its file name, size and modification
+time. A file with the same name, size and modification time as a stored one is recognised without reading it, any other
+file is hashed, so a renamed or copied chromatogram is recognised as well as an unchanged one.
+"""
+import hashlib
+import os
+
+_CHUNK = 1 << 20
+
+
+def file_hash(file: str) -> str:
+    """
+    Hash the content of the file.
+
+    :param file: path to the file
+    :returns: sha256 hex digest
+    """
+    digest = hashlib.sha256()
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """Ingested chromatograms of a library."""
+
+    def __init__(self, entries: list = None):
+        """
+        Initialize the manifest.
+
+        :param entries: stored entries ({"file", "size", "mtime", "sha256"})
+        """
+        self.__hashes = {}
+        self.__stats = {}
+        for entry in entries or []:
+            self.add(entry)
+
+    def __len__(self) -> int:
+        """Number of ingested chromatograms"""
+        return len(self.__hashes)
+
+    @property
+    def entries(self) -> list:
+        """Stored entries"""
+        return list(self.__hashes.values())
+
+    def check(self, file: str) -> tuple[dict, dict]:
+        """
+        Check whether the chromatogram was already ingested.
+
+        :param file: path to the chromatogram
+        :returns: entry of the file and the stored entry with the same content (None for a new or changed file)
+        """
+        stat = os.stat(file)
+        key = (os.path.basename(file), stat.st_size, stat.st_mtime)
+        if key in self.__stats:
+            return self.__stats[key], self.__stats[key]
+        entry = {"file": key[0], "size": stat.st_size, "mtime": stat.st_mtime, "sha256": file_hash(file)}
+        return entry, self.__hashes.get(entry["sha256"])
+
+    def add(self, entry: dict) -> None:
+        """
+        Add the ingested chromatogram.
+
+        :param entry: entry of the file (see check)
+        """
+        self.__hashes[entry["sha256"]] = entry
+        self.__stats[(entry["file"], entry["size"], entry["mtime"])] = entry
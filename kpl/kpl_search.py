@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""Search of peaks by their spectra only, independent of retention times.
+
+Chromatograms measured with other column or modulation settings do not share the retention times of the library, so the
+search window of compare finds nothing useful. The transformed spectra of the library are kept as a sparse matrix
+(records x m/z values, see SparseSpectra) and all peaks of a chromatogram are scored against all records by sparse
+matrix products; for each peak the best records above the similarity cutoff are returned:
+
+    spectra = SparseSpectra.from_library(path)
+    records, scores = spectra.search(helper.parse_spectra(df["Spectra"]), top=5, cutoff=90)
+
+The similarity is the one of the config file (DOT or Pearson), the same as scoring the peak against each record.
+"""
+import numpy as np
+from scipy import sparse
+
+import helper
+import kpl_columnar
+
+# stored entries of the product of one block of peaks with the library
+BLOCK_ENTRIES = 1 << 22
+
+
+class SparseSpectra:
+    """Transformed spectra of the library as a sparse matrix, the column of each m/z value is the m/z value itself."""
+
+    def __init__(self, codenames: list, offsets: np.ndarray, masses: np.ndarray, intensities: np.ndarray,
+                 transformation: tuple):
+        """
+        Build the matrix from spectra in CSR-like arrays (see helper.parse_spectra).
+
+        :param codenames: codenames of the records
+        :param offsets: offsets of the spectra of the records in masses and intensities
+        :param masses: m/z values
+        :param intensities: intensities (not transformed)
+        :param transformation: exponents (a, b) used for the transformation of intensities and masses
+        """
+        self.codenames = np.asarray(codenames, dtype=object)
+        self.transformation = tuple(transformation)
+        self.__power = np.zeros(0)
+        values = self.__transform(masses, intensities)
+        width = int(masses.max()) + 1 if len(masses) else 1
+        self.matrix = sparse.csr_matrix((values, masses, offsets), shape=(len(self.codenames), width))
+        self.matrix.sort_indices()
+        # the mask keeps m/z values with zero intensity, they count for Pearson's coefficient
+        self.mask = sparse.csr_matrix((np.ones(len(masses)), masses, offsets), shape=self.matrix.shape)
+        self.mask.sort_indices()
+        self.norms = np.sqrt(self.matrix.multiply(self.matrix).sum(axis=1).A1)
+        self.sums = self.matrix.sum(axis=1).A1
+        self.counts = np.diff(offsets)
+
+    def __len__(self) -> int:
+        """Number of records"""
+        return len(self.codenames)
+
+    @classmethod
+    def from_library(cls, path: str, chunk_records: int = kpl_columnar.SHARD_RECORDS) -> "SparseSpectra":
+        """
+        Build the matrix from the library, only one chunk of records is decoded at a time (see
+        kpl_columnar.iter_library).
+
+        :param path: path to the library (.h5, .txt, .kplc or .kpls)
+        :param chunk_records: number of records in each decoded chunk
+        :returns: sparse spectra of the library
+        """
+        codenames, lengths, masses, intensities = [], [], [], []
+        for chunk, _ in kpl_columnar.iter_library(path, chunk_records):
+            spectra = chunk["Spectra"].tolist()
+            codenames.extend(chunk["Codename"].tolist())
+            lengths.append(np.fromiter((len(spectrum) for spectrum in spectra), dtype=np.int64, count=len(spectra)))
+            masses.append(np.fromiter((mass for spectrum in spectra for mass in spectrum), dtype=np.int64,
+                                      count=int(lengths[-1].sum())))
+            intensities.append(np.fromiter((value for spectrum in spectra for value in spectrum.values()),
+                                           dtype=float, count=int(lengths[-1].sum())))
+        offsets = np.zeros(len(codenames) + 1, dtype=np.int64)
+        if lengths:
+            np.cumsum(np.concatenate(lengths), out=offsets[1:])
+        return cls(codenames, offsets,
+                   np.concatenate(masses) if masses else np.zeros(0, dtype=np.int64),
+                   np.concatenate(intensities) if intensities else np.zeros(0),
+                   helper.load_config()["transformation"])
+
+    def search(self, spectra: tuple, top: int = 5, cutoff: float = 90) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Score the peaks against all records and find the best records of each peak.
+
+        The peaks are scored in blocks, so that the product of a block with the library holds at most BLOCK_ENTRIES
+        similarity results. The norms and sums of the peaks include m/z values unknown to the library.
+
+        :param spectra: parsed spectra of the peaks (see helper.parse_spectra)
+        :param top: number of the best records of each peak
+        :param cutoff: similarity above which a record is a hit
+        :returns: positions of the best records of each peak (peaks x top, -1 pads peaks with fewer hits) and their
+        similarity (NaN for the padding), the best records first
+        """
+        offsets, masses, intensities, _ = spectra
+        peaks = len(offsets) - 1
+        records = np.full((peaks, top), -1, dtype=np.int64)
+        scores = np.full((peaks, top), np.nan)
+        block = max(1, BLOCK_ENTRIES // max(len(self), 1))
+        for start in range(0, peaks, block):
+            stop = min(start + block, peaks)
+            lower, upper = offsets[start], offsets[stop]
+            rows = np.repeat(np.arange(stop - start), np.diff(offsets[start:stop + 1]))
+            block_masses, values = masses[lower:upper], self.__transform(masses[lower:upper], intensities[lower:upper])
+            # the product of the sparse library with the block of peaks, records x peaks
+            products = self.matrix @ self.__query(rows, block_masses, values, stop - start)
+            squares = np.bincount(rows, values ** 2, minlength=stop - start)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                if helper.load_config()["sim_compare"] == "DOT":
+                    similarity = products / (np.sqrt(squares)[None, :] * self.norms[:, None]) * 100
+                else:
+                    counts = (np.bincount(rows, minlength=stop - start)[None, :] + self.counts[:, None]
+                              - self.mask @ self.__query(rows, block_masses, np.ones(len(rows)), stop - start))
+                    sums = np.bincount(rows, values, minlength=stop - start)[None, :]
+                    pearson = ((products - sums * self.sums[:, None] / counts)
+                               / np.sqrt((squares[None, :] - sums ** 2 / counts)
+                                         * ((self.norms ** 2)[:, None] - self.sums[:, None] ** 2 / counts)))
+                    similarity = np.round(np.clip(pearson, -1, 1) * 100, 2)
+            record, peak = np.nonzero(similarity > cutoff)
+            similarity = similarity[record, peak]
+            # the best records of each peak first, ties in the order of the library
+            order = np.lexsort((record, -similarity, peak))
+            peak, record, similarity = peak[order], record[order], similarity[order]
+            rank = np.arange(len(peak)) - np.searchsorted(peak, peak)
+            best = rank < top
+            records[start + peak[best], rank[best]] = record[best]
+            scores[start + peak[best], rank[best]] = similarity[best]
+        return records, scores
+
+    def __query(self, rows: np.ndarray, masses: np.ndarray, values: np.ndarray, peaks: int) -> np.ndarray:
+        """Align the peaks to the library columns (m/z values x peaks), unknown m/z values are dropped."""
+        query = np.zeros((self.matrix.shape[1], peaks))
+        known = masses < self.matrix.shape[1]
+        query[masses[known], rows[known]] = values[known]
+        return query
+
+    def __transform(self, masses: np.ndarray, values: np.ndarray) -> np.ndarray:
+        """Transform intensities: round(mass ** b * intensity ** a, 2), the same as SpectraMatrix."""
+        if len(masses) and masses.max() >= len(self.__power):
+            self.__power = np.arange(int(masses.max()) + 1, dtype=float) ** self.transformation[1]
+        return helper.round_array(self.__power[masses] * values ** self.transformation[0])
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""Per-stage timers, counters and histograms of kpl runs.
+
+Stages are timed with perf_counter (wall time and number of calls), histograms keep counts in power-of-two buckets
+(0, 1, 2-3, 4-7, ...) together with count, sum, min and max. Statistics collected in worker processes are merged into
+the run statistics, their stage times are summed over the processes.
+"""
+import contextlib
+import cProfile
+import json
+import logging
+import time
+
+
+class _Stage:
+    """Context manager timing one call of a stage."""
+
+    __slots__ = ("stats", "name", "start")
+
+    def __init__(self, stats: "RunStats", name: str):
+        self.stats = stats
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class RunStats:
+    """Statistics of a kpl run."""
+
+    def __init__(self):
+        """Initialize empty statistics."""
+        self.timers = {}
+        self.counters = {}
+        self.histograms = {}
+
+    def stage(self, name: str) -> _Stage:
+        """
+        Time a stage: with stats.stage("score"): ...
+
+        :param name: name of the stage
+        :returns: context manager
+        """
+        return _Stage(self, name)
+
+    def add_time(self, name: str, seconds: float, calls: int = 1) -> None:
+        """
+        Add time spent in the stage.
+
+        :param name: name of the stage
+        :param seconds: wall time
+        :param calls: number of calls
+        """
+        timer = self.timers.setdefault(name, [0.0, 0])
+        timer[0] += seconds
+        timer[1] += calls
+
+    def count(self, name: str, value: int = 1) -> None:
+        """
+        Increase the counter.
+
+        :param name: name of the counter
+        :param value: increment
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value: int) -> None:
+        """
+        Add the value to the histogram.
+
+        :param name: name of the histogram
+        :param value: observed non-negative value
+        """
+        histogram = self.histograms.setdefault(name, {"count": 0, "sum": 0, "min": value, "max": value,
+                                                      "buckets": {}})
+        histogram["count"] += 1
+        histogram["sum"] += value
+        histogram["min"] = min(histogram["min"], value)
+        histogram["max"] = max(histogram["max"], value)
+        bucket = 0 if value <= 0 else 1 << (int(value).bit_length() - 1)
+        histogram["buckets"][bucket] = histogram["buckets"].get(bucket, 0) + 1
+
+    def merge(self, other: dict) -> None:
+        """
+        Merge the statistics of another run or worker process.
+
+        :param other: statistics from to_dict
+        """
+        for name, timer in other["timers"].items():
+            self.add_time(name, timer["seconds"], timer["calls"])
+        for name, value in other["counters"].items():
+            self.count(name, value)
+        for name, histogram in other["histograms"].items():
+            mine = self.histograms.setdefault(name, {"count": 0, "sum": 0, "min": histogram["min"],
+                                                     "max": histogram["max"], "buckets": {}})
+            mine["count"] += histogram["count"]
+            mine["sum"] += histogram["sum"]
+            mine["min"] = min(mine["min"], histogram["min"])
+            mine["max"] = max(mine["max"], histogram["max"])
+            for bucket, count in histogram["buckets"].items():
+                mine["buckets"][int(bucket)] = mine["buckets"].get(int(bucket), 0) + count
+
+    def to_dict(self) -> dict:
+        """
+        Get the statistics as JSON compatible dict.
+
+        :returns: timers ({stage: {seconds, calls}}), counters and histograms
+        """
+        return {"timers": {name: {"seconds": seconds, "calls": calls}
+                           for name, (seconds, calls) in self.timers.items()},
+                "counters": dict(self.counters),
+                "histograms": {name: {**histogram, "mean": histogram["sum"] / histogram["count"],
+                                      "buckets": {str(bucket): count
+                                                  for bucket, count in sorted(histogram["buckets"].items())}}
+                               for name, histogram in self.histograms.items()}}
+
+    def summary(self) -> list:
+        """
+        Get human readable summary of the statistics.
+
+        :returns: lines of the summary
+        """
+        lines = ["Stage timings (stage: total s, calls, ms per call):"]
+        for name, (seconds, calls) in sorted(self.timers.items(), key=lambda item: -item[1][0]):
+            lines.append(f"  {name}: {seconds:.3f} s, {calls} calls, {1000 * seconds / calls:.3f} ms")
+        if self.counters:
+            lines.append("Counters: " + ", ".join(f"{name}={value}" for name, value in sorted(self.counters.items())))
+        for name, histogram in sorted(self.histograms.items()):
+            buckets = ", ".join(f"{bucket if bucket < 2 else f'{bucket}-{2 * bucket - 1}'}: {count}"
+                                for bucket, count in sorted(histogram["buckets"].items()))
+            lines.append(f"Histogram {name}: count {histogram['count']}, mean "
+                         f"{histogram['sum'] / histogram['count']:.2f}, min {histogram['min']}, "
+                         f"max {histogram['max']} ({buckets})")
+        return lines
+
+    def report(self, path: str = None) -> None:
+        """
+        Write the summary to the log and the statistics to the JSON report.
+
+        :param path: path to the JSON report, only the log is written if None
+        """
+        for line in self.summary():
+            logging.info(line)
+        if path:
+            with open(path, "w") as j:
+                j.write(json.dumps(self.to_dict(), indent=1))
+
+
+@contextlib.contextmanager
+def profile(path: str = None):
+    """
+    Profile the block with cProfile and dump the statistics (readable by pstats or snakeviz).
+
+    :param path: path of the dump, nothing is profiled if None
+    """
+    if not path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Shared fixtures of the tests. The tools use flat imports, so their folders are put on the path."""
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ("common", "kpl", "data_processing"):
+    sys.path.insert(0, os.path.join(ROOT, folder))
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run the test in an empty folder with the kpl config file (DOT similarity) and a cache in it."""
+    with open(os.path.join(ROOT, "kpl", "config.txt")) as f:
+        config = json.load(f)
+    config["sim_compare"] = "DOT"
+    (tmp_path / "config.txt").write_text(json.dumps(config))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("CHROM_CACHE", str(tmp_path / "cache"))
+    return tmp_path
+
+
+@pytest.fixture
+def write_export():
+    """Writer of ChromaTOF exports (see _write_export)."""
+    return _write_export
+
+
+def _write_export(path, peaks: list) -> str:
+    """
+    Write a ChromaTOF export (latin-1, decimal commas in the second dimension).
+
+    :param path: path to the export
+    :param peaks: list of (name, 1st RT, 2nd RT, {m/z: intensity})
+    :returns: the path as string
+    """
+    lines = ["Name\t1st Dimension Time (s)\t2nd Dimension Time (s)\tSpectra\tArea"]
+    for ix, (name, first_rt, second_rt, spectrum) in enumerate(peaks):
+        text = " ".join(f"{mass}:{value:g}" for mass, value in spectrum.items())
+        lines.append(f"{name}\t{first_rt}\t{str(second_rt).replace('.', ',')}\t{text}\t{1000 + ix}")
+    with open(path, "w", encoding="latin-1") as f:
+        f.write("\n".join(lines) + "\n")
+    return str(path)
+
+
+@pytest.fixture
+def make_record():
+    """Builder of library records (see _make_record)."""
+    return _make_record
+
+
+def _make_record(codename: str, first_rt: float, second_rt: float, spectrum: dict, found: list = ("a",),
+                 name: str = "peak") -> dict:
+    """
+    Build a library record with one hit per found chromatogram at the same retention times and spectrum.
+
+    :param codename: codename of the record
+    :param first_rt: retention time in the first dimension
+    :param second_rt: retention time in the second dimension
+    :param spectrum: spectrum {m/z: intensity} (not transformed)
+    :param found: names of the chromatograms the record was found in
+    :param name: name of the compound
+    :returns: record with all library columns
+    """
+    return {"Codename": codename, "1st RT": first_rt, "2nd RT": second_rt, "Spectra": dict(spectrum),
+            "Found": list(found), "Name": name, "calc_1stRT": [first_rt] * len(found),
+            "calc_2ndRT": [second_rt] * len(found),
+            "calc_spectra": {mass: [value] * len(found) for mass, value in spectrum.items()}}
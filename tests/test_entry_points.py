@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""Imports of the tool modules as the launchers run them: from the tool folder, without common/ on the path."""
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+
+def _import(folder: str, module: str) -> subprocess.CompletedProcess:
+    """Import the module in a fresh interpreter started in the tool folder and print where common/ was found."""
+    env = {key: value for key, value in os.environ.items() if key != "PYTHONPATH"}
+    return subprocess.run([sys.executable, "-c", f"import {module}, export_cache; print(export_cache.__file__)"],
+                          cwd=os.path.join(ROOT, folder), env=env, capture_output=True, text=True)
+
+
+@pytest.mark.parametrize("module", ["kpl_engine", "kpl_ingest"])
+def test_import_from_tool_folder(module):
+    result = _import("kpl", module)
+    assert result.returncode == 0, result.stderr
+    assert os.path.dirname(result.stdout.strip()) == os.path.join(ROOT, "common")
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Tests of the cache of parsed exports shared by the tools."""
+import pandas as pd
+
+import export_cache
+import kpl_engine
+import kpl_ingest
+from export_cache import ExportCache
+from kpl_stats import RunStats
+from sort_by_name import SortByName
+
+PEAKS = [("Benzene", 310.5, 1.25, {78: 9999, 77: 1500, 51: 800}),
+         ("Toluene", 402.0, 1.5, {91: 9999, 92: 6000}),
+         ("Xylene", 512.3, 1.75, {106: 7000, 91: 9999, 105: 2500})]
+
+
+def sort_by_name_reader(cache: ExportCache) -> SortByName:
+    """SortByName reading through the cache, without its window."""
+    reader = object.__new__(SortByName)
+    reader._SortByName__cache = cache
+    return reader
+
+
+def test_round_trip(workdir, write_export):
+    path = write_export(workdir / "export.txt", PEAKS)
+    cache = ExportCache(str(workdir / "cache"))
+    parsed = cache.read(path, "utf-8", lambda file: pd.read_csv(file, sep="\t"))
+    assert (cache.hits, cache.misses) == (0, 1)
+    pd.testing.assert_frame_equal(cache.read(path, "utf-8", None), parsed)
+    assert cache.hits == 1
+
+
+def test_kpl_entry_is_read_by_data_processing(workdir, write_export):
+    path = write_export(workdir / "export.txt", PEAKS)
+    cache = ExportCache(str(workdir / "cache"))
+    kpl_engine.read_chromatogram(path, RunStats(), cache=cache)
+    assert cache.misses == 1
+    table = sort_by_name_reader(cache).read_table(path)
+    assert cache.hits == 1
+    pd.testing.assert_frame_equal(table, pd.read_csv(path, sep="\t", encoding="utf-8"))
+
+
+def test_data_processing_entry_is_read_by_kpl(workdir, write_export):
+    path = write_export(workdir / "export.txt", PEAKS)
+    cache = ExportCache(str(workdir / "cache"))
+    sort_by_name_reader(cache).read_table(path)
+    df = kpl_ingest.read_export(path, cache=cache)
+    assert cache.hits == 1
+    pd.testing.assert_frame_equal(df, kpl_ingest.read_export(path))
+
+
+def test_non_ascii_entries_are_kept_per_encoding(workdir, write_export):
+    path = write_export(workdir / "export.txt", [("Limonène", 310.5, 1.25, {68: 9999})])
+    cache = ExportCache(str(workdir / "cache"))
+    digest = export_cache.file_hash(path)
+    latin = cache.read(path, "latin-1", lambda file: pd.read_csv(file, sep="\t", encoding="latin-1"))
+    assert latin.at[0, "Name"] == "Limonène"
+    assert cache.load(digest, "utf-8") is None
+    assert cache.load(digest, "ISO-8859-1")[0].at[0, "Name"] == "Limonène"
+
+
+def test_format_check_is_timed_separately(workdir, write_export):
+    path = write_export(workdir / "export.txt", PEAKS)
+    cache = ExportCache(str(workdir / "cache"))
+    # without the cache, on a cache miss and on a cache hit
+    for reader in (None, cache, cache):
+        stats = RunStats()
+        kpl_engine.read_chromatogram(path, stats, cache=reader)
+        assert stats.timers["read_export"][1] == 1
+        assert stats.timers["check_formatting"][1] == 1
+    assert (cache.hits, cache.misses) == (1, 1)
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Round-trips of the library through the supported formats (.h5, .txt, .kplc, .kpls)."""
+import numpy as np
+import pandas as pd
+import pytest
+
+import kpl_columnar
+
+
+@pytest.fixture
+def database(make_record):
+    """Records with non-ASCII names (bytes, as in the libraries), int and float intensities and a missing spectrum."""
+    records = [make_record("MX00000", 600.0, 2.5, {41: 100.0, 43: 50.5}, found=("a", "b"), name=b"Hexanal"),
+               make_record("MX00001", 300.0, 1.25, {57: 12, 71: 3.75}, name="Ethylbenzoát".encode("utf-8")),
+               make_record("MX00002", 900.0, 3.0, {0: 0}, found=("c",), name=b"Unknown"),
+               make_record("MX00003", 450.0, 0.75, {91: 999.9}, found=("a", "c", "d"), name=b"Toluene")]
+    records[0]["calc_1stRT"] = [599.0, 601.0]
+    records[0]["calc_spectra"] = {41: [90.0, 110.0], 43: [50, 51.0]}
+    return pd.DataFrame(records, columns=kpl_columnar.COLUMNS)
+
+
+def _records(database: pd.DataFrame) -> list:
+    """Records with the types of the values, so ints and floats are told apart."""
+    def typed(value):
+        if isinstance(value, dict):
+            return {typed(key): typed(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [typed(item) for item in value]
+        return value, type(value) is int
+    return [typed(record) for record in database.reset_index(drop=True).to_dict("records")]
+
+
+@pytest.mark.parametrize("extension", ["h5", "txt", "kplc", "kpls"])
+def test_library_round_trip(database, tmp_path, extension):
+    path = str(tmp_path / f"library.{extension}")
+    kpl_columnar.write_library(database, path)
+    assert _records(kpl_columnar.read_library(path)) == _records(database)
+
+
+def test_columnar_record_decodes_one_record(database, tmp_path):
+    path = str(tmp_path / "library.kplc")
+    kpl_columnar.write_columnar(database, path)
+    library = kpl_columnar.ColumnarLibrary(path)
+    assert [library.record(row) for row in range(len(database))] == database.to_dict("records")
+    assert _records(library.to_frame(rows=np.array([3, 1]))) == _records(database.iloc[[3, 1]])
+
+
+def test_sharded_round_trip_keeps_library_order(database, tmp_path):
+    path = str(tmp_path / "library.kpls")
+    kpl_columnar.write_sharded(database, path, shard_records=2)
+    store = kpl_columnar.ShardedStore(path)
+    assert len(store.shards) == 2
+    # the shards split the records by the 1st RT, the library order is restored from their positions
+    assert sorted(kpl_columnar.ColumnarLibrary(store.shard_path(0)).to_frame()["1st RT"]) == [300.0, 450.0]
+    assert _records(store.to_frame()) == _records(database)
+
+
+@pytest.mark.parametrize("extension", ["txt", "kplc", "kpls"])
+def test_iter_library_by_rt(database, tmp_path, extension):
+    path = str(tmp_path / f"library.{extension}")
+    kpl_columnar.write_library(database, path)
+    chunks = list(kpl_columnar.iter_library(path, chunk_records=3, by_rt=True))
+    rows = np.concatenate([rows for _, rows in chunks])
+    assert sorted(rows.tolist()) == [0, 1, 2, 3]
+    for chunk, positions in chunks:
+        assert _records(chunk) == _records(database.iloc[positions])
+    if extension != "kpls":
+        assert rows.tolist() == [1, 3, 0, 2]
+
+
+def test_convert_keeps_manifest_and_codename(database, tmp_path):
+    source, target = str(tmp_path / "library.h5"), str(tmp_path / "library.kplc")
+    entries = [{"file": "a.txt", "size": 10, "mtime": 1.0, "sha256": "0" * 64}]
+    kpl_columnar.write_library(database, source)
+    kpl_columnar.write_manifest(entries, source, 7)
+    kpl_columnar.convert(source, target)
+    assert _records(kpl_columnar.read_library(target)) == _records(database)
+    assert kpl_columnar.read_manifest(target) == entries
+    assert kpl_columnar.read_codename(target) == 7
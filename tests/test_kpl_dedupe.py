@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""Tests of dedupe_library: remapping of the merged records and retired codenames."""
+import pandas as pd
+import pytest
+
+import kpl_engine
+from kpl_library import KPLLibrary, ShardedKPLLibrary
+
+FIRST = {41: 100.0, 43: 50.0, 57: 20.0}
+SECOND = {91: 100.0, 105: 30.0, 120: 10.0}
+
+
+@pytest.fixture
+def library_path(workdir, make_record):
+    """Library whose last record duplicates the first one, so dedupe retires the highest codename."""
+    records = [make_record("MX00000", 600.0, 2.5, FIRST, found=("a", "b")),
+               make_record("MX00001", 900.0, 1.5, SECOND),
+               make_record("MX00002", 601.0, 2.5, FIRST)]
+    path = str(workdir / "core.h5")
+    KPLLibrary(pd.DataFrame(records)).save(path)
+    return path
+
+
+def test_dedupe_remaps_merged_records(library_path, workdir):
+    remap = kpl_engine.dedupe_library(library_path, str(workdir / "deduped.h5"), echo=lambda message: None)
+    assert remap == {"MX00002": "MX00000"}
+    remapped = pd.read_csv(f"{workdir / 'deduped.h5'}.remap.tsv", sep="\t")
+    assert remapped[["Old codename", "New codename"]].values.tolist() == [["MX00002", "MX00000"]]
+    deduped = KPLLibrary.load(str(workdir / "deduped.h5"))
+    assert deduped.database["Codename"].tolist() == ["MX00000", "MX00001"]
+    assert sorted(deduped.get(0, "Found")) == ["a", "a", "b"]
+
+
+@pytest.mark.parametrize("extension", ["h5", "txt", "kplc", "kpls"])
+def test_dedupe_never_reissues_retired_codename(library_path, workdir, extension):
+    target = str(workdir / f"deduped.{extension}")
+    retired = kpl_engine.dedupe_library(library_path, target, echo=lambda message: None)
+    deduped = ShardedKPLLibrary(target) if extension == "kpls" else KPLLibrary.load(target)
+    assert deduped.new_codename() == "MX00003"
+    assert deduped.new_codename() not in retired
+    # the counter survives a further save of the library, also in another format
+    deduped.save(str(workdir / "resaved.h5"))
+    assert KPLLibrary.load(str(workdir / "resaved.h5")).new_codename() == "MX00003"
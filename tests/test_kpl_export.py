@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""Round-trips of the library through the chunked exports (.tsv, .parquet, .kpls)."""
+import pandas as pd
+import pytest
+
+import kpl_columnar
+import kpl_export
+
+
+@pytest.fixture
+def library_path(tmp_path, make_record):
+    """Library (.h5) with a non-ASCII name, a record found nowhere and integer intensities, and its manifest."""
+    records = [make_record("MX00000", 600.0, 2.5, {41: 100.0, 43: 50.5}, found=("a", "b"), name=b"Hexanal"),
+               make_record("MX00001", 300.0, 1.25, {57: 12, 71: 3.75}, name="Ethylbenzoát".encode("utf-8")),
+               make_record("MX00002", 900.0, 3.0, {0: 0}, found=(), name=b"Unknown"),
+               make_record("MX00004", 450.0, 0.75, {91: 999.9}, found=("a", "c", "d"), name=b"Toluene")]
+    path = str(tmp_path / "library.h5")
+    kpl_columnar.write_library(pd.DataFrame(records, columns=kpl_columnar.COLUMNS), path)
+    kpl_columnar.write_manifest([{"file": "a.txt", "size": 10, "mtime": 1.0, "sha256": "0" * 64}], path, 6)
+    return path
+
+
+def test_tsv_round_trip(library_path, tmp_path):
+    target = str(tmp_path / "library.tsv")
+    assert kpl_export.export(library_path, target, chunk_records=3) == 4
+    exported = kpl_export.read_tsv(target)
+    expected = kpl_columnar.read_library(library_path)
+    assert exported.to_dict("records") == expected.to_dict("records")
+    # integer intensities stay integers
+    assert [type(value) for value in exported.at[1, "Spectra"].values()] == [int, float]
+
+
+def test_tsv_export_of_empty_library(tmp_path):
+    source, target = str(tmp_path / "library.kplc"), str(tmp_path / "library.tsv")
+    kpl_columnar.write_library(pd.DataFrame(columns=kpl_columnar.COLUMNS), source)
+    assert kpl_export.export(source, target) == 0
+    assert kpl_export.read_tsv(target).empty
+
+
+def test_parquet_round_trip(library_path, tmp_path):
+    parquet = pytest.importorskip("pyarrow.parquet")
+    target = str(tmp_path / "library.parquet")
+    assert kpl_export.export(library_path, target, chunk_records=3) == 4
+    assert parquet.ParquetFile(target).num_row_groups == 2
+    exported = kpl_export.unflatten(parquet.read_table(target).to_pandas())
+    assert exported.to_dict("records") == kpl_columnar.read_library(library_path).to_dict("records")
+
+
+def test_kpls_export_keeps_manifest_and_codename(library_path, tmp_path):
+    target = str(tmp_path / "library.kpls")
+    assert kpl_export.export(library_path, target, chunk_records=3) == 4
+    assert len(kpl_columnar.ShardedStore(target).shards) == 2
+    assert kpl_columnar.read_library(target).to_dict("records") == \
+        kpl_columnar.read_library(library_path).to_dict("records")
+    assert kpl_columnar.read_manifest(target) == kpl_columnar.read_manifest(library_path)
+    assert kpl_columnar.ShardedStore(target).meta["next_codename"] == 5
+    assert kpl_columnar.read_codename(target) == 6
+
+
+def test_unknown_format(library_path, tmp_path):
+    with pytest.raises(ValueError, match="Unknown export format"):
+        kpl_export.export(library_path, str(tmp_path / "library.csv"))
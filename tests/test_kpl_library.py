@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""Tests of the precomputed structures of the kpl library."""
+import random
+import statistics
+
+import numpy as np
+import pytest
+
+import helper
+from kpl_library import RTIndex, RunningMedian, SpectraMatrix
+
+
+def test_running_median_matches_statistics():
+    rng = random.Random(1)
+    values = [rng.uniform(0, 10) for _ in range(5)]
+    median = RunningMedian(values)
+    assert median.median == statistics.median(values)
+    for _ in range(200):
+        # repeated values exercise the ties between the two heaps
+        value = rng.choice([rng.uniform(-5, 15), values[0]])
+        values.append(value)
+        assert median.add(value) == statistics.median(values)
+        assert median.median == statistics.median(values)
+
+
+def test_running_median_single_value():
+    median = RunningMedian([3.5])
+    assert median.median == 3.5
+    assert median.add(1.5) == 2.5
+
+
+def _window(first, second, first_rt, second_rt):
+    """Records inside the default search window (the bounds computed as in compare), found by a full scan."""
+    inside = ((first >= first_rt - RTIndex.FIRST_BAND) & (first <= first_rt + RTIndex.FIRST_BAND)
+              & (second >= second_rt - RTIndex.SECOND_BAND) & (second <= second_rt + RTIndex.SECOND_BAND))
+    return np.flatnonzero(inside)
+
+
+@pytest.mark.parametrize("pending", [1, RTIndex.PENDING, 1000])
+def test_rt_index_matches_full_scan(monkeypatch, pending):
+    # merged after every update, after some updates, or never (all updates are scanned as pending records)
+    monkeypatch.setattr(RTIndex, "PENDING", pending)
+    rng = np.random.default_rng(3)
+    first = rng.uniform(0, 1000, 300).round(0)
+    second = rng.uniform(0, 5, 300).round(2)
+    first[::37] = np.nan
+    index = RTIndex(first, second)
+    # moved, added and invalidated records keep the index in sync with the retention times
+    first, second = np.append(first, np.full(20, np.nan)), np.append(second, np.full(20, np.nan))
+    for row in rng.integers(0, 300, 50).tolist() + list(range(300, 320)):
+        first[row], second[row] = round(rng.uniform(0, 1000)), round(rng.uniform(0, 5), 2)
+        index.set_row(row, first[row], second[row])
+    first[5], second[5] = np.nan, np.nan
+    index.set_row(5, np.nan, np.nan)
+    for first_rt, second_rt in zip(rng.uniform(0, 1000, 100).round(0), rng.uniform(0, 5, 100).round(2)):
+        np.testing.assert_array_equal(index.window(first_rt, second_rt), _window(first, second, first_rt, second_rt))
+
+
+def test_rt_index_window_includes_bounds():
+    index = RTIndex(np.array([100.0, 150.0, 50.0, 151.0]), np.array([2.0, 2.9, 1.1, 2.0]))
+    np.testing.assert_array_equal(index.window(100.0, 2.0), [0, 1, 2])
+
+
+def _spectrum(rng, base: dict = None) -> dict:
+    """Random spectrum, or a noisy copy of the base spectrum."""
+    if base is not None:
+        return {mass: round(value * rng.uniform(0.7, 1.3), 1) for mass, value in base.items()}
+    masses = rng.choice(np.arange(30, 300), size=int(rng.integers(3, 15)), replace=False)
+    return {int(mass): round(float(rng.uniform(1, 1000)), 1) for mass in masses}
+
+
+def test_key_ion_bound_never_prunes_a_match(workdir):
+    rng = np.random.default_rng(5)
+    spectra = [_spectrum(rng) for _ in range(200)]
+    matrix = SpectraMatrix(spectra, helper.load_config()["transformation"])
+    rows = np.arange(len(spectra))
+    pruned = 0
+    for query in [_spectrum(rng, spectra[row]) for row in range(0, 200, 4)] + [_spectrum(rng) for _ in range(50)]:
+        full = matrix.score(query, rows)
+        scores, keep = matrix.score_pruned(query, rows, 90)
+        # scored records get the exact similarity, pruned ones could not have matched
+        np.testing.assert_array_equal(scores[keep], full[keep])
+        assert (full[~keep] <= 90).all()
+        assert (scores[~keep] == -np.inf).all()
+        pruned += int((~keep).sum())
+    assert pruned > 0
+
+
+def test_key_ion_bound_keeps_match_without_shared_key_ion(workdir):
+    # the key ions of the record (41-45) and of the spectrum (46-50) differ, but the spectra are nearly the same
+    record = {mass: 120.0 if mass <= 45 else 100.0 for mass in range(41, 51)}
+    spectrum = {mass: 100.0 if mass <= 45 else 120.0 for mass in range(41, 51)}
+    matrix = SpectraMatrix([record], (1, 0))
+    assert not np.isin(matrix.keys[0], matrix.transform(spectrum)[0].argsort()[-5:]).any()
+    scores, keep = matrix.score_pruned(spectrum, np.array([0]), 90)
+    assert keep.all()
+    np.testing.assert_array_equal(scores, matrix.score(spectrum, np.array([0])))
+    assert scores[0] > 90
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""Tests of merge_libraries: codenames of the merged records in the core library."""
+import os
+
+import pandas as pd
+import pytest
+
+import kpl_engine
+from kpl_library import KPLLibrary
+
+FIRST = {41: 100.0, 43: 50.0, 57: 20.0}
+SECOND = {91: 100.0, 105: 30.0, 120: 10.0}
+THIRD = {73: 100.0, 147: 60.0, 207: 15.0}
+
+
+@pytest.fixture
+def libraries(workdir, make_record):
+    """Paths to the core library and to the user's library updated from it."""
+    core = [make_record("MX00000", 600.0, 2.5, FIRST),
+            make_record("MX00001", 900.0, 1.5, SECOND)]
+    user = [make_record("MX00010", 602.0, 2.5, FIRST, found=("u",)),
+            make_record("MX00011", 300.0, 1.0, THIRD, found=("u",)),
+            make_record("MX00012", 301.0, 1.0, THIRD, found=("v",)),
+            make_record("MX00001", 900.0, 1.5, SECOND, found=("a", "b"))]
+    core_path, user_path = str(workdir / "core.h5"), str(workdir / "user.h5")
+    KPLLibrary(pd.DataFrame(core)).save(core_path)
+    KPLLibrary(pd.DataFrame(user), [{"file": "u.txt", "size": 10, "mtime": 1.0, "sha256": "1" * 64}]).save(user_path)
+    return core_path, user_path
+
+
+def test_merge_remaps_codenames(libraries, workdir):
+    core_path, user_path = libraries
+    save_path = str(workdir / "merged.h5")
+    codename_map, missing = kpl_engine.merge_libraries(core_path, user_path, save_path=save_path,
+                                                       echo=lambda message: None)
+    # matched records join the core record, new ones get the next core codenames (and are matched in the same merge),
+    # the updated core record replaces its old version
+    assert codename_map == {"MX00010": "MX00000", "MX00011": "MX00002", "MX00012": "MX00002", "MX00001": "MX00001"}
+    assert missing == []
+    merged = KPLLibrary.load(save_path)
+    assert merged.database["Codename"].tolist() == ["MX00000", "MX00001", "MX00002"]
+    assert [sorted(found) for found in merged.database["Found"]] == [["a", "u"], ["a", "b"], ["u", "v"]]
+    assert merged.new_codename() == "MX00003"
+    # the manifest of the user's library is merged with the whole library only
+    assert [entry["file"] for entry in merged.manifest.entries] == ["u.txt"]
+
+
+def test_merge_selected_codenames_reports_missing(libraries, workdir):
+    core_path, user_path = libraries
+    codename_map, missing = kpl_engine.merge_libraries(core_path, user_path, ["MX0001?", "MX99999", "NO*"],
+                                                       echo=lambda message: None)
+    assert codename_map == {"MX00010": "MX00000", "MX00011": "MX00002", "MX00012": "MX00002"}
+    assert missing == ["MX99999", "NO*"]
+    assert KPLLibrary.load(core_path).new_codename() == "MX00002"
+
+
+def test_merge_without_found_codename_keeps_core(libraries, workdir):
+    core_path, user_path = libraries
+    save_path = str(workdir / "merged.h5")
+    codename_map, missing = kpl_engine.merge_libraries(core_path, user_path, ["MX99999"], save_path,
+                                                       echo=lambda message: None)
+    assert (codename_map, missing) == ({}, ["MX99999"])
+    assert not os.path.exists(save_path)
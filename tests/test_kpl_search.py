@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Tests of the spectral search: top-k of the sparse products against dense scoring of every record."""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import helper
+import kpl_engine
+import kpl_search
+from kpl_library import KPLLibrary, SpectraMatrix
+
+
+def _spectrum(rng, base: dict = None) -> dict:
+    """Random spectrum, or a noisy copy of the base spectrum."""
+    if base is not None:
+        return {mass: round(value * rng.uniform(0.6, 1.4), 1) for mass, value in base.items()}
+    masses = rng.choice(np.arange(31, 200), size=int(rng.integers(3, 12)), replace=False)
+    return {int(mass): round(float(rng.uniform(1, 1000)), 1) for mass in masses}
+
+
+def _text(spectrum: dict) -> str:
+    """Spectrum in the notation of ChromaTOF."""
+    return " ".join(f"{mass}:{value}" for mass, value in spectrum.items())
+
+
+@pytest.fixture(params=["DOT", "Pearson"])
+def similarity(request, workdir):
+    """Similarity method of the config file."""
+    path = workdir / "config.txt"
+    config = json.loads(path.read_text())
+    config["sim_compare"] = request.param
+    path.write_text(json.dumps(config))
+    # the parsed config is cached by the modification time
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1))
+    return request.param
+
+
+@pytest.fixture
+def library(workdir, make_record):
+    """Spectra of a library saved as .kplc and its path."""
+    rng = np.random.default_rng(11)
+    spectra = [_spectrum(rng) for _ in range(60)]
+    records = [make_record(f"MX{row:05d}", 100.0 + row, 1.0, spectrum) for row, spectrum in enumerate(spectra)]
+    path = str(workdir / "library.kplc")
+    KPLLibrary(pd.DataFrame(records)).save(path)
+    return spectra, path
+
+
+@pytest.mark.parametrize("block_entries", [kpl_search.BLOCK_ENTRIES, 150])
+def test_search_matches_dense_scoring(library, similarity, monkeypatch, block_entries):
+    monkeypatch.setattr(kpl_search, "BLOCK_ENTRIES", block_entries)
+    spectra, path = library
+    rng = np.random.default_rng(12)
+    queries = [_spectrum(rng, spectra[row]) for row in range(0, 60, 3)] + [_spectrum(rng) for _ in range(10)]
+    sparse = kpl_search.SparseSpectra.from_library(path, chunk_records=7)
+    records, scores = sparse.search(helper.parse_spectra(pd.Series([_text(query) for query in queries])), 3, 50)
+    dense = SpectraMatrix(spectra, helper.load_config()["transformation"])
+    for peak, query in enumerate(queries):
+        expected = dense.score(query, np.arange(len(spectra)))
+        best = [row for row in np.lexsort((np.arange(len(spectra)), -expected)) if expected[row] > 50][:3]
+        assert records[peak, :len(best)].tolist() == best
+        np.testing.assert_allclose(scores[peak, :len(best)], expected[best], atol=0.01)
+        # peaks with fewer hits are padded
+        assert (records[peak, len(best):] == -1).all()
+        assert np.isnan(scores[peak, len(best):]).all()
+    assert (records[:20, 0] == np.arange(0, 60, 3)).all()
+
+
+def test_search_library_writes_hits(library, workdir, write_export):
+    spectra, path = library
+    (workdir / "input").mkdir()
+    (workdir / "output").mkdir()
+    write_export(workdir / "input" / "sample.txt", [("peak 1", 130.0, 1.5, spectra[30]),
+                                                    ("peak 2", 400.0, 2.5, {31: 1.0, 250: 5.0})])
+    kpl_engine.search_library(path, str(workdir / "input"), str(workdir / "output"), top=2, echo=lambda message: None,
+                              cache=False)
+    searched = pd.read_csv(workdir / "output" / "searched_sample.txt", sep="\t", keep_default_na=False)
+    assert searched.columns.tolist()[-4:] == ["Hit 1", "Similarity 1", "Hit 2", "Similarity 2"]
+    assert searched["Hit 1"].tolist() == ["MX00030", ""]
+    assert float(searched.at[0, "Similarity 1"]) == pytest.approx(100)
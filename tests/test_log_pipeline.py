@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+"""Tests of the logging pipeline shared by the tools."""
+import os
+import subprocess
+import sys
+
+COMMON = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common")
+SCRIPT = """
+import logging, sys
+sys.path.insert(0, {common!r})
+import log_pipeline
+log_pipeline.setup([logging.FileHandler({log!r}, mode="w")])
+logging.info("Record %d.", 1)
+logging.debug("Dropped.")
+"""
+
+
+def test_records_are_written_at_exit(tmp_path):
+    log = tmp_path / "run.log"
+    result = subprocess.run([sys.executable, "-c", SCRIPT.format(common=COMMON, log=str(log))],
+                            capture_output=True, text=True)
+    assert result.returncode == 0
+    assert result.stderr == ""
+    assert log.read_text().splitlines()[-1].endswith("Record 1.")
+    assert "Dropped." not in log.read_text()